@@ -0,0 +1,154 @@
+"""
+In-process execution of the sub-requests of ``POST /api/batch/``.
+
+Each sub-request is resolved against the API URLs and handed straight to
+its view, skipping the middleware stack. The batch's already authenticated
+user is forced onto it, so the JWT is decoded and the user loaded once per
+batch, and the tenant shard chosen for the batch stays active. Within a
+batch, identical GETs run once; any write clears that cache so later reads
+see its effect.
+
+Sub-requests run in order. With ``concurrent``, each run of consecutive
+GETs is spread over up to BATCH_MAX_WORKERS threads; writes always run
+alone, in order.
+"""
+import contextvars
+import io
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = 'api/'
+METHODS = {'GET', 'POST', 'PUT', 'PATCH', 'DELETE'}
+# Unauthenticated endpoints and the batch endpoint itself
+EXCLUDED_VIEWS = {'api_batch', 'token_obtain_pair', 'token_refresh', 'api_register', 'api_login'}
+FORWARDED_HEADERS = ('Location', 'Retry-After')
+
+
+class BatchItemError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def parse_item(item):
+    """``(method, path, query string, body)`` of a sub-request, or raises BatchItemError."""
+    if not isinstance(item, dict):
+        raise BatchItemError(400, 'Expected an object with method and path.')
+    method = str(item.get('method', 'GET')).upper()
+    if method not in METHODS:
+        raise BatchItemError(405, f'Method {method} is not allowed.')
+    url = item.get('path')
+    if not isinstance(url, str) or not url.startswith('/'):
+        raise BatchItemError(400, 'path must be an absolute path such as /api/forms/.')
+    parts = urlsplit(url)
+    return method, parts.path, parts.query, item.get('body')
+
+
+def build_request(batch_request, method, path, query, body):
+    request = HttpRequest()
+    request.method = method
+    request.path = request.path_info = path
+    request.META = dict(batch_request.META)
+    request.META.update({'REQUEST_METHOD': method, 'PATH_INFO': path, 'QUERY_STRING': query})
+    request.GET = QueryDict(query)
+    data = b'' if body is None else json.dumps(body).encode()
+    request.META['CONTENT_TYPE'] = 'application/json'
+    request.META['CONTENT_LENGTH'] = str(len(data))
+    request._stream = io.BytesIO(data)
+    request._read_started = False
+    request.user = batch_request.user
+    # Picked up by rest_framework.request.Request in place of the view's authenticators
+    request._force_auth_user = batch_request.user
+    request._force_auth_token = batch_request.auth
+    return request
+
+
+def dispatch(batch_request, item):
+    """Run one sub-request; returns its ``{'status', 'body'[, 'headers']}`` result."""
+    try:
+        method, path, query, body = parse_item(item)
+        try:
+            match = resolve(path)
+        except Resolver404:
+            raise BatchItemError(404, 'No API endpoint at this path.')
+        if not match.route.startswith(API_PREFIX) or match.url_name in EXCLUDED_VIEWS:
+            raise BatchItemError(400, 'This endpoint cannot be called in a batch.')
+        response = match.func(build_request(batch_request, method, path, query, body), *match.args, **match.kwargs)
+        try:
+            if response.streaming:
+                raise BatchItemError(400, 'Streaming responses, such as exports, cannot be batched.')
+            content = response.data if hasattr(response, 'data') else response.content.decode()
+        finally:
+            response.close()
+    except BatchItemError as exc:
+        return {'status': exc.status, 'body': {'error': exc.message}}
+    except Exception:
+        logger.exception('Batch sub-request %r failed', item)
+        return {'status': 500, 'body': {'error': 'Internal server error'}}
+    result = {'status': response.status_code, 'body': content}
+    headers = {name: response[name] for name in FORWARDED_HEADERS if response.has_header(name)}
+    if headers:
+        result['headers'] = headers
+    return result
+
+
+def _cache_key(item):
+    if isinstance(item, dict) and str(item.get('method', 'GET')).upper() == 'GET':
+        return item.get('path')
+    return None
+
+
+def _run_in_thread(context, batch_request, item):
+    try:
+        return context.run(dispatch, batch_request, item)
+    finally:
+        # Worker threads open their own connections
+        connections.close_all()
+
+
+def run_batch(batch_request, items, concurrent=False):
+    results = [None] * len(items)
+    cache = {}
+    max_workers = getattr(settings, 'BATCH_MAX_WORKERS', 4)
+
+    def run_reads(indexes):
+        pending = {}
+        for i in indexes:
+            key = _cache_key(items[i])
+            if key not in cache:
+                pending.setdefault(key, i)
+        if concurrent and len(pending) > 1:
+            with ThreadPoolExecutor(max_workers=min(max_workers, len(pending))) as pool:
+                futures = {
+                    key: pool.submit(_run_in_thread, contextvars.copy_context(), batch_request, items[i])
+                    for key, i in pending.items()
+                }
+                cache.update((key, future.result()) for key, future in futures.items())
+        else:
+            cache.update((key, dispatch(batch_request, items[i])) for key, i in pending.items())
+        for i in indexes:
+            results[i] = cache[_cache_key(items[i])]
+
+    reads = []
+    for i, item in enumerate(items):
+        if _cache_key(item) is not None:
+            reads.append(i)
+            continue
+        if reads:
+            run_reads(reads)
+            reads = []
+        results[i] = dispatch(batch_request, item)
+        cache.clear()
+    if reads:
+        run_reads(reads)
+    return results
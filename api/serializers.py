@@ -1,5 +1,7 @@
 from rest_framework import serializers
-from employees.models import CustomUser, FormTemplate, FormField, Employee, EmployeeData
+from employees.models import (
+    CustomUser, FormTemplate, FormField, Employee, EmployeeData, ArchivedEmployee, Job, ChangeLogEntry,
+)
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True)
@@ -41,14 +43,25 @@ class FormTemplateSerializer(serializers.ModelSerializer):
 class FormFieldSerializer(serializers.ModelSerializer):
     class Meta:
         model = FormField
-        fields = ('id', 'form_template', 'label', 'field_type', 'required', 'order')
+        fields = ('id', 'form_template', 'label', 'field_type', 'required', 'is_key', 'order')
         read_only_fields = ('id', 'order')
 
 class EmployeeSerializer(serializers.ModelSerializer):
     class Meta:
         model = Employee
-        fields = ('id', 'form_template', 'created_by', 'created_at', 'updated_at')
-        read_only_fields = ('created_by', 'created_at', 'updated_at')
+        fields = ('id', 'form_template', 'fingerprint', 'created_by', 'created_at', 'updated_at')
+        read_only_fields = ('fingerprint', 'created_by', 'created_at', 'updated_at')
+
+class ArchivedEmployeeSerializer(serializers.ModelSerializer):
+    archived = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = ArchivedEmployee
+        fields = ('id', 'form_template', 'created_by', 'created_at', 'updated_at', 'archived', 'archived_at')
+        read_only_fields = fields
+    
+    def get_archived(self, obj):
+        return True
 
 class EmployeeDataSerializer(serializers.ModelSerializer):
     field_label = serializers.CharField(source='field.label', read_only=True)
@@ -57,4 +70,18 @@ class EmployeeDataSerializer(serializers.ModelSerializer):
     class Meta:
         model = EmployeeData
         fields = ('id', 'employee', 'field', 'field_label', 'field_type', 'value')
-        read_only_fields = ('employee', 'field_label', 'field_type')
\ No newline at end of file
+        read_only_fields = ('employee', 'field_label', 'field_type')
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = ('id', 'task', 'status', 'attempts', 'max_attempts', 'run_at', 'result', 'last_error', 'created_at', 'finished_at')
+        read_only_fields = fields
+
+class ChangeLogEntrySerializer(serializers.ModelSerializer):
+    seq = serializers.IntegerField(source='id', read_only=True)
+    
+    class Meta:
+        model = ChangeLogEntry
+        fields = ('seq', 'model', 'object_id', 'action', 'data', 'created_at')
+        read_only_fields = fields
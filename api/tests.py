@@ -1,3 +1,217 @@
+import io
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from django.core.management import call_command
 from django.test import TestCase
+from rest_framework.test import APIRequestFactory, force_authenticate
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from employee_portal.admission import gates
+from api.views import FormReportAPIView
+from employees.models import ChangeLogEntry, CustomUser, Employee, FormField, FormTemplate
+from employees.sharding import current_shard, use_shard
+from employees.storage import write_values
+
+
+class APITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        cls.name = FormField.objects.create(form_template=cls.template, label='Name', field_type='text')
+
+    def setUp(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def add_employee(self, name):
+        employee = Employee.objects.create(form_template=self.template, created_by=self.user)
+        write_values(employee, {self.name.pk: name})
+        return employee
+
+
+class AdmissionTests(APITestCase):
+    def test_streaming_export_holds_its_slot_until_closed(self):
+        self.add_employee('Ada')
+        heavy = gates['heavy']
+        response = self.client.get(f'/api/forms/{self.template.pk}/report/?export=csv', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(heavy.active, 1)
+        body = b''.join(response.streaming_content).decode()
+        self.assertIn('Ada', body)
+        response.close()
+        self.assertEqual(heavy.active, 0)
+
+    async def test_async_streaming_export_holds_its_slot_until_closed(self):
+        await sync_to_async(self.add_employee)('Ada')
+        heavy = gates['heavy']
+        response = await self.async_client.get(f'/api/forms/{self.template.pk}/report/?export=csv',
+                                               headers={'Authorization': self.auth['HTTP_AUTHORIZATION']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(heavy.active, 1)
+        # The export's body is a plain generator reading the database
+        body = await sync_to_async(b''.join)(response.streaming_content)
+        self.assertIn('Ada', body.decode())
+        await sync_to_async(response.close)()
+        self.assertEqual(heavy.active, 0)
+
+
+class EmployeeCreateTests(APITestCase):
+    def create(self, body):
+        return self.client.post('/api/employees/', body, content_type='application/json', **self.auth)
+
+    def test_required_fields_enforced_without_values(self):
+        response = self.create({'form_template': self.template.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(str(self.name.pk), response.json()['values'])
+        self.assertFalse(Employee.objects.exists())
+
+    def test_create_with_values(self):
+        response = self.create({'form_template': self.template.pk, 'values': {str(self.name.pk): 'Ada'}})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Employee.objects.get().data.get().value, 'Ada')
+
+    def test_values_optional_when_nothing_is_required(self):
+        FormField.objects.filter(pk=self.name.pk).update(required=False)
+        self.assertEqual(self.create({'form_template': self.template.pk}).status_code, 201)
+
+
+class DuplicateTests(APITestCase):
+    def check(self, body):
+        return self.client.post(f'/api/forms/{self.template.pk}/duplicates/', body, content_type='application/json',
+                                **self.auth)
+
+    def test_non_object_body_is_rejected(self):
+        for body in ([1, 2], 'text', 3):
+            self.assertEqual(self.check(body).status_code, 400, body)
+
+    def test_finds_employees_with_the_same_key(self):
+        FormField.objects.filter(pk=self.name.pk).update(is_key=True)
+        employee = self.add_employee('Ada')
+        body = self.check({'values': {str(self.name.pk): 'Ada'}}).json()
+        self.assertTrue(body['is_duplicate'])
+        self.assertEqual(body['duplicates'], [employee.pk])
+        self.assertFalse(self.check({'values': {str(self.name.pk): 'Grace'}}).json()['is_duplicate'])
+
+
+class ChangeFeedTests(APITestCase):
+    def feed(self, since=None, limit=None):
+        params = {key: value for key, value in (('since', since), ('limit', limit)) if value is not None}
+        return self.client.get('/api/changes/', params, **self.auth)
+
+    def test_pages_through_own_changes(self):
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='x')
+        FormTemplate.objects.create(name='Theirs', created_by=other)
+        employee = self.add_employee('Ada')
+        body = self.feed(limit=2).json()
+        self.assertEqual([change['model'] for change in body['changes']], ['form_template', 'form_field'])
+        self.assertTrue(body['has_more'])
+        body = self.feed(body['next_since']).json()
+        self.assertEqual([(change['model'], change['action']) for change in body['changes']],
+                         [('employee', 'insert'), ('employee_data', 'insert')])
+        self.assertEqual(body['changes'][0]['object_id'], employee.pk)
+        self.assertFalse(body['has_more'])
+        # Caught up: the cursor moves past other users' entries
+        body = self.feed(body['next_since']).json()
+        self.assertEqual((body['changes'], body['next_since']), ([], body['latest_seq']))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.feed('abc').status_code, 400)
+        self.assertEqual(self.feed(limit='x').status_code, 400)
+
+    def test_unknown_sequence_number_requires_resync(self):
+        response = self.feed(ChangeLogEntry.objects.latest('id').id + 100)
+        self.assertEqual(response.status_code, 410)
+
+    def test_bootstrap_after_compaction(self):
+        self.add_employee('Ada')
+        latest = ChangeLogEntry.objects.latest('id').id
+        call_command('compact_changes', '--before-seq', latest, stdout=io.StringIO())
+        for since in (None, 0, latest - 2):
+            response = self.feed(since)
+            self.assertEqual(response.status_code, 410, since)
+            self.assertEqual(response.json()['resync_since'], latest)
+        # The client reloads its state, then follows the feed from the cursor
+        body = self.feed(latest).json()
+        self.assertEqual(body['changes'], [])
+        employee = self.add_employee('Grace')
+        body = self.feed(latest).json()
+        self.assertEqual(body['changes'][0]['object_id'], employee.pk)
+
+
+class BatchTests(APITestCase):
+    def test_non_object_body_is_rejected(self):
+        for body in ([1, 2], 'text', 3):
+            response = self.client.post('/api/batch/', body, content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 400, body)
+
+    def test_runs_requests(self):
+        response = self.client.post('/api/batch/', {'requests': [{'method': 'GET', 'path': '/api/forms/'}]},
+                                    content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['responses'][0]['status'], 200)
+
+    def test_streaming_sub_response_is_refused(self):
+        self.add_employee('Ada')
+        response = self.client.post('/api/batch/', {'requests': [
+            {'method': 'GET', 'path': f'/api/forms/{self.template.pk}/report/?export=csv'},
+            {'method': 'GET', 'path': '/api/forms/'},
+        ]}, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['status'] for item in response.json()['responses']], [400, 200])
+        self.assertIn('cannot be batched', response.json()['responses'][0]['body']['error'])
+
+
+class EmployeeDataTests(APITestCase):
+    def test_non_object_body_is_rejected(self):
+        employee = self.add_employee('Ada')
+        for method in (self.client.patch, self.client.put):
+            for body in ([1, 2], 'text', {'values': [1]}):
+                response = method(f'/api/employees/{employee.pk}/data/', body, content_type='application/json',
+                                  **self.auth)
+                self.assertEqual(response.status_code, 400, body)
+
+    def test_updates_values(self):
+        employee = self.add_employee('Ada')
+        response = self.client.patch(f'/api/employees/{employee.pk}/data/', {'values': {str(self.name.pk): 'Grace'}},
+                                     content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['changed'], [self.name.pk])
+        self.assertEqual(employee.data.get().value, 'Grace')
+
+
+class EmployeeBulkDataTests(APITestCase):
+    def test_non_object_body_is_rejected(self):
+        for method in (self.client.patch, self.client.put):
+            response = method('/api/employees/data/', [1, 2], content_type='application/json', **self.auth)
+            self.assertEqual(response.status_code, 400)
+
+    def test_updates_values(self):
+        employee = self.add_employee('Ada')
+        response = self.client.patch('/api/employees/data/', {
+            'employees': [{'id': employee.pk, 'values': {str(self.name.pk): 'Grace'}}],
+        }, content_type='application/json', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(employee.data.get().value, 'Grace')
+
+
+class ReportExportTests(APITestCase):
+    def test_csv_rows_read_from_the_request_shard(self):
+        # TenantMiddleware's shard is gone by the time the body is streamed
+        seen = []
+
+        def export(*args):
+            seen.append(current_shard())
+            yield {'id': 1, 'created_at': self.template.created_at, 'values': {self.name.pk: 'Ada'}}
 
-# Create your tests here.
+        request = APIRequestFactory().get(f'/api/forms/{self.template.pk}/report/', {'export': 'csv'})
+        force_authenticate(request, self.user)
+        with mock.patch('api.views.export', export):
+            with use_shard('shard_1'):
+                response = FormReportAPIView.as_view()(request, template_pk=self.template.pk)
+            self.assertIsNone(current_shard())
+            body = b''.join(response.streaming_content).decode()
+        self.assertEqual(seen, ['shard_1'])
+        self.assertIn('Ada', body)
+        self.assertIsNone(current_shard())
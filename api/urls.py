@@ -6,8 +6,10 @@ from rest_framework_simplejwt.views import (
 from .views import (
     UserRegisterAPIView, UserLoginAPIView,
     FormTemplateAPIView, FormTemplateDetailAPIView,
-    FormFieldAPIView, FormFieldDetailAPIView,
-    EmployeeAPIView, EmployeeDetailAPIView,
+    FormFieldAPIView, FormFieldDetailAPIView, FieldValueCountsAPIView, DuplicateAPIView,
+    FormReportAPIView, FieldStatsAPIView, FieldSuggestAPIView,
+    EmployeeAPIView, EmployeeDetailAPIView, EmployeeDataAPIView, EmployeeBulkDataAPIView,
+    JobDetailAPIView, ChangeFeedAPIView, BatchAPIView,
 )
 
 urlpatterns = [
@@ -21,7 +23,18 @@ urlpatterns = [
     path('forms/<int:pk>/', FormTemplateDetailAPIView.as_view(), name='api_form_detail'),
     path('forms/<int:template_pk>/fields/', FormFieldAPIView.as_view(), name='api_fields'),
     path('forms/<int:template_pk>/fields/<int:pk>/', FormFieldDetailAPIView.as_view(), name='api_field_detail'),
+    path('forms/<int:template_pk>/fields/<int:pk>/values/', FieldValueCountsAPIView.as_view(), name='api_field_values'),
+    path('forms/<int:template_pk>/fields/<int:pk>/stats/', FieldStatsAPIView.as_view(), name='api_field_stats'),
+    path('fields/<int:pk>/suggest/', FieldSuggestAPIView.as_view(), name='api_field_suggest'),
+    path('forms/<int:template_pk>/duplicates/', DuplicateAPIView.as_view(), name='api_duplicates'),
+    path('forms/<int:template_pk>/report/', FormReportAPIView.as_view(), name='api_form_report'),
     
     path('employees/', EmployeeAPIView.as_view(), name='api_employees'),
+    path('employees/data/', EmployeeBulkDataAPIView.as_view(), name='api_employee_data_bulk'),
     path('employees/<int:pk>/', EmployeeDetailAPIView.as_view(), name='api_employee_detail'),
+    path('employees/<int:pk>/data/', EmployeeDataAPIView.as_view(), name='api_employee_data'),
+
+    path('jobs/<int:pk>/', JobDetailAPIView.as_view(), name='api_job_detail'),
+    path('changes/', ChangeFeedAPIView.as_view(), name='api_changes'),
+    path('batch/', BatchAPIView.as_view(), name='api_batch'),
 ]
\ No newline at end of file
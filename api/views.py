@@ -3,16 +3,43 @@ from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+import csv
+
+from django.conf import settings
+from django.http import StreamingHttpResponse
 from django.contrib.auth import authenticate
+from django.urls import reverse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from employees.models import FormTemplate, FormField, Employee, EmployeeData
+from employees.models import FormTemplate, FormField, Employee, ArchivedEmployee, Job
+from employees.archive import archived_field_rows
+from employees.deletion import delete_employee, delete_field, delete_template
+from employees.storage import field_rows, filter_value, update_values, value_counts, write_values
+from employees.validation import compile_template
+from employees.fingerprints import duplicate_groups, find_duplicates
+from employees.changes import changes_since, seq_bounds, seq_floor
+from employees.reports import export, field_stats, report
+from employees.sharding import current_shard, use_shard
+from employees.suggest import suggest, suggestible
+from .batch import run_batch
 from .serializers import (
     UserSerializer, FormTemplateSerializer, FormFieldSerializer,
-    EmployeeSerializer, EmployeeDataSerializer
+    EmployeeSerializer, ArchivedEmployeeSerializer, JobSerializer, ChangeLogEntrySerializer
 )
 
 
+def job_accepted_response(request, job):
+    """202 response for work handed to the job queue, pointing at its status URL."""
+    status_url = request.build_absolute_uri(reverse('api_job_detail', args=[job.pk]))
+    response = Response(
+        {'job_id': job.pk, 'status': job.status, 'status_url': status_url},
+        status=status.HTTP_202_ACCEPTED
+    )
+    response['Location'] = status_url
+    return response
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class UserRegisterAPIView(APIView):
     permission_classes = [AllowAny]
@@ -50,7 +77,6 @@ class UserLoginAPIView(APIView):
         
         user = authenticate(email=email, password=password)
         if user:
-            from rest_framework_simplejwt.tokens import RefreshToken
             refresh = RefreshToken.for_user(user)
             return Response({
                 'refresh': str(refresh),
@@ -114,7 +140,9 @@ class FormTemplateDetailAPIView(APIView):
         template = self.get_object(pk, request.user)
         if not template:
             return Response({'error': 'Not found'}, status=status.HTTP_404_NOT_FOUND)
-        template.delete()
+        job = delete_template(template, user=request.user)
+        if job:
+            return job_accepted_response(request, job)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -214,28 +242,237 @@ class FormFieldDetailAPIView(APIView):
         field = self.get_object(template_pk, pk, request.user)
         if not field:
             return Response({'error': 'Field not found'}, status=status.HTTP_404_NOT_FOUND)
-        field.delete()
+        job = delete_field(field, user=request.user)
+        if job:
+            return job_accepted_response(request, job)
         return Response(status=status.HTTP_204_NO_CONTENT)
     
 
+@method_decorator(csrf_exempt, name='dispatch')
+class FieldValueCountsAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, template_pk, pk):
+        """How many employees have each value of a field"""
+        try:
+            field = FormField.objects.get(pk=pk, form_template_id=template_pk, form_template__created_by=request.user)
+        except FormField.DoesNotExist:
+            return Response({'error': 'Field not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'values': [{'value': value, 'count': n} for value, n in value_counts(field)]})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class DuplicateAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_groups = 1000
+    
+    def get_template(self, template_pk, user):
+        try:
+            return FormTemplate.objects.get(pk=template_pk, created_by=user)
+        except FormTemplate.DoesNotExist:
+            return None
+    
+    def get(self, request, template_pk):
+        """Groups of employees whose key fields match"""
+        template = self.get_template(template_pk, request.user)
+        if not template:
+            return Response({'error': 'Template not found'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 100)), self.max_groups))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'groups': duplicate_groups(template, limit)})
+    
+    def post(self, request, template_pk):
+        """Existing employees that ``values`` would duplicate, checked before creating it"""
+        template = self.get_template(template_pk, request.user)
+        if not template:
+            return Response({'error': 'Template not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not isinstance(request.data, dict):
+            return Response({'error': 'The request body must be a JSON object'}, status=status.HTTP_400_BAD_REQUEST)
+        values, errors = validate_values(template, request.data.get('values'), partial=True)
+        if errors:
+            return Response({'values': errors}, status=status.HTTP_400_BAD_REQUEST)
+        fingerprint, duplicates = find_duplicates(template, values)
+        return Response({'fingerprint': fingerprint, 'duplicates': duplicates, 'is_duplicate': bool(duplicates)})
+
+
+def report_filters(request):
+    """``{field_id: value}`` from the ``field_<id>=<value>`` query parameters."""
+    return {
+        int(param[6:]): value for param, value in request.query_params.items()
+        if param.startswith('field_') and param[6:].isdigit()
+    }
+
+
+class Echo:
+    """A file-like object for csv.writer that hands each line back."""
+
+    def write(self, value):
+        return value
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FormReportAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_limit = 1000
+    
+    def get(self, request, template_pk):
+        """
+        The template's employees with their values, filtered by
+        ``field_<id>=<value>`` and sorted by ``sort=<field id>`` (``-`` for
+        descending). ``export=csv`` streams every matching row instead of a page.
+        """
+        try:
+            template = FormTemplate.objects.get(pk=template_pk, created_by=request.user)
+        except FormTemplate.DoesNotExist:
+            return Response({'error': 'Template not found'}, status=status.HTTP_404_NOT_FOUND)
+        sort = request.query_params.get('sort', '')
+        descending = sort.startswith('-')
+        try:
+            sort_field = int(sort.lstrip('-')) if sort else None
+            limit = max(1, min(int(request.query_params.get('limit', 50)), self.max_limit))
+            offset = max(0, int(request.query_params.get('offset', 0)))
+        except ValueError:
+            return Response({'error': 'sort, limit and offset must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        filters = report_filters(request)
+        
+        if request.query_params.get('export') == 'csv':
+            fields = list(template.fields.order_by('order', 'id'))
+            writer = csv.writer(Echo())
+            # The rows are read after TenantMiddleware has returned, so keep
+            # reading from this request's shard
+            alias = current_shard()
+
+            def rows():
+                with use_shard(alias):
+                    yield from export(template, request.user, filters, sort_field, descending)
+
+            lines = (
+                writer.writerow([row['id'], row['created_at'].isoformat()] + [row['values'].get(f.pk) for f in fields])
+                for row in rows()
+            )
+            header = writer.writerow(['id', 'created_at'] + [f.label for f in fields])
+            response = StreamingHttpResponse(
+                (line for chunk in ([header], lines) for line in chunk), content_type='text/csv'
+            )
+            response['Content-Disposition'] = f'attachment; filename="template-{template.pk}.csv"'
+            return response
+        
+        count, rows = report(template, request.user, filters, sort_field, descending, limit, offset)
+        return Response({'count': count, 'results': rows})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FieldStatsAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, template_pk, pk):
+        """Count, distinct, min, max, average and top values of a field, filtered like the report"""
+        try:
+            field = FormField.objects.select_related('form_template').get(
+                pk=pk, form_template_id=template_pk, form_template__created_by=request.user
+            )
+        except FormField.DoesNotExist:
+            return Response({'error': 'Field not found'}, status=status.HTTP_404_NOT_FOUND)
+        stats = field_stats(field.form_template, request.user, field, report_filters(request))
+        stats['top'] = [{'value': value, 'count': n} for value, n in stats['top']]
+        return Response(stats)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class FieldSuggestAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, pk):
+        """The most common stored values of a field starting with ``prefix``"""
+        try:
+            field = FormField.objects.get(pk=pk, form_template__created_by=request.user)
+        except FormField.DoesNotExist:
+            return Response({'error': 'Field not found'}, status=status.HTTP_404_NOT_FOUND)
+        if not suggestible(field):
+            return Response({'error': f'No suggestions for {field.field_type} fields'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = max(1, int(request.query_params.get('limit', 10)))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        prefix = request.query_params.get('prefix', '')
+        return Response({
+            'prefix': prefix,
+            'suggestions': [{'value': value, 'count': n} for value, n in suggest(field, prefix, limit)],
+        })
+
+
+def validate_values(template, values, partial=False):
+    """
+    ``(cleaned values, errors)`` for the ``values`` object of a request body.
+    A missing object is validated as empty, so required fields still apply.
+    """
+    if values is None:
+        values = {}
+    if not isinstance(values, dict):
+        return {}, {'non_field_errors': 'Expected an object of field id to value.'}
+    return compile_template(template).validate(values, partial)
+
+
+def clean_changes(template, records, replace):
+    """
+    Validate value changes for employees of ``template``. Each record maps
+    field ids to new values; null or blank removes a value. With
+    ``replace``, fields left out are removed too. Returns the batch result
+    and, per record, ``{field_id: value or None}`` (None if invalid).
+    """
+    validator = compile_template(template)
+    # Blank rather than missing, so blanking a required field is an error
+    records = [{key: '' if value is None else value for key, value in record.items()} for record in records]
+    result = validator.validate_batch(records, partial=not replace)
+    changes = []
+    for record, cleaned in zip(records, result.values):
+        if cleaned is None:
+            changes.append(None)
+            continue
+        changes.append({
+            field_id: cleaned.get(field_id)
+            for field_id, (int_key, str_key), _, _ in validator.columns
+            if replace or int_key in record or str_key in record
+        })
+    return result, changes
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class EmployeeAPIView(APIView):
     authentication_classes = [JWTAuthentication]
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        """List all employees for the current user"""
+        """
+        List all employees for the current user. ``field_<id>=<value>``
+        parameters keep only employees with that exact value.
+        """
         employees = Employee.objects.filter(created_by=request.user)
+        for param, value in request.query_params.items():
+            if param.startswith('field_') and param[6:].isdigit():
+                employees = filter_value(employees, int(param[6:]), value)
         serializer = EmployeeSerializer(employees, many=True)
         return Response(serializer.data)
     
     def post(self, request):
-        """Create a new employee"""
+        """Create a new employee with ``values`` ({field id: value}); required fields must be given"""
         serializer = EmployeeSerializer(data=request.data)
-        if serializer.is_valid():
-            serializer.save(created_by=request.user)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        values, errors = validate_values(serializer.validated_data['form_template'], request.data.get('values'))
+        if errors:
+            return Response({'values': errors}, status=status.HTTP_400_BAD_REQUEST)
+        employee = serializer.save(created_by=request.user)
+        write_values(employee, values)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
 @method_decorator(csrf_exempt, name='dispatch')
@@ -246,25 +483,26 @@ class EmployeeDetailAPIView(APIView):
     def get_object(self, pk, user):
         """Helper method to get employee or return None"""
         try:
-            return Employee.objects.get(pk=pk, created_by=user)
+            return Employee.objects.select_related('form_template').get(pk=pk, created_by=user)
         except Employee.DoesNotExist:
             return None
     
     def get(self, request, pk):
-        """Get employee details"""
+        """Get employee details, including archived employees"""
         employee = self.get_object(pk, request.user)
         if not employee:
-            return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
+            archived = ArchivedEmployee.objects.filter(pk=pk, created_by=request.user).first()
+            if not archived:
+                return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
+            response_data = ArchivedEmployeeSerializer(archived).data
+            response_data['fields_data'] = archived_field_rows(archived)
+            return Response(response_data)
         
         # Get basic employee data
         employee_serializer = EmployeeSerializer(employee)
         
-        # Get all employee data fields
-        employee_data = EmployeeData.objects.filter(employee=employee)
-        data_serializer = EmployeeDataSerializer(employee_data, many=True)
-        
         response_data = employee_serializer.data
-        response_data['fields_data'] = data_serializer.data
+        response_data['fields_data'] = field_rows(employee)
         
         return Response(response_data)
     
@@ -275,10 +513,15 @@ class EmployeeDetailAPIView(APIView):
             return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
         
         serializer = EmployeeSerializer(employee, data=request.data, partial=True)
-        if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        template = serializer.validated_data.get('form_template', employee.form_template)
+        values, errors = validate_values(template, request.data.get('values'), partial=True)
+        if errors:
+            return Response({'values': errors}, status=status.HTTP_400_BAD_REQUEST)
+        employee = serializer.save()
+        write_values(employee, values)
+        return Response(serializer.data)
     
     def delete(self, request, pk):
         """Delete an employee"""
@@ -286,5 +529,184 @@ class EmployeeDetailAPIView(APIView):
         if not employee:
             return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        employee.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        delete_employee(employee)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class EmployeeDataAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def put(self, request, pk):
+        """Replace all values of an employee with ``values``"""
+        return self.apply(request, pk, replace=True)
+    
+    def patch(self, request, pk):
+        """Change only the fields given in ``values``; null removes a value"""
+        return self.apply(request, pk, replace=False)
+    
+    def apply(self, request, pk, replace):
+        try:
+            employee = Employee.objects.select_related('form_template').get(pk=pk, created_by=request.user)
+        except Employee.DoesNotExist:
+            return Response({'error': 'Employee not found'}, status=status.HTTP_404_NOT_FOUND)
+        values = request.data.get('values') if isinstance(request.data, dict) else None
+        if not isinstance(values, dict):
+            return Response({'values': {'non_field_errors': 'Expected an object of field id to value.'}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        result, (changes,) = clean_changes(employee.form_template, [values], replace)
+        if result.error_count:
+            return Response({'values': dict(zip(result.errors['field'], result.errors['message']))},
+                            status=status.HTTP_400_BAD_REQUEST)
+        changed = update_values([(employee, changes)])
+        return Response({
+            'id': employee.pk,
+            'changed': changed.get(employee.pk, []),
+            'fields_data': field_rows(employee),
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class EmployeeBulkDataAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    max_employees = 500
+    
+    def put(self, request):
+        """Replace the values of several employees; see patch()"""
+        return self.apply(request, replace=True)
+    
+    def patch(self, request):
+        """
+        Change values of several employees in one transaction. ``employees``
+        is a list of ``{"id", "values"}``. Nothing is written unless every
+        entry is valid; errors come back as parallel lists keyed by employee.
+        """
+        return self.apply(request, replace=False)
+    
+    def apply(self, request, replace):
+        items = request.data.get('employees') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'employees must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > self.max_employees:
+            return Response({'error': f'At most {self.max_employees} employees per request'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not all(isinstance(item, dict) and isinstance(item.get('values'), dict) for item in items):
+            return Response({'error': 'Each entry needs an id and a values object'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ids = [int(item.get('id')) for item in items]
+        except (TypeError, ValueError):
+            return Response({'error': 'Each entry needs an integer id'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(set(ids)) != len(ids):
+            return Response({'error': 'Each employee may appear only once'}, status=status.HTTP_400_BAD_REQUEST)
+        employees = Employee.objects.select_related('form_template').in_bulk(ids)
+        missing = [pk for pk in ids if pk not in employees or employees[pk].created_by_id != request.user.pk]
+        if missing:
+            return Response({'error': 'Employees not found', 'ids': missing}, status=status.HTTP_404_NOT_FOUND)
+        
+        # Validate each template's employees as one batch
+        by_template = {}
+        for pk, item in zip(ids, items):
+            by_template.setdefault(employees[pk].form_template_id, []).append((pk, item['values']))
+        errors = {'employee': [], 'field': [], 'code': [], 'message': []}
+        changes = []
+        for entries in by_template.values():
+            template = employees[entries[0][0]].form_template
+            result, cleaned = clean_changes(template, [values for _, values in entries], replace)
+            errors['employee'].extend(entries[row][0] for row in result.errors['row'])
+            for key in ('field', 'code', 'message'):
+                errors[key].extend(result.errors[key])
+            changes.extend((employees[pk], values) for (pk, _), values in zip(entries, cleaned))
+        if errors['employee']:
+            return Response({'errors': errors}, status=status.HTTP_400_BAD_REQUEST)
+        changed = update_values(changes)
+        return Response({'updated': len(changed), 'changed': changed})
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class JobDetailAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request, pk):
+        """Status of a background job started by the current user"""
+        try:
+            job = Job.objects.get(pk=pk, created_by=request.user)
+        except Job.DoesNotExist:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(JobSerializer(job).data)
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ChangeFeedAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    default_limit = 100
+    max_limit = 1000
+    
+    def get(self, request):
+        """
+        Changes to the current user's forms and employees after ``since``,
+        oldest first. Keep calling with ``since=next_since`` while ``has_more``.
+        A 410 means changes after ``since`` are no longer in the log, which
+        is also what a new client gets once the log has been compacted:
+        load the current state from the other endpoints, then follow the
+        feed from the ``resync_since`` the 410 carried.
+        """
+        try:
+            since = int(request.query_params.get('since', 0))
+            limit = int(request.query_params.get('limit', self.default_limit))
+        except ValueError:
+            return Response({'error': 'since and limit must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, self.max_limit))
+        
+        oldest, latest = seq_bounds()
+        since = since or seq_floor()
+        # Past ``latest`` means a sequence number from another shard's log,
+        # i.e. the tenant has been moved since the client last synced
+        if since < oldest - 1 or since > latest:
+            return Response(
+                {'error': 'Changes since this sequence number were compacted, resync required',
+                 'latest_seq': latest, 'resync_since': latest},
+                status=status.HTTP_410_GONE
+            )
+        
+        entries = changes_since(request.user, since, limit + 1)
+        has_more = len(entries) > limit
+        entries = entries[:limit]
+        return Response({
+            'changes': ChangeLogEntrySerializer(entries, many=True).data,
+            'next_since': entries[-1].id if entries else max(since, latest),
+            'has_more': has_more,
+            'latest_seq': latest,
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class BatchAPIView(APIView):
+    authentication_classes = [JWTAuthentication]
+    permission_classes = [IsAuthenticated]
+    
+    def post(self, request):
+        """
+        Run several API calls in one round trip. ``requests`` is a list of
+        ``{"method", "path", "body"}``; the response lists each call's
+        ``status`` and ``body`` in the same order. With ``concurrent``,
+        consecutive GETs may run in parallel.
+        """
+        items = request.data.get('requests') if isinstance(request.data, dict) else None
+        if not isinstance(items, list) or not items:
+            return Response({'error': 'requests must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+        max_requests = getattr(settings, 'BATCH_MAX_REQUESTS', 20)
+        if len(items) > max_requests:
+            return Response({'error': f'At most {max_requests} requests per batch'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        results = run_batch(request, items, concurrent=bool(request.data.get('concurrent')))
+        # Echo client ids; deduplicated GETs share one result, so copy
+        results = [
+            dict(result, id=item['id']) if isinstance(item, dict) and 'id' in item else result
+            for item, result in zip(items, results)
+        ]
+        return Response({'responses': results})
@@ -0,0 +1,276 @@
+"""
+Admission control.
+
+Each request is classified by the URL name of its view into one of the
+ADMISSION_CLASSES (``read``, ``write``, ``heavy``) and must get one of that
+class's ``limit`` slots before it runs. At most ``queue`` requests wait for a
+slot per class; a request that would make the queue longer, or that waits
+more than ``timeout`` seconds, is turned away at once with 503 and
+Retry-After instead of piling onto an already saturated worker.
+
+A streaming response (e.g. a CSV export) keeps its slot until the server
+has sent the body and closed the response.
+
+The middleware runs on either handler. Under ASGI a waiting request awaits
+an asyncio semaphore (one per event loop) instead of holding a thread; the
+queue length, timeout and counters are the same. Django only runs it async
+when every middleware below it can run async too, so keep those
+async-capable. A process serves one or the other, so the two paths don't
+share their slots.
+
+Limits are per process. ``admission_stats`` (staff only) reports the live
+queue depth and admission/rejection counters of the process that answers.
+Every request that goes through a gate is also counted host-wide by
+employee_portal.traffic.
+"""
+import asyncio
+import math
+import threading
+import time
+import weakref
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+
+from . import traffic
+
+DEFAULT_CLASSES = {
+    'read': {'limit': 16, 'queue': 32, 'timeout': 1.0},
+    'write': {'limit': 4, 'queue': 16, 'timeout': 3.0},
+    'heavy': {'limit': 2, 'queue': 8, 'timeout': 5.0},
+}
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+class Gate:
+    """A counting semaphore with a bounded wait queue and counters."""
+
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.admitted = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+        self._loop_slots = weakref.WeakKeyDictionary()
+
+    def acquire(self):
+        with self._cond:
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                self.admitted += 1
+                return True
+            if self.waiting >= self.queue:
+                self.rejected_full += 1
+                return False
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                admitted = self._cond.wait_for(lambda: self.active < self.limit, self.timeout)
+            finally:
+                self.waiting -= 1
+            if not admitted:
+                self.rejected_timeout += 1
+                return False
+            self.active += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    async def aacquire(self):
+        """
+        acquire() for the async path. Returns the function that gives the slot
+        back (callable from any thread), or None when the request is turned away.
+        """
+        loop = asyncio.get_running_loop()
+        slots = self._loop_slots.get(loop)
+        if slots is None:
+            slots = self._loop_slots[loop] = asyncio.Semaphore(self.limit)
+        if slots.locked():
+            with self._cond:
+                if self.waiting >= self.queue:
+                    self.rejected_full += 1
+                    return None
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+            try:
+                await asyncio.wait_for(slots.acquire(), self.timeout)
+            except asyncio.TimeoutError:
+                with self._cond:
+                    self.rejected_timeout += 1
+                return None
+            finally:
+                with self._cond:
+                    self.waiting -= 1
+        else:
+            # Free slot: acquire() returns without suspending
+            await slots.acquire()
+        with self._cond:
+            self.active += 1
+            self.admitted += 1
+
+        def release():
+            with self._cond:
+                self.active -= 1
+            try:
+                running = asyncio.get_running_loop()
+            except RuntimeError:
+                running = None
+            if running is loop:
+                slots.release()
+            elif not loop.is_closed():
+                # Streaming responses are closed from a worker thread
+                loop.call_soon_threadsafe(slots.release)
+
+        return release
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'queue': self.queue,
+                'timeout': self.timeout,
+                'active': self.active,
+                'waiting': self.waiting,
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'rejected_queue_full': self.rejected_full,
+                'rejected_timeout': self.rejected_timeout,
+            }
+
+
+def _build_gates():
+    classes = getattr(settings, 'ADMISSION_CLASSES', DEFAULT_CLASSES)
+    return {name: Gate(name, **options) for name, options in classes.items()}
+
+
+gates = _build_gates()
+
+
+def classify(request):
+    """The admission class for ``request``, or None when it is exempt."""
+    try:
+        url_name = resolve(request.path_info).url_name
+    except Resolver404:
+        url_name = None
+    if url_name in getattr(settings, 'ADMISSION_EXEMPT_VIEWS', ()):
+        return None
+    if url_name in getattr(settings, 'ADMISSION_HEAVY_VIEWS', ()):
+        return 'heavy'
+    return 'read' if request.method in SAFE_METHODS else 'write'
+
+
+class _HeldContent:
+    """
+    Streaming content that gives back its admission slot when the response
+    is closed: StreamingHttpResponse closes its content's iterator along
+    with the response, whether or not the body was ever read.
+    """
+
+    def __init__(self, content, done):
+        self.content = content
+        self.done = done
+
+    def close(self):
+        self.done()
+
+
+class _SyncHeldContent(_HeldContent):
+    def __iter__(self):
+        return iter(self.content)
+
+
+class _AsyncHeldContent(_HeldContent):
+    def __aiter__(self):
+        return aiter(self.content)
+
+
+class AdmissionControlMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        gate = gates.get(classify(request))
+        if gate is None:
+            return self.get_response(request)
+        started = time.monotonic()
+        if not gate.acquire():
+            return self.busy(gate, started)
+        waited = time.monotonic() - started
+        done = self.finisher(gate.release, started)
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            done()
+            raise
+        return self.admitted(response, gate, waited, done)
+
+    async def __acall__(self, request):
+        gate = gates.get(classify(request))
+        if gate is None:
+            return await self.get_response(request)
+        started = time.monotonic()
+        release = await gate.aacquire()
+        if release is None:
+            return self.busy(gate, started)
+        waited = time.monotonic() - started
+        done = self.finisher(release, started)
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            done()
+            raise
+        return self.admitted(response, gate, waited, done)
+
+    def busy(self, gate, started):
+        traffic.record(time.monotonic() - started)
+        response = JsonResponse({'error': 'Server is busy, try again shortly'}, status=503)
+        response['Retry-After'] = str(max(1, math.ceil(gate.timeout)))
+        return response
+
+    def finisher(self, release, started):
+        released = []
+
+        def done():
+            if not released:
+                released.append(True)
+                release()
+                traffic.record(time.monotonic() - started)
+
+        return done
+
+    def admitted(self, response, gate, waited, done):
+        if response.streaming:
+            # The body is produced after this returns; hold the slot until the
+            # server closes the response
+            held = _AsyncHeldContent if response.is_async else _SyncHeldContent
+            response.streaming_content = held(response.streaming_content, done)
+        else:
+            done()
+        timing = f'admission;desc="{gate.name}";dur={waited * 1000:.1f}'
+        response['Server-Timing'] = ', '.join(filter(None, [response.get('Server-Timing'), timing]))
+        return response
+
+
+@staff_member_required
+def admission_stats(request):
+    return JsonResponse({name: gate.stats() for name, gate in gates.items()})
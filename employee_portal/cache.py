@@ -0,0 +1,291 @@
+"""
+A cache backend shared by every worker process on one host.
+
+The cache is a fixed-size, set-associative hash table in a memory-mapped
+file. A key hashes to one bucket of WAYS slots of SLOT_SIZE bytes each. A
+slot holds one pickled entry, and a full bucket evicts its least recently
+used slot. Values that don't fit in a slot are not cached.
+
+Writers lock their bucket with a POSIX byte-range lock (``lockf``), plus a
+thread lock for the other threads of the same process. Each slot starts
+with a sequence number that is odd while a write is in progress, so readers
+take no locks: they copy the slot and retry if the sequence moved. incr()
+and decr() run under the bucket lock, which makes them safe for rate
+counters.
+
+    CACHES = {
+        "default": {
+            "BACKEND": "employee_portal.cache.MmapCache",
+            "LOCATION": "/var/tmp/employee_portal.cache",
+            "OPTIONS": {"SIZE": 64 * 2**20, "SLOT_SIZE": 2048, "WAYS": 8},
+        }
+    }
+
+Linux/Unix only (fcntl).
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import pickle
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+MAGIC = b'EPMCACHE'
+LAYOUT_VERSION = 1
+HEADER = struct.Struct('<8sIIII')  # magic, layout version, buckets, ways, slot size
+HEADER_SIZE = 64
+SLOT_HEADER = struct.Struct('<QQ')  # sequence, last access (monotonic ns)
+ENTRY = struct.Struct('<QdHI')  # key hash, expiry (0 = never), key length, value length
+ENTRY_OFFSET = SLOT_HEADER.size
+DATA_OFFSET = ENTRY_OFFSET + ENTRY.size
+SEQ = struct.Struct('<Q')
+ATIME = struct.Struct('<Q')
+READ_RETRIES = 100
+LOCK_STRIPES = 64
+
+# One mapping per file and process, shared by the per-thread cache instances
+_mappings = {}
+_mappings_lock = threading.Lock()
+
+
+class _Mapping:
+    def __init__(self, path, buckets, ways, slot_size):
+        self.buckets = buckets
+        self.ways = ways
+        self.slot_size = slot_size
+        self.bucket_size = ways * slot_size
+        size = HEADER_SIZE + buckets * self.bucket_size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(self.fd, fcntl.LOCK_EX)
+        try:
+            header = os.pread(self.fd, HEADER.size, 0)
+            expected = (MAGIC, LAYOUT_VERSION, buckets, ways, slot_size)
+            if os.fstat(self.fd).st_size != size or len(header) < HEADER.size or HEADER.unpack(header) != expected:
+                # New file or a different layout: start empty
+                os.ftruncate(self.fd, 0)
+                os.ftruncate(self.fd, size)
+                os.pwrite(self.fd, HEADER.pack(*expected), 0)
+            self.mm = mmap.mmap(self.fd, size)
+        finally:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        self.locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def slot_offsets(self, bucket):
+        start = HEADER_SIZE + bucket * self.bucket_size
+        return range(start, start + self.bucket_size, self.slot_size)
+
+    @contextmanager
+    def locked(self, bucket):
+        start = HEADER_SIZE + bucket * self.bucket_size
+        with self.locks[bucket % LOCK_STRIPES]:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, self.bucket_size, start)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN, self.bucket_size, start)
+
+    @contextmanager
+    def locked_all(self):
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self.fd, fcntl.LOCK_UN)
+        finally:
+            for lock in self.locks:
+                lock.release()
+
+
+def _get_mapping(path, buckets, ways, slot_size):
+    key = (os.getpid(), path)
+    mapping = _mappings.get(key)
+    if mapping is None:
+        with _mappings_lock:
+            mapping = _mappings.get(key)
+            if mapping is None:
+                mapping = _mappings[key] = _Mapping(path, buckets, ways, slot_size)
+    return mapping
+
+
+class MmapCache(BaseCache):
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._slot_size = options.get('SLOT_SIZE', 2048)
+        self._ways = options.get('WAYS', 8)
+        self._buckets = max(1, options.get('SIZE', 64 * 2**20) // (self._slot_size * self._ways))
+
+    @property
+    def _map(self):
+        return _get_mapping(self._path, self._buckets, self._ways, self._slot_size)
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        # 0 marks an empty slot
+        return int.from_bytes(digest, 'little') or 1
+
+    # Slot access. Readers go through _read(); everything else must hold the
+    # bucket lock.
+
+    def _read(self, mm, offset, key_hash, key_bytes):
+        """``(expiry, value bytes)`` of the entry for the key at ``offset``, or None."""
+        for _ in range(READ_RETRIES):
+            seq = SEQ.unpack_from(mm, offset)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            entry_hash, expiry, key_len, value_len = ENTRY.unpack_from(mm, offset + ENTRY_OFFSET)
+            if entry_hash != key_hash or not key_len:
+                return None
+            start = offset + DATA_OFFSET
+            stored_key = mm[start:start + key_len]
+            value = mm[start + key_len:start + key_len + value_len]
+            if SEQ.unpack_from(mm, offset)[0] == seq:
+                return (expiry, value) if stored_key == key_bytes else None
+        return None
+
+    def _find(self, mm, bucket, key_hash, key_bytes):
+        """Offset of the slot holding the key (lock held), or None."""
+        for offset in self._map.slot_offsets(bucket):
+            entry_hash, _, key_len, _ = ENTRY.unpack_from(mm, offset + ENTRY_OFFSET)
+            if entry_hash == key_hash and key_len:
+                start = offset + DATA_OFFSET
+                if mm[start:start + key_len] == key_bytes:
+                    return offset
+        return None
+
+    def _victim(self, mm, bucket, now):
+        """An empty or expired slot, else the least recently used one (lock held)."""
+        oldest = None
+        for offset in self._map.slot_offsets(bucket):
+            _, atime = SLOT_HEADER.unpack_from(mm, offset)
+            _, expiry, key_len, _ = ENTRY.unpack_from(mm, offset + ENTRY_OFFSET)
+            if not key_len or (expiry and expiry <= now):
+                return offset
+            if oldest is None or atime < oldest[0]:
+                oldest = (atime, offset)
+        return oldest[1]
+
+    def _write(self, mm, offset, key_hash, expiry, key_bytes, value):
+        seq = SEQ.unpack_from(mm, offset)[0]
+        SEQ.pack_into(mm, offset, seq + 1)
+        ENTRY.pack_into(mm, offset + ENTRY_OFFSET, key_hash, expiry, len(key_bytes), len(value))
+        start = offset + DATA_OFFSET
+        mm[start:start + len(key_bytes) + len(value)] = key_bytes + value
+        ATIME.pack_into(mm, offset + 8, time.monotonic_ns())
+        SEQ.pack_into(mm, offset, seq + 2)
+
+    def _erase(self, mm, offset):
+        seq = SEQ.unpack_from(mm, offset)[0]
+        SEQ.pack_into(mm, offset, seq + 1)
+        ENTRY.pack_into(mm, offset + ENTRY_OFFSET, 0, 0.0, 0, 0)
+        SEQ.pack_into(mm, offset, seq + 2)
+
+    def _expiry(self, timeout):
+        expiry = self.get_backend_timeout(timeout)
+        return 0.0 if expiry is None else expiry
+
+    def _locate(self, key, version):
+        key = self.make_and_validate_key(key, version=version)
+        key_hash = self._hash(key)
+        return key_hash, key_hash % self._buckets, key.encode()
+
+    def _store(self, key, value, timeout, version, only_if_missing=False, only_if_present=False):
+        key_hash, bucket, key_bytes = self._locate(key, version)
+        data = pickle.dumps(value, self.pickle_protocol) if not only_if_present else None
+        mapping = self._map
+        mm = mapping.mm
+        with mapping.locked(bucket):
+            now = time.time()
+            offset = self._find(mm, bucket, key_hash, key_bytes)
+            if offset is not None:
+                expiry = ENTRY.unpack_from(mm, offset + ENTRY_OFFSET)[1]
+                live = not expiry or expiry > now
+            else:
+                live = False
+            if (only_if_missing and live) or (only_if_present and not live):
+                return False
+            if only_if_present:
+                # touch(): rewrite the expiry only
+                entry = list(ENTRY.unpack_from(mm, offset + ENTRY_OFFSET))
+                entry[1] = self._expiry(timeout)
+                seq = SEQ.unpack_from(mm, offset)[0]
+                SEQ.pack_into(mm, offset, seq + 1)
+                ENTRY.pack_into(mm, offset + ENTRY_OFFSET, *entry)
+                SEQ.pack_into(mm, offset, seq + 2)
+                return True
+            if DATA_OFFSET + len(key_bytes) + len(data) > self._slot_size:
+                # Too big to cache; make sure a stale value doesn't linger
+                if offset is not None:
+                    self._erase(mm, offset)
+                return False
+            if offset is None:
+                offset = self._victim(mm, bucket, now)
+            self._write(mm, offset, key_hash, self._expiry(timeout), key_bytes, data)
+            return True
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, value, timeout, version, only_if_missing=True)
+
+    def get(self, key, default=None, version=None):
+        key_hash, bucket, key_bytes = self._locate(key, version)
+        mm = self._map.mm
+        for offset in self._map.slot_offsets(bucket):
+            found = self._read(mm, offset, key_hash, key_bytes)
+            if found is None:
+                continue
+            expiry, value = found
+            if expiry and expiry <= time.time():
+                return default
+            # Unlocked; a lost update only makes eviction slightly less exact
+            ATIME.pack_into(mm, offset + 8, time.monotonic_ns())
+            return pickle.loads(value)
+        return default
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self._store(key, value, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self._store(key, None, timeout, version, only_if_present=True)
+
+    def delete(self, key, version=None):
+        key_hash, bucket, key_bytes = self._locate(key, version)
+        mapping = self._map
+        with mapping.locked(bucket):
+            offset = self._find(mapping.mm, bucket, key_hash, key_bytes)
+            if offset is None:
+                return False
+            self._erase(mapping.mm, offset)
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        key_hash, bucket, key_bytes = self._locate(key, version)
+        mapping = self._map
+        mm = mapping.mm
+        with mapping.locked(bucket):
+            offset = self._find(mm, bucket, key_hash, key_bytes)
+            found = offset is not None and self._read(mm, offset, key_hash, key_bytes)
+            if not found or (found[0] and found[0] <= time.time()):
+                raise ValueError("Key '%s' not found" % key)
+            expiry, value = found
+            new_value = pickle.loads(value) + delta
+            self._write(mm, offset, key_hash, expiry, key_bytes, pickle.dumps(new_value, self.pickle_protocol))
+            return new_value
+
+    def clear(self):
+        mapping = self._map
+        with mapping.locked_all():
+            mm = mapping.mm
+            mm[HEADER_SIZE:] = bytes(len(mm) - HEADER_SIZE)
@@ -0,0 +1,144 @@
+"""
+Production media serving.
+
+Full responses go through FileResponse so WSGI servers can hand the file to
+``sendfile`` via ``wsgi.file_wrapper``. Single byte ranges, conditional GETs
+and long-lived caching of content-hashed names are handled here; when
+MEDIA_ACCEL_REDIRECT_PREFIX is set the body is left to the front proxy
+(nginx ``internal`` location) via ``X-Accel-Redirect``.
+"""
+import mimetypes
+import os
+import re
+import stat
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_http_methods
+
+# Names like ``profile_pics/thumbs/310990e7d7492cef_64.webp`` never change
+# content, so they can be cached for good.
+HASHED_NAME_RE = re.compile(r'(^|/)[0-9a-f]{16}_[^/]+$')
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+def _cache_control(path):
+    if HASHED_NAME_RE.search(path):
+        return IMMUTABLE_CACHE_CONTROL
+    return f"public, max-age={getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)}"
+
+
+def _etag(st):
+    return f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+
+
+def _parse_range(header, size):
+    """Return ``(start, end)`` for a single satisfiable byte range, or None."""
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+    else:
+        # Suffix range: the last N bytes
+        start = max(size - int(last), 0)
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def _read_range(path, start, length):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        while length > 0:
+            chunk = fh.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+@require_http_methods(['GET', 'HEAD'])
+def serve_media(request, path):
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404('File not found')
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404('File not found')
+
+    etag = _etag(st)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(st.st_mtime),
+        'Cache-Control': _cache_control(path),
+        'Accept-Ranges': 'bytes',
+    }
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match:
+        not_modified = if_none_match.strip() == '*' or etag in [
+            tag.strip().removeprefix('W/') for tag in if_none_match.split(',')
+        ]
+    else:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        not_modified = since is not None and int(st.st_mtime) <= since
+    if not_modified:
+        response = HttpResponseNotModified()
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type or 'application/octet-stream'
+
+    accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', None)
+    if accel_prefix:
+        # The proxy serves the body, including ranges, from its internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + path.lstrip('/')
+        for name, value in headers.items():
+            response[name] = value
+        return response
+
+    byte_range = None
+    range_header = request.headers.get('Range')
+    if_range = request.headers.get('If-Range')
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, st.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{st.st_size}'
+            return response
+
+    if byte_range:
+        start, end = byte_range
+        length = end - start + 1
+        body = [] if request.method == 'HEAD' else _read_range(fullpath, start, length)
+        response = StreamingHttpResponse(body, status=206, content_type=content_type)
+        response['Content-Range'] = f'bytes {start}-{end}/{st.st_size}'
+        response['Content-Length'] = str(length)
+    elif request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+        response['Content-Length'] = str(st.st_size)
+    else:
+        response = FileResponse(open(fullpath, 'rb'), content_type=content_type)
+
+    if encoding:
+        response['Content-Encoding'] = encoding
+    for name, value in headers.items():
+        response[name] = value
+    return response
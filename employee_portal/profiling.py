@@ -0,0 +1,243 @@
+"""
+On-demand request profiling.
+
+Staff can profile a single request by sending an ``X-Profile: 1`` header or
+a ``_profile=1`` query parameter (session or JWT auth). With
+PROFILE_SAMPLE_RATE > 0, that fraction of all requests is profiled as well.
+
+While the view runs, a sampling thread records the request thread's stack
+every PROFILE_INTERVAL seconds. Every SQL statement is captured with its
+duration; parameters are not stored. The result is saved as one JSON file
+in PROFILE_DIR, which holds at most PROFILE_MAX_FILES profiles (oldest
+removed first). Its ``collapsed`` member is in the folded-stack format that
+flamegraph.pl and speedscope read. Profiled responses carry an
+``X-Profile-Id`` header.
+
+Staff can list and download profiles at ``/admin/profiles/``.
+"""
+import json
+import os
+import random
+import re
+import sys
+import sysconfig
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db import connections
+from django.http import FileResponse, Http404, HttpResponse
+from django.shortcuts import render
+
+PROFILE_ID_RE = re.compile(r'^\d+-[0-9a-f]{8}$')
+STDLIB = sysconfig.get_paths()['stdlib']
+
+
+def profile_dir():
+    return getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+
+
+class StackSampler:
+    """Counts the distinct stacks of one thread, sampled from another."""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    path = code.co_filename
+    if path.startswith(str(settings.BASE_DIR)):
+        path = os.path.relpath(path, settings.BASE_DIR)
+    elif 'site-packages' in path:
+        path = path.split('site-packages' + os.sep, 1)[1]
+    elif path.startswith(STDLIB):
+        path = os.path.relpath(path, STDLIB)
+    return f'{path}:{getattr(code, "co_qualname", code.co_name)}'
+
+
+class QueryLog:
+    """An execute_wrapper recording each statement and its duration."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'db': context['connection'].alias,
+                'sql': sql,
+                'many': many,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def save_profile(profile):
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{profile['id']}.json")
+    with open(path + '.tmp', 'w') as f:
+        json.dump(profile, f)
+    os.replace(path + '.tmp', path)
+    # Keep the ring bounded
+    for stale in list_profile_ids()[getattr(settings, 'PROFILE_MAX_FILES', 50):]:
+        try:
+            os.remove(os.path.join(directory, f'{stale}.json'))
+        except FileNotFoundError:
+            pass
+
+
+def list_profile_ids():
+    """Saved profile ids, newest first."""
+    try:
+        names = os.listdir(profile_dir())
+    except FileNotFoundError:
+        return []
+    ids = [name[:-5] for name in names if name.endswith('.json') and PROFILE_ID_RE.match(name[:-5])]
+    return sorted(ids, key=lambda profile_id: int(profile_id.split('-')[0]), reverse=True)
+
+
+def load_profile(profile_id):
+    if not PROFILE_ID_RE.match(profile_id):
+        raise Http404
+    try:
+        with open(os.path.join(profile_dir(), f'{profile_id}.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise Http404
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        trigger = self._trigger(request)
+        if trigger is None:
+            return self.get_response(request)
+        return self.profile(request, trigger, self.get_response)
+
+    async def __acall__(self, request):
+        trigger = await sync_to_async(self._trigger)(request)
+        if trigger is None:
+            return await self.get_response(request)
+        # Sample the thread the view runs on, which is the one sync_to_async uses
+        return await sync_to_async(self.profile)(request, trigger, async_to_sync(self.get_response))
+
+    def profile(self, request, trigger, get_response):
+        query_log = QueryLog()
+        interval = getattr(settings, 'PROFILE_INTERVAL', 0.005)
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_log))
+            sampler = stack.enter_context(StackSampler(threading.get_ident(), interval))
+            response = get_response(request)
+        duration = time.perf_counter() - started
+
+        profile_id = f'{time.time_ns()}-{uuid.uuid4().hex[:8]}'
+        user = getattr(request, 'user', None)
+        save_profile({
+            'id': profile_id,
+            'trigger': trigger,
+            'method': request.method,
+            'path': request.get_full_path(),
+            'user': user.pk if user is not None and user.is_authenticated else None,
+            'status': response.status_code,
+            'duration_ms': round(duration * 1000, 3),
+            'interval_ms': interval * 1000,
+            'samples': sum(sampler.stacks.values()),
+            'collapsed': sampler.collapsed(),
+            'sql': query_log.queries,
+        })
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    def _trigger(self, request):
+        if request.headers.get('X-Profile') == '1' or request.GET.get('_profile') == '1':
+            return 'requested' if self._is_staff(request) else None
+        rate = getattr(settings, 'PROFILE_SAMPLE_RATE', 0.0)
+        if rate and random.random() < rate:
+            return 'sampled'
+        return None
+
+    def _is_staff(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.is_staff
+        if request.headers.get('Authorization', '').startswith('Bearer '):
+            from rest_framework.exceptions import AuthenticationFailed
+            from rest_framework_simplejwt.authentication import JWTAuthentication
+            try:
+                authenticated = JWTAuthentication().authenticate(request)
+            except AuthenticationFailed:
+                return False
+            return bool(authenticated and authenticated[0].is_staff)
+        return False
+
+
+@staff_member_required
+def profile_list(request):
+    profiles = []
+    for profile_id in list_profile_ids():
+        try:
+            profile = load_profile(profile_id)
+        except (Http404, ValueError):
+            continue
+        profile['query_count'] = len(profile['sql'])
+        profile['sql_ms'] = round(sum(q['duration_ms'] for q in profile['sql']), 1)
+        profiles.append(profile)
+    return render(request, 'admin/profiles.html', {'profiles': profiles, 'title': 'Request profiles'})
+
+
+@staff_member_required
+def profile_download(request, profile_id, fmt):
+    if fmt == 'collapsed':
+        response = HttpResponse(load_profile(profile_id)['collapsed'], content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{profile_id}.folded"'
+        return response
+    load_profile(profile_id)
+    return FileResponse(
+        open(os.path.join(profile_dir(), f'{profile_id}.json'), 'rb'),
+        as_attachment=True, filename=f'{profile_id}.json', content_type='application/json',
+    )
@@ -48,10 +48,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "employee_portal.admission.AdmissionControlMiddleware",
+    "employees.slowqueries.SlowQueryMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "employees.sharding.TenantMiddleware",
+    "employee_portal.profiling.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'corsheaders.middleware.CorsMiddleware',
@@ -86,6 +90,31 @@ DATABASES = {
     "default": {"ENGINE": "django.db.backends.sqlite3", "NAME": BASE_DIR / "db.sqlite3"}
 }
 
+# Per-tenant sharding (see employees/sharding.py). With N > 0 each tenant's
+# forms and employees live in one of shard_0.sqlite3 .. shard_{N-1}.sqlite3;
+# run ``manage.py migrate --database shard_<i>`` for each shard.
+TENANT_SHARDS = 0
+
+for _shard in range(TENANT_SHARDS):
+    DATABASES[f"shard_{_shard}"] = {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / f"shard_{_shard}.sqlite3",
+    }
+
+DATABASE_ROUTERS = ["employees.sharding.TenantRouter"]
+
+# Shared by all worker processes on the host (see employee_portal/cache.py)
+CACHES = {
+    "default": {
+        "BACKEND": "employee_portal.cache.MmapCache",
+        "LOCATION": os.path.join(BASE_DIR, "cache.mmap"),
+        "OPTIONS": {"SIZE": 64 * 2**20, "SLOT_SIZE": 2048, "WAYS": 8},
+    }
+}
+
+# Sessions are read from the cache and written through to django_session
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -152,4 +181,87 @@ LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login/'
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
\ No newline at end of file
+MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+
+# Media serving (see employee_portal/media.py)
+# Content-hashed names are always cached for a year; everything else for this long.
+MEDIA_CACHE_MAX_AGE = 3600
+# Set to an nginx ``internal`` location (e.g. '/protected-media/') to let the
+# proxy send media bodies via X-Accel-Redirect.
+MEDIA_ACCEL_REDIRECT_PREFIX = None
+
+# Cascade deletes (see employees/deletion.py)
+DELETE_CHUNK_SIZE = 1000
+DELETE_CHUNK_PAUSE = 0.01
+# Hide deleted templates/fields immediately and purge them from the job queue
+# (requires ``manage.py runworker``)
+DELETE_IN_BACKGROUND = False
+
+# Employee value storage: 'eav', 'dual' or 'json' (see employees/storage.py)
+EMPLOYEE_STORAGE = 'eav'
+
+# Activity journal retention (see ``manage.py trim_activity``)
+ACTIVITY_RETENTION_DAYS = 90
+ACTIVITY_MAX_PER_USER = 1000
+
+# Admission control (see employee_portal/admission.py): per-process
+# concurrency limits, wait queue lengths and wait deadlines (seconds)
+ADMISSION_CLASSES = {
+    "read": {"limit": 16, "queue": 32, "timeout": 1.0},
+    "write": {"limit": 4, "queue": 16, "timeout": 3.0},
+    "heavy": {"limit": 2, "queue": 8, "timeout": 5.0},
+}
+# URL names of list/search views, admitted as "heavy" whatever the method
+ADMISSION_HEAVY_VIEWS = ["employee_list", "ajax_employee_rows", "api_employees", "api_changes", "api_batch",
+                         "api_form_report", "api_field_stats"]
+# Long-lived or diagnostic views that never wait for a slot
+ADMISSION_EXEMPT_VIEWS = ["activity_stream", "admission_stats", "warmup_report"]
+
+# Request profiling (see employee_portal/profiling.py)
+PROFILE_DIR = os.path.join(BASE_DIR, "profiles")
+PROFILE_MAX_FILES = 50
+# Fraction of all requests to profile at random, e.g. 0.001
+PROFILE_SAMPLE_RATE = 0.0
+PROFILE_INTERVAL = 0.005
+
+# Statements slower than this many milliseconds go to the slow-query log
+# (manage.py slow_queries); 0 turns the log off
+SLOW_QUERY_MS = 100
+
+# POST /api/batch/: sub-requests per batch, and threads for concurrent reads
+BATCH_MAX_REQUESTS = 20
+BATCH_MAX_WORKERS = 4
+
+# Keep a typed table per form template for reports (employees.materialized);
+# build tables for existing templates with manage.py materialize_templates
+MATERIALIZED_TABLES = False
+
+# Field value autocomplete (employees.suggest): values kept in memory across
+# all cached fields, and seconds before an index is rebuilt from the database
+SUGGEST_CACHE_VALUES = 1000000
+SUGGEST_TTL = 300
+
+# Online backups (manage.py backup_database, employees/backup.py): pages per
+# backup step, pause between steps, and restarts caused by concurrent writes
+# before the rest is copied in one step
+BACKUP_DIR = os.path.join(BASE_DIR, "backups")
+BACKUP_PAGES = 100
+BACKUP_SLEEP = 0.02
+BACKUP_MAX_RESTARTS = 10
+
+# Worker warm-up (employee_portal/warmup.py), run by wsgi.py and asgi.py
+# before the worker takes traffic: modules to import up front, GET paths sent
+# through the middleware once, and value dictionary entries to load
+WARMUP_ON_STARTUP = True
+WARMUP_MODULES = [
+    "rest_framework_simplejwt.authentication",
+    "rest_framework_simplejwt.state",
+    "rest_framework_simplejwt.tokens",
+    "employees.views",
+    "api.views",
+    "employees.reports",
+    "employees.suggest",
+    "employees.materialized",
+]
+WARMUP_URLS = ["/login/", "/admin/login/", "/api/forms/"]
+WARMUP_DICTIONARY_ROWS = 100000
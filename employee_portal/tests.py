@@ -0,0 +1,369 @@
+import asyncio
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+from django.conf import settings
+from django.db import connections
+from django.test import SimpleTestCase, TestCase, override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from employees.models import CustomUser
+
+from . import warmup
+from .admission import Gate
+from .cache import MmapCache
+from .profiling import StackSampler, list_profile_ids, load_profile
+from .media import IMMUTABLE_CACHE_CONTROL
+
+SLOT_SIZE = 256
+
+
+def make_cache(path, buckets=16, ways=4):
+    return MmapCache(path, {'OPTIONS': {'SIZE': buckets * ways * SLOT_SIZE, 'SLOT_SIZE': SLOT_SIZE, 'WAYS': ways}})
+
+
+def _increment(path, key, times):
+    cache = make_cache(path)
+    for _ in range(times):
+        cache.incr(key)
+
+
+def _store(path, key, value):
+    make_cache(path).set(key, value)
+
+
+class MmapCacheTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'cache.mmap')
+        self.cache = make_cache(self.path)
+
+    def test_set_get_delete(self):
+        self.assertIsNone(self.cache.get('missing'))
+        self.assertEqual(self.cache.get('missing', 'default'), 'default')
+        self.cache.set('key', {'a': [1, 2]})
+        self.assertEqual(self.cache.get('key'), {'a': [1, 2]})
+        self.cache.set('key', 'replaced')
+        self.assertEqual(self.cache.get('key'), 'replaced')
+        self.assertTrue(self.cache.delete('key'))
+        self.assertFalse(self.cache.delete('key'))
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_add_only_when_missing(self):
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(self.cache.add('key', 2))
+        self.assertEqual(self.cache.get('key'), 1)
+
+    def test_incr_and_decr(self):
+        with self.assertRaises(ValueError):
+            self.cache.incr('counter')
+        self.cache.set('counter', 10)
+        self.assertEqual(self.cache.incr('counter', 5), 15)
+        self.assertEqual(self.cache.decr('counter'), 14)
+        self.assertEqual(self.cache.get('counter'), 14)
+
+    def test_expiry(self):
+        self.cache.set('short', 'value', 0.2)
+        self.cache.set('forever', 'value', None)
+        self.cache.set('gone', 'value', 0)
+        self.assertEqual(self.cache.get('short'), 'value')
+        self.assertIsNone(self.cache.get('gone'))
+        time.sleep(0.3)
+        self.assertIsNone(self.cache.get('short'))
+        self.assertEqual(self.cache.get('forever'), 'value')
+        # An expired entry can be added again, but not incremented
+        with self.assertRaises(ValueError):
+            self.cache.incr('short')
+        self.assertTrue(self.cache.add('short', 'again'))
+
+    def test_touch(self):
+        self.assertFalse(self.cache.touch('missing'))
+        self.cache.set('key', 'value', 0.2)
+        self.assertTrue(self.cache.touch('key', None))
+        time.sleep(0.3)
+        self.assertEqual(self.cache.get('key'), 'value')
+
+    def test_full_bucket_evicts_least_recently_used(self):
+        cache = make_cache(os.path.join(os.path.dirname(self.path), 'small.mmap'), buckets=1, ways=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_expired_slot_is_reused_first(self):
+        cache = make_cache(os.path.join(os.path.dirname(self.path), 'small.mmap'), buckets=1, ways=2)
+        cache.set('a', 1, 0)
+        cache.set('b', 2)
+        cache.set('c', 3)
+        self.assertEqual((cache.get('b'), cache.get('c')), (2, 3))
+
+    def test_oversize_value_is_dropped(self):
+        self.cache.set('key', 'small')
+        self.cache.set('key', 'x' * SLOT_SIZE)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.add('other', 'x' * SLOT_SIZE))
+        self.assertIsNone(self.cache.get('other'))
+
+    def test_clear(self):
+        self.cache.set('key', 'value')
+        self.cache.clear()
+        self.assertIsNone(self.cache.get('key'))
+
+    def test_shared_across_processes(self):
+        context = multiprocessing.get_context('fork')
+        writer = context.Process(target=_store, args=(self.path, 'from-child', 'hello'))
+        writer.start()
+        writer.join()
+        self.assertEqual(self.cache.get('from-child'), 'hello')
+
+        self.cache.set('counter', 0)
+        workers = [context.Process(target=_increment, args=(self.path, 'counter', 200)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([worker.exitcode for worker in workers], [0] * 4)
+        self.assertEqual(self.cache.get('counter'), 800)
+
+
+class AdmissionGateTests(SimpleTestCase):
+    async def test_async_slots_queue_and_time_out(self):
+        gate = Gate('test', limit=1, queue=1, timeout=0.05)
+        release = await gate.aacquire()
+        self.assertIsNotNone(release)
+        # One request may wait; it gives up after the timeout, and a third
+        # arriving meanwhile finds the queue full
+        waiter = asyncio.ensure_future(gate.aacquire())
+        await asyncio.sleep(0)
+        self.assertIsNone(await gate.aacquire())
+        self.assertIsNone(await waiter)
+        stats = gate.stats()
+        self.assertEqual((stats['active'], stats['waiting'], stats['admitted']), (1, 0, 1))
+        self.assertEqual((stats['rejected_queue_full'], stats['rejected_timeout']), (1, 1))
+
+    async def test_async_release_admits_the_next_waiter(self):
+        gate = Gate('test', limit=1, queue=1, timeout=5)
+        release = await gate.aacquire()
+        waiter = asyncio.ensure_future(gate.aacquire())
+        await asyncio.sleep(0)
+        self.assertEqual(gate.stats()['waiting'], 1)
+        # Streaming responses give their slot back from a worker thread
+        await asyncio.to_thread(release)
+        second = await waiter
+        self.assertEqual(gate.stats()['active'], 1)
+        second()
+        self.assertEqual(gate.stats()['active'], 0)
+
+
+def _spin(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class ProfilingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_user(username='staff', email='staff@example.com', password='x',
+                                                   is_staff=True)
+        cls.user = CustomUser.objects.create_user(username='user', email='user@example.com', password='x')
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(PROFILE_DIR=directory.name, PROFILE_INTERVAL=0.001))
+
+    def test_staff_can_profile_a_request(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/', HTTP_X_PROFILE='1')
+        profile = load_profile(response['X-Profile-Id'])
+        self.assertEqual((profile['trigger'], profile['method'], profile['path']), ('requested', 'GET', '/'))
+        self.assertEqual((profile['user'], profile['status']), (self.staff.pk, 200))
+        self.assertTrue(any('employees_employee' in query['sql'] for query in profile['sql']))
+        self.assertEqual(list_profile_ids(), [response['X-Profile-Id']])
+
+    def test_others_are_not_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/login/?_profile=1'))
+        self.client.force_login(self.user)
+        self.assertNotIn('X-Profile-Id', self.client.get('/', HTTP_X_PROFILE='1'))
+        self.assertEqual(list_profile_ids(), [])
+
+    def test_jwt_staff_can_profile_api_requests(self):
+        token = str(RefreshToken.for_user(self.staff).access_token)
+        response = self.client.get('/api/forms/?_profile=1', HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(load_profile(response['X-Profile-Id'])['path'], '/api/forms/?_profile=1')
+
+    async def test_async_requests_are_profiled(self):
+        await self.async_client.aforce_login(self.staff)
+        response = await self.async_client.get('/', headers={'X-Profile': '1'})
+        profile = load_profile(response['X-Profile-Id'])
+        # The queries ran on the request's sync thread, where they were captured
+        self.assertTrue(any('employees_employee' in query['sql'] for query in profile['sql']))
+
+    def test_sampling_and_retention(self):
+        with self.settings(PROFILE_SAMPLE_RATE=1.0, PROFILE_MAX_FILES=2):
+            ids = [self.client.get('/login/')['X-Profile-Id'] for _ in range(3)]
+        self.assertEqual(load_profile(ids[-1])['trigger'], 'sampled')
+        self.assertEqual(set(list_profile_ids()), set(ids[1:]))
+
+    def test_list_and_download(self):
+        self.client.force_login(self.staff)
+        profile_id = self.client.get('/', HTTP_X_PROFILE='1')['X-Profile-Id']
+        self.assertContains(self.client.get('/admin/profiles/'), profile_id)
+        response = self.client.get(f'/admin/profiles/{profile_id}/collapsed/')
+        self.assertEqual(response.content.decode(), load_profile(profile_id)['collapsed'])
+        response = self.client.get(f'/admin/profiles/{profile_id}/json/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        response.close()
+        self.assertEqual(self.client.get('/admin/profiles/1-00000000/json/').status_code, 404)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(f'/admin/profiles/{profile_id}/json/').status_code, 302)
+
+    def test_sampler_records_the_other_threads_stack(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=_spin, args=(stop,))
+        worker.start()
+        try:
+            with StackSampler(worker.ident, 0.001) as sampler:
+                time.sleep(0.05)
+        finally:
+            stop.set()
+            worker.join()
+        self.assertIn('employee_portal/tests.py:_spin', sampler.collapsed())
+        self.assertGreater(sum(sampler.stacks.values()), 0)
+
+
+class MediaViewTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, MEDIA_CACHE_MAX_AGE=60))
+        os.makedirs(os.path.join(media.name, 'profile_pics', 'thumbs'))
+        self.body = bytes(range(256)) * 4
+        for name in ('profile_pics/me.png', 'profile_pics/thumbs/0123456789abcdef_64.webp'):
+            with open(os.path.join(media.name, name), 'wb') as fh:
+                fh.write(self.body)
+
+    def test_full_response(self):
+        response = self.client.get('/media/profile_pics/me.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.body)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=60')
+        response.close()
+
+    def test_hashed_names_are_immutable(self):
+        response = self.client.head('/media/profile_pics/thumbs/0123456789abcdef_64.webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
+        self.assertEqual(response['Content-Length'], str(len(self.body)))
+
+    def test_missing_and_escaping_paths(self):
+        for path in ('/media/missing.png', '/media/profile_pics', '/media/../settings.py'):
+            self.assertEqual(self.client.get(path).status_code, 404, path)
+        self.assertEqual(self.client.post('/media/profile_pics/me.png').status_code, 405)
+
+    def test_ranges(self):
+        for header, start, end in (('bytes=0-9', 0, 9), ('bytes=1000-', 1000, 1023), ('bytes=-4', 1020, 1023),
+                                   ('bytes=1020-5000', 1020, 1023)):
+            response = self.client.get('/media/profile_pics/me.png', HTTP_RANGE=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/1024')
+            self.assertEqual(b''.join(response.streaming_content), self.body[start:end + 1])
+        response = self.client.get('/media/profile_pics/me.png', HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+        # Several ranges are not supported; the whole file is sent
+        response = self.client.get('/media/profile_pics/me.png', HTTP_RANGE='bytes=0-1,5-6')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_stale_if_range_sends_everything(self):
+        response = self.client.get('/media/profile_pics/me.png', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_conditional_requests(self):
+        response = self.client.head('/media/profile_pics/me.png')
+        etag, modified = response['ETag'], response['Last-Modified']
+        for headers in ({'HTTP_IF_NONE_MATCH': etag}, {'HTTP_IF_NONE_MATCH': f'"other", W/{etag}'},
+                        {'HTTP_IF_MODIFIED_SINCE': modified}):
+            response = self.client.get('/media/profile_pics/me.png', **headers)
+            self.assertEqual(response.status_code, 304, headers)
+            self.assertEqual(response['ETag'], etag)
+        response = self.client.get('/media/profile_pics/me.png', HTTP_IF_NONE_MATCH='"other"')
+        self.assertEqual(response.status_code, 200)
+        response.close()
+
+    def test_accel_redirect(self):
+        with self.settings(MEDIA_ACCEL_REDIRECT_PREFIX='/protected/'):
+            response = self.client.get('/media/profile_pics/me.png')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected/profile_pics/me.png')
+        self.assertEqual(response.content, b'')
+
+
+def _failing_step():
+    raise RuntimeError('boom')
+
+
+class WarmupTests(TestCase):
+    def setUp(self):
+        self.enterContext(mock.patch.object(warmup, 'report', None))
+
+    def test_report(self):
+        with self.assertLogs('employee_portal.warmup', 'INFO'):
+            report = warmup.run()
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(list(report['steps']), [name for name, _ in warmup.STEPS])
+        self.assertEqual(report['pid'], os.getpid())
+        self.assertIsNotNone(report['ready_at'])
+        self.assertEqual(sorted(timing['module'] for timing in report['imports']['modules']),
+                         sorted(settings.WARMUP_MODULES))
+        self.assertGreater(report['templates']['compiled'], 0)
+        self.assertEqual([timing['path'] for timing in report['requests']['urls']], settings.WARMUP_URLS)
+        self.assertTrue(all(timing['status'] < 500 for timing in report['requests']['urls']))
+        self.assertEqual(set(report['databases']['connect_ms']), set(connections))
+        self.assertIs(warmup.report, report)
+
+    def test_failing_step_does_not_stop_startup(self):
+        steps = [('imports', warmup._import_modules), ('broken', _failing_step), ('urls', warmup._populate_urls)]
+        with mock.patch.object(warmup, 'STEPS', steps), self.assertLogs('employee_portal.warmup') as logs:
+            report = warmup.on_startup()
+        self.assertEqual(report['errors'], {'broken': "RuntimeError('boom')"})
+        self.assertEqual(list(report['steps']), ['imports', 'broken', 'urls'])
+        self.assertIn('urls', report)
+        self.assertIn('Warm-up step broken failed', logs.output[0])
+
+    def test_on_startup_in_an_event_loop(self):
+        steps = [('loop', asyncio.get_running_loop)]
+
+        async def start():
+            return warmup.on_startup()
+
+        with mock.patch.object(warmup, 'STEPS', steps), self.assertLogs('employee_portal.warmup'):
+            report = asyncio.run(start())
+        # Run on a thread of its own, outside the loop
+        self.assertIn('loop', report['errors'])
+
+    @override_settings(WARMUP_ON_STARTUP=False)
+    def test_on_startup_can_be_turned_off(self):
+        self.assertIsNone(warmup.on_startup())
+
+    def test_report_view_is_staff_only(self):
+        staff = CustomUser.objects.create_user(username='staff', email='staff@example.com', password='x',
+                                               is_staff=True)
+        self.client.force_login(staff)
+        self.assertEqual(self.client.get('/admin/warmup/').json(), {'ready_at': None})
+        with mock.patch.object(warmup, 'STEPS', []), self.assertLogs('employee_portal.warmup'):
+            warmup.run()
+        self.assertEqual(self.client.get('/admin/warmup/').json()['steps'], {})
+        self.client.logout()
+        self.assertEqual(self.client.get('/admin/warmup/').status_code, 302)
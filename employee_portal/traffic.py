@@ -0,0 +1,53 @@
+"""
+Host-wide request counters.
+
+AdmissionControlMiddleware adds every request it handles to two counters in
+the default cache: how many requests finished and their total time in
+microseconds. With the shared MmapCache (employee_portal.cache) every worker
+process on the host adds to the same counters, so any other process, such as
+``manage.py backup_database``, can take totals() at two moments and compare
+throughput and mean latency between windows of time.
+"""
+import time
+
+from django.core.cache import cache
+
+COUNT_KEY = 'traffic:requests'
+TIME_KEY = 'traffic:request_us'
+
+
+def _add(key, delta):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+def record(duration):
+    """Count one finished request that took ``duration`` seconds."""
+    _add(COUNT_KEY, 1)
+    _add(TIME_KEY, int(duration * 1_000_000))
+
+
+def totals():
+    """``(monotonic time, requests, microseconds)`` as of now."""
+    return time.monotonic(), cache.get(COUNT_KEY, 0), cache.get(TIME_KEY, 0)
+
+
+def window(before, after):
+    """
+    ``{'seconds', 'requests', 'per_second', 'mean_ms'}`` between two totals(),
+    or None when the counters went backwards (evicted or cleared meanwhile).
+    """
+    seconds = after[0] - before[0]
+    requests = after[1] - before[1]
+    micros = after[2] - before[2]
+    if seconds <= 0 or requests < 0 or micros < 0:
+        return None
+    return {
+        'seconds': round(seconds, 3),
+        'requests': requests,
+        'per_second': round(requests / seconds, 2),
+        'mean_ms': round(micros / requests / 1000, 2) if requests else None,
+    }
@@ -15,15 +15,21 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from .admission import admission_stats
+from .media import serve_media
+from .profiling import profile_download, profile_list
+from .warmup import warmup_report
 
 urlpatterns = [
+    path("admin/admission/", admission_stats, name="admission_stats"),
+    path("admin/warmup/", warmup_report, name="warmup_report"),
+    path("admin/profiles/", profile_list, name="profile_list"),
+    re_path(r"^admin/profiles/(?P<profile_id>\d+-[0-9a-f]{8})/(?P<fmt>collapsed|json)/$", profile_download,
+            name="profile_download"),
     path("admin/", admin.site.urls),
     path("", include("employees.urls")),  # employees app URLs
     path("api/", include("api.urls")),    # API URLs
-]+ static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_URL)
\ No newline at end of file
+    re_path(r"^%s(?P<path>.*)$" % settings.MEDIA_URL.lstrip("/"), serve_media, name="media"),
+]
\ No newline at end of file
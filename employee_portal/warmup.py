@@ -0,0 +1,254 @@
+"""
+Worker warm-up.
+
+A freshly started worker pays, on its first requests, for everything that
+happens lazily: importing views and the JWT machinery, populating the URL
+resolver, compiling templates, building the middleware chain, opening
+database connections and filling per-process caches (value dictionaries,
+materialized table names, content types). After a deploy every worker pays
+it at once, and the first users see it.
+
+wsgi.py and asgi.py call on_startup() right after building the application,
+which is before the server lets the worker accept connections, so the cost
+moves out of request latency. Steps, each timed:
+
+- ``imports``: WARMUP_MODULES, timed per module with how many modules each
+  pulled in.
+- ``urls``: the URL resolver.
+- ``templates``: every template the engines can find, into the cached loader.
+- ``caches``: per-process caches that would otherwise fill request by request.
+- ``requests``: each of WARMUP_URLS sent twice through the full middleware
+  stack, so the first-request cost is the difference. Modules first imported
+  here are reported; they are candidates for WARMUP_MODULES.
+- ``databases``: a connection per alias, touching every table. It stays open
+  for the first request only with CONN_MAX_AGE; otherwise the point is having
+  the schema and table roots in the OS page cache.
+
+The report, with time-to-ready counted from when the server imported the
+entry point, is logged to ``employee_portal.warmup`` and served by
+``warmup_report`` (staff only) for the process that answers.
+``manage.py warmup`` runs the same steps in a fresh process and prints it.
+A failing step is logged and reported; it never keeps the worker from
+starting.
+"""
+import asyncio
+import io
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.handlers.wsgi import WSGIHandler
+from django.db import connections
+from django.http import JsonResponse
+from django.template import engines
+from django.urls import get_resolver
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODULES = [
+    'rest_framework_simplejwt.authentication',
+    'rest_framework_simplejwt.state',
+    'rest_framework_simplejwt.tokens',
+]
+DEFAULT_URLS = ['/login/']
+
+# Report of the warm-up of this process, once it ran
+report = None
+# Connections opened before a fork (gunicorn --preload) and dropped in the child
+_inherited = []
+_fork_guard = False
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def _import_modules():
+    timings = []
+    for name in getattr(settings, 'WARMUP_MODULES', DEFAULT_MODULES):
+        loaded = len(sys.modules)
+        started = time.perf_counter()
+        import_module(name)
+        timings.append({'module': name, 'ms': _ms(time.perf_counter() - started),
+                        'loaded': len(sys.modules) - loaded})
+    timings.sort(key=lambda timing: -timing['ms'])
+    return {'modules': timings}
+
+
+def _populate_urls():
+    resolver = get_resolver()
+    # reverse_dict populates the resolver, importing every URLconf and view
+    return {'names': len(resolver.reverse_dict)}
+
+
+def _compile_templates():
+    compiled = failed = 0
+    for engine in engines.all():
+        names = set()
+        for directory in engine.template_dirs:
+            for root, _, files in os.walk(directory):
+                names.update(os.path.relpath(os.path.join(root, file), directory).replace(os.sep, '/')
+                             for file in files)
+        for name in sorted(names):
+            try:
+                engine.get_template(name)
+            except Exception:
+                # Not every file under a template directory is a template
+                failed += 1
+            else:
+                compiled += 1
+    return {'compiled': compiled, 'skipped': failed}
+
+
+def _prime_caches():
+    from django.contrib.contenttypes.models import ContentType
+    from employees import dictionary, materialized
+
+    ContentType.objects.get_for_models(*apps.get_models())
+    limit = getattr(settings, 'WARMUP_DICTIONARY_ROWS', 100000)
+    entries = {alias: dictionary.preload(alias, limit) for alias in connections}
+    if materialized.enabled():
+        for alias in connections:
+            materialized.preload(alias)
+    return {'dictionary_entries': entries}
+
+
+def _host():
+    for host in settings.ALLOWED_HOSTS:
+        if host != '*':
+            return host.lstrip('.')
+    return 'localhost'
+
+
+def _get(handler, path, headers):
+    environ = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': path, 'QUERY_STRING': '', 'SERVER_NAME': _host(),
+        'SERVER_PORT': '443' if settings.SECURE_SSL_REDIRECT else '80', 'HTTP_HOST': _host(),
+        'REMOTE_ADDR': '127.0.0.1', 'wsgi.input': io.BytesIO(),
+        'wsgi.url_scheme': 'https' if settings.SECURE_SSL_REDIRECT else 'http', **headers,
+    }
+    status = []
+    started = time.perf_counter()
+    response = handler(environ, lambda line, response_headers: status.append(int(line.split()[0])))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return status[0], _ms(time.perf_counter() - started)
+
+
+def _replay_requests():
+    loaded = set(sys.modules)
+    handler = WSGIHandler()
+    timings = []
+    # Keep the expected 4xx answers out of the log
+    request_logger = logging.getLogger('django.request')
+    level = request_logger.level
+    request_logger.setLevel(logging.ERROR)
+    try:
+        for path in getattr(settings, 'WARMUP_URLS', DEFAULT_URLS):
+            # API paths answer 401 to the bogus token, after going through JWT decoding
+            headers = {'HTTP_AUTHORIZATION': 'Bearer warmup'} if path.startswith('/api/') else {}
+            status, first_ms = _get(handler, path, headers)
+            second_ms = _get(handler, path, headers)[1]
+            if status >= 500:
+                logger.warning('Warm-up request to %s answered %s', path, status)
+            timings.append({'path': path, 'status': status, 'first_ms': first_ms, 'second_ms': second_ms})
+    finally:
+        request_logger.setLevel(level)
+    lazy = sorted(set(sys.modules) - loaded)
+    return {'urls': timings, 'lazy_imports': lazy}
+
+
+def _forget_inherited():
+    # A child must not use, or close, SQLite connections of its parent; keep
+    # the objects alive so they are never closed here
+    for connection in connections.all(initialized_only=True):
+        if connection.connection is not None:
+            _inherited.append(connection.connection)
+            connection.connection = None
+
+
+def _open_databases():
+    global _fork_guard
+    timings = {}
+    keep = False
+    for connection in connections.all():
+        started = time.perf_counter()
+        connection.ensure_connection()
+        tables = set(connection.introspection.table_names())
+        with connection.cursor() as cursor:
+            for model in apps.get_models():
+                if model._meta.db_table in tables:
+                    cursor.execute(f'SELECT 1 FROM {connection.ops.quote_name(model._meta.db_table)} LIMIT 1')
+        timings[connection.alias] = _ms(time.perf_counter() - started)
+        if connection.settings_dict['CONN_MAX_AGE'] == 0:
+            # The first request would close it anyway
+            connection.close()
+        else:
+            keep = True
+    if keep and not _fork_guard:
+        os.register_at_fork(after_in_child=_forget_inherited)
+        _fork_guard = True
+    return {'connect_ms': timings, 'kept_open': keep}
+
+
+STEPS = [
+    ('imports', _import_modules),
+    ('urls', _populate_urls),
+    ('templates', _compile_templates),
+    ('caches', _prime_caches),
+    ('requests', _replay_requests),
+    ('databases', _open_databases),
+]
+
+
+def run(started=None):
+    """
+    Run every warm-up step and return the report. ``started`` is the
+    perf_counter() value time-to-ready is counted from (default: now).
+    """
+    global report
+    started = time.perf_counter() if started is None else started
+    result = {'pid': os.getpid(), 'steps': {}, 'errors': {}}
+    for name, step in STEPS:
+        step_started = time.perf_counter()
+        try:
+            result[name] = step()
+        except Exception as exc:
+            logger.exception('Warm-up step %s failed', name)
+            result['errors'][name] = repr(exc)
+        result['steps'][name] = _ms(time.perf_counter() - step_started)
+    result['time_to_ready_ms'] = _ms(time.perf_counter() - started)
+    result['ready_at'] = timezone.now().isoformat()
+    report = result
+    logger.info('Worker %s ready in %s ms (%s)', result['pid'], result['time_to_ready_ms'],
+                ', '.join(f'{name} {ms} ms' for name, ms in result['steps'].items()))
+    return result
+
+
+def on_startup(started=None):
+    """Warm up unless WARMUP_ON_STARTUP is off; called by wsgi.py and asgi.py."""
+    if not getattr(settings, 'WARMUP_ON_STARTUP', True):
+        return None
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return run(started)
+    # Imported inside the server's event loop (uvicorn), where the ORM refuses
+    # to run; block the loop anyway, it takes no traffic yet
+    with ThreadPoolExecutor(1) as executor:
+        return executor.submit(run, started).result()
+
+
+@staff_member_required
+def warmup_report(request):
+    return JsonResponse(report or {'ready_at': None})
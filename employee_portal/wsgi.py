@@ -8,9 +8,17 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 """
 
 import os
+import time
+
+started = time.perf_counter()
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "employee_portal.settings")
 
 application = get_wsgi_application()
+
+# Before the server hands this worker any requests
+from employee_portal import warmup
+
+warmup.on_startup(started)
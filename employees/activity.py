@@ -0,0 +1,80 @@
+"""
+Append-only activity journal behind the recent activity page.
+
+One compact ActivityEntry per create, update or delete of a form, field or
+employee, indexed on ``(user, ts)``. The feed is read newest first with
+keyset pagination on ``(ts, id)``, so every page is a single range scan of
+that index however deep the user pages. ``manage.py trim_activity`` keeps
+the table bounded.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db.models import Q
+
+from .models import FormTemplate, FormField, Employee, ActivityEntry
+
+KINDS = {
+    FormTemplate: 'form_template',
+    FormField: 'form_field',
+    Employee: 'employee',
+}
+PAGE_SIZE = 20
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def describe(instance):
+    """``(user_id, label)`` for a journaled instance."""
+    if isinstance(instance, FormTemplate):
+        return instance.created_by_id, instance.name
+    if isinstance(instance, FormField):
+        return instance.form_template.created_by_id, f'{instance.label} ({instance.form_template.name})'
+    return instance.created_by_id, f'Employee #{instance.pk} ({instance.form_template.name})'
+
+
+def entry(instance, action):
+    user_id, label = describe(instance)
+    return ActivityEntry(
+        user_id=user_id,
+        kind=KINDS[type(instance)],
+        action=action,
+        object_id=instance.pk,
+        label=label[:200],
+    )
+
+
+def log(instance, action):
+    entry(instance, action).save()
+
+
+def log_many(instances, action):
+    ActivityEntry.objects.bulk_create([entry(instance, action) for instance in instances])
+
+
+def feed_page(user, before=None, page_size=PAGE_SIZE):
+    """
+    Up to ``page_size`` entries for ``user`` older than the ``(ts, id)``
+    cursor ``before``, newest first, plus the cursor for the next page (or None).
+    """
+    entries = ActivityEntry.objects.filter(user=user)
+    if before:
+        ts, entry_id = before
+        entries = entries.filter(Q(ts__lt=ts) | Q(ts=ts, id__lt=entry_id))
+    entries = list(entries.order_by('-ts', '-id')[:page_size + 1])
+    next_cursor = None
+    if len(entries) > page_size:
+        entries = entries[:page_size]
+        next_cursor = encode_cursor(entries[-1])
+    return entries, next_cursor
+
+
+def encode_cursor(entry):
+    return f'{(entry.ts - EPOCH) // timedelta(microseconds=1)}_{entry.pk}'
+
+
+def decode_cursor(value):
+    """Inverse of encode_cursor(); returns None for a missing or malformed cursor."""
+    try:
+        ts, entry_id = value.split('_')
+        return EPOCH + timedelta(microseconds=int(ts)), int(entry_id)
+    except (AttributeError, ValueError, OverflowError):
+        return None
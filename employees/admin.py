@@ -1,3 +1,385 @@
+"""
+Admin for support staff.
+
+The employee tables run to millions of rows, so the changelists of the big
+models (LargeTableAdmin) avoid what makes the stock admin slow there:
+
+- Counting: an unfiltered list shows the id range of the table as an
+  estimate, read from the ends of the primary key index. Filtered lists and
+  searches count at most COUNT_LIMIT rows. The "N total" count is off.
+- Paging: lists run newest first and page with ``?cursor=<id>`` (rows with a
+  smaller id) instead of OFFSET, so a deep page costs what the first does.
+  Column sorting is off, since it would need OFFSET again.
+- Related rows: ``list_select_related`` covers every column and ``__str__``
+  shown, and foreign keys use autocomplete widgets instead of a <select>
+  listing every employee or field. Searches use indexed lookups, e.g. exact
+  ids.
+
+Values are written through employees.storage, as in the API, so admin edits
+keep the value dictionary, the change log and fingerprints in step.
+Templates and fields are deleted through employees.deletion, and their
+delete confirmation shows counts instead of listing every affected row.
+Lists show the active shard (see employees.sharding), i.e. that of the
+signed-in staff user.
+"""
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, PAGE_VAR
+from django.contrib.auth.admin import UserAdmin
+from django.core.paginator import Paginator
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+
+from .deletion import delete_employee, delete_field, delete_template
+from .dictionary import decode_value
+from .forms import CustomUserCreationForm
+from .models import (
+    CustomUser, FormTemplate, FormField, Employee, EmployeeData, FieldValueCode, ArchivedEmployee,
+    Job, ChangeLogEntry, ActivityEntry, TenantShard, SlowQuery,
+)
+from .storage import update_values, uses_eav
+
+CURSOR_VAR = 'cursor'
+COUNT_LIMIT = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator that never counts a whole big table: ``estimated`` lists
+    count the id range, other lists at most COUNT_LIMIT rows (``capped``).
+    """
+
+    def __init__(self, object_list, per_page, orphans=0, allow_empty_first_page=True, estimated=False):
+        super().__init__(object_list, per_page, orphans, allow_empty_first_page)
+        self.estimated = estimated
+        self.capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if self.estimated:
+            bounds = queryset.model._base_manager.using(queryset.db).aggregate(low=Min('pk'), high=Max('pk'))
+            return bounds['high'] - bounds['low'] + 1 if bounds['high'] is not None else 0
+        count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+        self.capped = count > COUNT_LIMIT
+        return min(count, COUNT_LIMIT)
+
+
+class KeysetChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+        self.result_list = list(self.result_list)
+        self.first_page_url = self.get_query_string(remove=[PAGE_VAR]) if self.model_admin.cursor(request) else None
+        self.next_page_url = None
+        if self.multi_page and len(self.result_list) == self.list_per_page:
+            self.next_page_url = self.get_query_string({CURSOR_VAR: self.result_list[-1].pk}, [PAGE_VAR])
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist settings for tables with millions of rows (see the module docstring)."""
+    ordering = ('-pk',)
+    sortable_by = ()
+    show_full_result_count = False
+    list_per_page = 50
+    list_max_show_all = 0
+    paginator = EstimatedCountPaginator
+    change_list_template = 'admin/large_table_change_list.html'
+
+    def cursor(self, request):
+        return getattr(request, '_admin_cursor', None)
+
+    def changelist_view(self, request, extra_context=None):
+        # ChangeList treats unknown parameters as field lookups, so take the cursor out first
+        if CURSOR_VAR in request.GET:
+            request.GET = request.GET.copy()
+            cursor = request.GET.pop(CURSOR_VAR)[-1]
+            request._admin_cursor = int(cursor) if cursor.isdigit() else None
+        return super().changelist_view(request, extra_context)
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        cursor = self.cursor(request)
+        return queryset.filter(pk__lt=cursor) if cursor is not None else queryset
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        # Only page and cursor parameters: the whole table, whose size can be estimated
+        estimated = not set(request.GET) - {PAGE_VAR}
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, estimated=estimated)
+
+    def get_search_results(self, request, queryset, search_term):
+        """A number matches the id; other searches go to search_by_text()."""
+        term = search_term.strip()
+        if not term:
+            return queryset, False
+        if term.isdigit():
+            return queryset.filter(pk=int(term)), False
+        return self.search_by_text(queryset, term), False
+
+    def search_by_text(self, queryset, term):
+        return queryset.none()
+
+
+class ReadOnlyAdmin(LargeTableAdmin):
+    """For logs and tables written only by the application (and trimmed by its commands)."""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+def _summary(model_counts):
+    """get_deleted_objects() result listing counts instead of rows."""
+    return [f'{count} {name}' for name, count in model_counts.items()], model_counts, set(), []
+
+
+def _count(queryset):
+    count = queryset.order_by()[:COUNT_LIMIT + 1].count()
+    return f'{COUNT_LIMIT}+' if count > COUNT_LIMIT else count
+
+
+@admin.register(CustomUser)
+class CustomUserAdmin(UserAdmin):
+    add_form = CustomUserCreationForm
+    add_fieldsets = (
+        (None, {'classes': ('wide',), 'fields': ('email', 'username', 'password1', 'password2')}),
+    )
+    list_display = ('id', 'email', 'username', 'is_staff', 'is_active', 'date_joined')
+    search_fields = ('email', 'username')
+    ordering = ('email',)
+    show_full_result_count = False
+
+
+@admin.register(FormTemplate)
+class FormTemplateAdmin(admin.ModelAdmin):
+    list_display = ('id', 'name', 'created_by', 'created_at', 'updated_at')
+    list_select_related = ('created_by',)
+    search_fields = ('name',)
+    autocomplete_fields = ('created_by',)
+    show_full_result_count = False
+
+    def get_deleted_objects(self, objs, request):
+        templates = [template.pk for template in objs]
+        return _summary({
+            'form templates': len(templates),
+            'fields': _count(FormField.all_objects.filter(form_template__in=templates)),
+            'employees': _count(Employee.all_objects.filter(form_template__in=templates)),
+            'values': _count(EmployeeData.all_objects.filter(field__form_template__in=templates)),
+        })
+
+    def delete_model(self, request, obj):
+        delete_template(obj, user=request.user)
+
+    def delete_queryset(self, request, queryset):
+        for template in queryset:
+            delete_template(template, user=request.user)
+
+
+@admin.register(FormField)
+class FormFieldAdmin(admin.ModelAdmin):
+    list_display = ('id', 'label', 'field_type', 'form_template', 'required', 'is_key', 'order')
+    list_select_related = ('form_template',)
+    list_filter = ('field_type',)
+    search_fields = ('label', 'form_template__name')
+    autocomplete_fields = ('form_template',)
+    show_full_result_count = False
+
+    def get_deleted_objects(self, objs, request):
+        fields = [field.pk for field in objs]
+        return _summary({
+            'fields': len(fields),
+            'values': _count(EmployeeData.all_objects.filter(field__in=fields)),
+        })
+
+    def delete_model(self, request, obj):
+        delete_field(obj, user=request.user)
+
+    def delete_queryset(self, request, queryset):
+        for field in queryset:
+            delete_field(field, user=request.user)
+
+
+class EmployeeDataForm(forms.ModelForm):
+    """Shows the stored value of dictionary-encoded rows, whose ``value`` column is blank."""
+
+    class Meta:
+        model = EmployeeData
+        fields = ('employee', 'field', 'value')
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        row = self.instance
+        if row.pk and row.code is not None:
+            self.initial['value'] = decode_value(row._state.db, row.field_id, row.value, row.code)
+
+
+class EmployeeDataInline(admin.TabularInline):
+    model = EmployeeData
+    form = EmployeeDataForm
+    fields = ('field', 'value')
+    extra = 1
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('field')
+
+    def get_formset(self, request, obj=None, **kwargs):
+        request._admin_employee = obj
+        return super().get_formset(request, obj, **kwargs)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        employee = getattr(request, '_admin_employee', None)
+        if db_field.name == 'field' and employee is not None:
+            # The fields of the employee's template only
+            kwargs['queryset'] = FormField.objects.filter(form_template_id=employee.form_template_id)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
+@admin.register(Employee)
+class EmployeeAdmin(LargeTableAdmin):
+    list_display = ('id', 'form_template', 'created_by', 'created_at', 'updated_at')
+    list_select_related = ('form_template', 'created_by')
+    search_help_text = 'An employee id, or the start of a form name'
+    search_fields = ('id',)
+    autocomplete_fields = ('form_template', 'created_by')
+    readonly_fields = ('created_at', 'updated_at', 'fingerprint', 'field_values')
+    inlines = (EmployeeDataInline,)
+
+    def search_by_text(self, queryset, term):
+        return queryset.filter(form_template__name__istartswith=term)
+
+    def get_inlines(self, request, obj):
+        # With document storage the values live in field_values
+        return self.inlines if obj is not None and uses_eav() else ()
+
+    def save_formset(self, request, form, formset, change):
+        if formset.model is not EmployeeData:
+            return super().save_formset(request, form, formset, change)
+        values = {}
+        for row_form in formset.initial_forms:
+            if row_form in formset.deleted_forms or 'field' in row_form.changed_data:
+                values[row_form.instance.field_id] = None
+        for row_form in formset.forms:
+            if row_form not in formset.deleted_forms and row_form.has_changed():
+                values[row_form.cleaned_data['field'].pk] = row_form.cleaned_data['value']
+        if values:
+            update_values([(form.instance, values)])
+        # Read by construct_change_message(); the change log has the details
+        formset.new_objects, formset.changed_objects, formset.deleted_objects = [], [], []
+
+    def delete_model(self, request, obj):
+        delete_employee(obj)
+
+    def delete_queryset(self, request, queryset):
+        for employee in queryset:
+            delete_employee(employee)
+
+
+@admin.register(EmployeeData)
+class EmployeeDataAdmin(LargeTableAdmin):
+    form = EmployeeDataForm
+    list_display = ('id', 'employee', 'field', 'stored_value')
+    list_select_related = ('employee__form_template', 'field')
+    search_help_text = 'An id, or "employee <id>"'
+    search_fields = ('id',)
+    autocomplete_fields = ('employee', 'field')
+
+    @admin.display(description='value')
+    def stored_value(self, row):
+        return decode_value(row._state.db, row.field_id, row.value, row.code)
+
+    def search_by_text(self, queryset, term):
+        kind, _, pk = term.partition(' ')
+        if kind == 'employee' and pk.strip().isdigit():
+            return queryset.filter(employee_id=int(pk))
+        return queryset.none()
+
+    def get_readonly_fields(self, request, obj=None):
+        return ('employee', 'field') if obj is not None else ()
+
+    def has_add_permission(self, request):
+        return uses_eav() and super().has_add_permission(request)
+
+    def save_model(self, request, obj, form, change):
+        update_values([(obj.employee, {obj.field_id: obj.value})])
+        obj.pk = EmployeeData.all_objects.get(employee=obj.employee, field_id=obj.field_id).pk
+
+    def delete_model(self, request, obj):
+        update_values([(obj.employee, {obj.field_id: None})])
+
+    def delete_queryset(self, request, queryset):
+        by_employee = {}
+        for row in queryset.select_related('employee'):
+            by_employee.setdefault(row.employee_id, (row.employee, {}))[1][row.field_id] = None
+        update_values(list(by_employee.values()))
+
+
+@admin.register(FieldValueCode)
+class FieldValueCodeAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'field', 'code', 'value')
+    list_select_related = ('field',)
+    search_fields = ('id',)
+
+    def search_by_text(self, queryset, term):
+        return queryset.filter(value__startswith=term)
+
+
+@admin.register(ArchivedEmployee)
+class ArchivedEmployeeAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'form_template', 'created_by', 'archived_at')
+    list_select_related = ('form_template', 'created_by')
+    search_fields = ('id',)
+    exclude = ('payload',)
+
+
+@admin.register(ChangeLogEntry)
+class ChangeLogEntryAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'owner', 'action', 'model', 'object_id', 'created_at')
+    list_select_related = ('owner',)
+    list_filter = ('action',)
+    search_fields = ('id',)
+
+
+@admin.register(ActivityEntry)
+class ActivityEntryAdmin(ReadOnlyAdmin):
+    list_display = ('id', 'user', 'ts', 'kind', 'action', 'label')
+    list_select_related = ('user',)
+    list_filter = ('kind', 'action')
+    search_fields = ('id',)
+
+
+@admin.register(Job)
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'task', 'status', 'attempts', 'run_at', 'finished_at', 'created_by')
+    list_select_related = ('created_by',)
+    list_filter = ('status',)
+    search_fields = ('id',)
+    readonly_fields = ('locked_by', 'locked_at', 'result', 'last_error', 'created_at', 'finished_at')
+
+    def search_by_text(self, queryset, term):
+        return queryset.filter(task__startswith=term)
+
+
+@admin.register(TenantShard)
+class TenantShardAdmin(admin.ModelAdmin):
+    list_display = ('user', 'shard', 'locked')
+    list_select_related = ('user',)
+    autocomplete_fields = ('user',)
+    readonly_fields = ('locked',)
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ('fingerprint', 'count', 'total_ms', 'max_ms', 'view', 'last_seen')
+    ordering = ('-total_ms',)
+    search_fields = ('sql', 'view')
+    readonly_fields = [f.name for f in SlowQuery._meta.fields]
 
-# Register your models here.
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,138 @@
+"""
+Cold storage for inactive employees.
+
+archive_employees() moves employees out of Employee/EmployeeData into
+ArchivedEmployee, one row per employee holding its values as a single
+zlib-compressed JSON blob, so list, search and count queries no longer
+touch them. The employee keeps its id, and ``GET /api/employees/<id>/``
+still returns it (marked ``archived``). restore_employees() moves them
+back with their original ids and timestamps.
+
+Both work in pk order, one transaction per chunk, so an interrupted run
+can simply be started again (``manage.py archive_employees``). To the
+change feed archiving looks like a delete and restoring like an insert.
+"""
+import json
+import zlib
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .changes import record_many, snapshot
+from .deletion import delete_in_chunks
+from .dictionary import decode_value, encode_data
+from .fingerprints import refresh_fingerprints
+from .models import FormField, Employee, EmployeeData, ArchivedEmployee
+from .sharding import insert_rows
+from .storage import uses_document
+
+CHUNK_SIZE = 500
+COMPRESSION_LEVEL = 6
+
+
+def pack(payload):
+    data = json.dumps(payload, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':'))
+    return zlib.compress(data.encode(), COMPRESSION_LEVEL)
+
+
+def unpack(blob):
+    return json.loads(zlib.decompress(blob))
+
+
+def archive_employees(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Archive the employees of ``queryset``. Yields ``(last pk, count)`` after
+    each chunk is committed.
+    """
+    db = queryset.db
+    last_pk = 0
+    while True:
+        employees = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not employees:
+            return
+        ids = [e.pk for e in employees]
+        data = defaultdict(list)
+        for pk, employee_id, field_id, value, code in EmployeeData.all_objects.using(db).filter(
+            employee_id__in=ids
+        ).order_by('pk').values_list('pk', 'employee_id', 'field_id', 'value', 'code'):
+            data[employee_id].append([pk, field_id, decode_value(db, field_id, value, code)])
+        with transaction.atomic(using=db):
+            ArchivedEmployee.objects.using(db).bulk_create([
+                ArchivedEmployee(
+                    id=e.pk, form_template_id=e.form_template_id, created_by_id=e.created_by_id,
+                    created_at=e.created_at, updated_at=e.updated_at,
+                    payload=pack({'field_values': e.field_values, 'data': data[e.pk]}),
+                )
+                for e in employees
+            ])
+            delete_in_chunks(EmployeeData.all_objects.using(db).filter(employee_id__in=ids), pause=0)
+            delete_in_chunks(Employee.all_objects.using(db).filter(pk__in=ids), pause=0)
+        last_pk = ids[-1]
+        yield last_pk, len(ids)
+
+
+def restore_employees(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Move the ArchivedEmployee rows of ``queryset`` back into the hot tables.
+    Values of fields deleted in the meantime are dropped. Yields like
+    archive_employees().
+    """
+    db = queryset.db
+    last_pk = 0
+    while True:
+        archived = list(queryset.filter(pk__gt=last_pk).order_by('pk')[:chunk_size])
+        if not archived:
+            return
+        ids = [a.pk for a in archived]
+        live_fields = set(FormField.all_objects.using(db).filter(
+            form_template_id__in={a.form_template_id for a in archived}
+        ).values_list('pk', flat=True))
+        employees, rows = [], []
+        for a in archived:
+            payload = unpack(a.payload)
+            employees.append(Employee(
+                pk=a.pk, form_template_id=a.form_template_id, created_by_id=a.created_by_id,
+                created_at=a.created_at, updated_at=a.updated_at,
+                field_values={k: v for k, v in payload['field_values'].items() if int(k) in live_fields},
+            ))
+            rows.extend(
+                EmployeeData(pk=pk, employee_id=a.pk, field_id=field_id, value=value)
+                for pk, field_id, value in payload['data'] if field_id in live_fields
+            )
+        owners = {a.pk: a.created_by_id for a in archived}
+        snapshots = [(r.pk, owners[r.employee_id], snapshot(r)) for r in rows]
+        with transaction.atomic(using=db):
+            encode_data(rows, db)
+            insert_rows(Employee, employees, db)
+            insert_rows(EmployeeData, rows, db)
+            record_many(Employee, 'insert', [(e.pk, e.created_by_id, snapshot(e)) for e in employees])
+            record_many(EmployeeData, 'insert', snapshots)
+            delete_in_chunks(ArchivedEmployee.objects.using(db).filter(pk__in=ids), pause=0)
+            by_template = defaultdict(list)
+            for e in employees:
+                by_template[e.form_template_id].append(e.pk)
+            for template_id, employee_ids in by_template.items():
+                refresh_fingerprints(template_id, employee_ids)
+        last_pk = ids[-1]
+        yield last_pk, len(ids)
+
+
+def archived_field_rows(archived):
+    """Like storage.field_rows(), for an ArchivedEmployee."""
+    payload = unpack(archived.payload)
+    fields = FormField.objects.filter(form_template_id=archived.form_template_id)
+    if uses_document():
+        doc = payload['field_values']
+        return [
+            {'id': None, 'employee': archived.pk, 'field': f.pk, 'field_label': f.label,
+             'field_type': f.field_type, 'value': doc[str(f.pk)]}
+            for f in fields if str(f.pk) in doc
+        ]
+    by_field = {f.pk: f for f in fields}
+    data = sorted((row for row in payload['data'] if row[1] in by_field), key=lambda row: by_field[row[1]].order)
+    return [
+        {'id': pk, 'employee': archived.pk, 'field': field_id, 'field_label': by_field[field_id].label,
+         'field_type': by_field[field_id].field_type, 'value': value}
+        for pk, field_id, value in data
+    ]
@@ -0,0 +1,246 @@
+"""
+Online backups of the SQLite databases.
+
+copy_online() copies a live database with SQLite's backup API on a
+connection of its own, BACKUP_PAGES pages per step, sleeping BACKUP_SLEEP
+seconds between steps. A step holds a shared lock only while it copies its
+pages, so writers wait at most one step. A write from another process
+restarts the copy from the first page. After BACKUP_MAX_RESTARTS restarts
+the rest is copied in one step, which holds the lock for the whole copy
+but always finishes.
+
+Each run leaves two files in BACKUP_DIR: the backup itself and a JSON
+manifest describing it (``<alias>-<timestamp>.json``). A full backup is a
+database file. An incremental snapshot holds only the pages that differ
+from the alias's latest full backup, as (page number, page) records, so
+restoring one needs that full backup plus the snapshot. Either can be
+gzipped. Manifests keep the SHA-256 of the complete database image, which
+restore() checks, and the request throughput and latency seen host-wide
+(employee_portal.traffic) while the live database was being copied.
+"""
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import struct
+import time
+from contextlib import closing
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+
+from employee_portal import traffic
+
+PAGE_NUMBER = struct.Struct('>I')
+READ_SIZE = 1 << 20
+COMPRESS_LEVEL = 6
+
+
+class BackupError(Exception):
+    pass
+
+
+class TooManyRestarts(Exception):
+    pass
+
+
+def backup_dir():
+    return str(getattr(settings, 'BACKUP_DIR', os.path.join(settings.BASE_DIR, 'backups')))
+
+
+def database_path(alias):
+    connection = connections[alias]
+    if connection.vendor != 'sqlite' or connection.is_in_memory_db():
+        raise BackupError(f'{alias} is not an SQLite database file')
+    return str(connection.settings_dict['NAME'])
+
+
+def copy_online(source_path, target_path, pages=None, sleep=None, max_restarts=None):
+    """
+    Copy the database at ``source_path`` to ``target_path`` while it stays
+    in use. Returns ``{'steps', 'restarts', 'final_step', 'seconds'}``.
+    """
+    pages = pages or getattr(settings, 'BACKUP_PAGES', 100)
+    sleep = getattr(settings, 'BACKUP_SLEEP', 0.02) if sleep is None else sleep
+    max_restarts = getattr(settings, 'BACKUP_MAX_RESTARTS', 10) if max_restarts is None else max_restarts
+    stats = {'steps': 0, 'restarts': 0, 'final_step': False}
+    remaining_before = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_before
+        stats['steps'] += 1
+        if remaining_before is not None and remaining > remaining_before:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise TooManyRestarts
+        remaining_before = remaining
+        if remaining:
+            time.sleep(sleep)
+
+    started = time.monotonic()
+    with closing(sqlite3.connect(source_path, timeout=30)) as source, \
+            closing(sqlite3.connect(target_path)) as target:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except TooManyRestarts:
+            stats['final_step'] = True
+            source.backup(target, pages=-1)
+    stats['seconds'] = round(time.monotonic() - started, 3)
+    return stats
+
+
+def integrity_check(path):
+    with closing(sqlite3.connect(path)) as connection:
+        rows = connection.execute('PRAGMA integrity_check').fetchall()
+    return '; '.join(row[0] for row in rows)
+
+
+def _open(path, mode='rb'):
+    return gzip.open(path, mode, COMPRESS_LEVEL) if path.endswith('.gz') else open(path, mode)
+
+
+def _pages(path, page_size):
+    with _open(path) as file:
+        while True:
+            page = file.read(page_size)
+            if not page:
+                return
+            yield page
+
+
+def _image_info(path):
+    """``(page size, page count, sha256)`` of an uncompressed database file."""
+    with closing(sqlite3.connect(path)) as connection:
+        page_size = connection.execute('PRAGMA page_size').fetchone()[0]
+        page_count = connection.execute('PRAGMA page_count').fetchone()[0]
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(READ_SIZE), b''):
+            digest.update(chunk)
+    return page_size, page_count, digest.hexdigest()
+
+
+def manifests(alias=None, directory=None):
+    """The manifests in the backup directory, oldest first."""
+    directory = directory or backup_dir()
+    found = []
+    if not os.path.isdir(directory):
+        return found
+    for name in sorted(os.listdir(directory)):
+        if name.endswith('.json'):
+            with open(os.path.join(directory, name)) as file:
+                manifest = json.load(file)
+            if alias is None or manifest['alias'] == alias:
+                found.append(dict(manifest, manifest=name))
+    return found
+
+
+def latest_full(alias, directory=None):
+    full = [m for m in manifests(alias, directory) if m['kind'] == 'full']
+    return full[-1] if full else None
+
+
+def _write_delta(image_path, base_path, delta_path, page_size):
+    """Write the pages of ``image_path`` that differ from ``base_path``; returns how many."""
+    changed = 0
+    base = _pages(base_path, page_size)
+    with _open(delta_path, 'wb') as out:
+        for number, page in enumerate(_pages(image_path, page_size), start=1):
+            if next(base, None) != page:
+                out.write(PAGE_NUMBER.pack(number))
+                out.write(page)
+                changed += 1
+    return changed
+
+
+def _compress(path):
+    with open(path, 'rb') as source, _open(path + '.gz', 'wb') as target:
+        shutil.copyfileobj(source, target, READ_SIZE)
+    os.remove(path)
+    return path + '.gz'
+
+
+def backup(alias, incremental=False, compress=False, verify=False, directory=None, **copy_options):
+    """
+    Back up database ``alias`` into ``directory`` (BACKUP_DIR). Returns the
+    manifest, also saved next to the backup. ``incremental`` falls back to
+    a full backup when there is no usable full one.
+    """
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    name = f'{alias}-{timezone.now():%Y%m%d-%H%M%S-%f}'
+    image_path = os.path.join(directory, name + '.partial')
+    try:
+        before = traffic.totals()
+        copy = copy_online(database_path(alias), image_path, **copy_options)
+        # Requests served host-wide while the live database was being read
+        copy['traffic'] = traffic.window(before, traffic.totals())
+        page_size, page_count, sha256 = _image_info(image_path)
+        manifest = {
+            'alias': alias, 'kind': 'full', 'created': timezone.now().isoformat(), 'base': None,
+            'page_size': page_size, 'page_count': page_count, 'sha256': sha256,
+            'copy': copy, 'integrity': integrity_check(image_path) if verify else None,
+        }
+        if manifest['integrity'] not in (None, 'ok'):
+            raise BackupError(f'{alias}: integrity check of the copy failed: {manifest["integrity"]}')
+        base = latest_full(alias, directory) if incremental else None
+        if base is not None and base['page_size'] == page_size:
+            path = os.path.join(directory, name + '.pages' + ('.gz' if compress else ''))
+            manifest.update(kind='incremental', base=base['manifest'])
+            manifest['pages_written'] = _write_delta(
+                image_path, os.path.join(directory, base['file']), path, page_size
+            )
+            os.remove(image_path)
+        else:
+            path = os.path.join(directory, name + '.sqlite3')
+            os.replace(image_path, path)
+            if compress:
+                path = _compress(path)
+            manifest['pages_written'] = page_count
+        manifest.update(file=os.path.basename(path), bytes=os.path.getsize(path))
+    finally:
+        if os.path.exists(image_path):
+            os.remove(image_path)
+    with open(os.path.join(directory, name + '.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    manifest['manifest'] = name + '.json'
+    if verify and manifest['kind'] == 'incremental':
+        # Prove the snapshot restores to the image that was checked
+        check_path = os.path.join(directory, name + '.verify')
+        try:
+            restore(manifest['manifest'], check_path, directory)
+        finally:
+            if os.path.exists(check_path):
+                os.remove(check_path)
+    return manifest
+
+
+def restore(manifest_name, target_path, directory=None):
+    """Rebuild the database of a backup at ``target_path`` and check its SHA-256."""
+    directory = directory or backup_dir()
+    with open(os.path.join(directory, manifest_name)) as file:
+        manifest = json.load(file)
+    if manifest['kind'] == 'full':
+        source = os.path.join(directory, manifest['file'])
+    else:
+        with open(os.path.join(directory, manifest['base'])) as file:
+            source = os.path.join(directory, json.load(file)['file'])
+    with _open(source) as base, open(target_path, 'wb') as target:
+        shutil.copyfileobj(base, target, READ_SIZE)
+    if manifest['kind'] == 'incremental':
+        page_size = manifest['page_size']
+        with _open(os.path.join(directory, manifest['file'])) as delta, open(target_path, 'r+b') as target:
+            while True:
+                number = delta.read(PAGE_NUMBER.size)
+                if not number:
+                    break
+                target.seek((PAGE_NUMBER.unpack(number)[0] - 1) * page_size)
+                target.write(delta.read(page_size))
+            target.truncate(manifest['page_count'] * page_size)
+    sha256 = _image_info(target_path)[2]
+    if sha256 != manifest['sha256']:
+        raise BackupError(f'{manifest_name}: restored database does not match its checksum')
+    return manifest
@@ -0,0 +1,110 @@
+"""
+Append-only change log behind ``GET /api/changes/``.
+
+Every insert, update and delete of FormTemplate, FormField, Employee and
+EmployeeData is recorded as a ChangeLogEntry for the owning user. Entries
+are numbered by the table's AUTOINCREMENT key, which SQLite never reuses, and
+because SQLite has a single writer they become visible in sequence order, so
+a client that remembers the last ``seq`` it saw never misses a change.
+
+Regular ORM saves and deletes are picked up by the signal handlers in
+employees.signals; the bulk paths (employees.storage, employees.deletion)
+call record_many() themselves. ``manage.py compact_changes`` trims old
+entries; clients asking for a ``since`` older than what is left must resync.
+The same calls keep the materialized template tables and the value
+suggestion indexes up to date.
+"""
+from django.db.models import Max, Min
+
+from . import materialized, suggest
+from .models import FormTemplate, FormField, Employee, EmployeeData, ChangeLogEntry
+from .sharding import current_shard, shard_id_floor
+
+MODEL_NAMES = {
+    FormTemplate: 'form_template',
+    FormField: 'form_field',
+    Employee: 'employee',
+    EmployeeData: 'employee_data',
+}
+
+# Lookup from each tracked model to the id of the user that owns the row
+OWNER_PATHS = {
+    FormTemplate: 'created_by_id',
+    FormField: 'form_template__created_by_id',
+    Employee: 'created_by_id',
+    EmployeeData: 'employee__created_by_id',
+}
+
+
+def snapshot(instance):
+    return {f.attname: f.value_from_object(instance) for f in instance._meta.concrete_fields}
+
+
+def owner_id(instance):
+    if isinstance(instance, FormField):
+        return instance.form_template.created_by_id
+    if isinstance(instance, EmployeeData):
+        return instance.employee.created_by_id
+    return instance.created_by_id
+
+
+def record(instance, action):
+    ChangeLogEntry.objects.create(
+        owner_id=owner_id(instance),
+        model=MODEL_NAMES[type(instance)],
+        object_id=instance.pk,
+        action=action,
+        data=None if action == 'delete' else snapshot(instance),
+    )
+    materialized.track(type(instance), action, [snapshot(instance)])
+    suggest.track(type(instance), action, [snapshot(instance)])
+
+
+def record_many(model, action, rows):
+    """Record ``action`` for ``rows`` of ``(object_id, owner_id, data)``."""
+    ChangeLogEntry.objects.bulk_create([
+        ChangeLogEntry(
+            owner_id=owner, model=MODEL_NAMES[model], object_id=object_id, action=action, data=data,
+        )
+        for object_id, owner, data in rows
+    ])
+    if action != 'delete':
+        materialized.track(model, action, [data for _, _, data in rows])
+        suggest.track(model, action, [data for _, _, data in rows])
+
+
+def record_deletes(queryset):
+    """Record deletes for every row of ``queryset`` (call before deleting them)."""
+    model = queryset.model
+    if model not in MODEL_NAMES:
+        return
+    materialized.track_queryset(queryset, 'delete')
+    rows = queryset.order_by().values_list('pk', OWNER_PATHS[model])
+    record_many(model, 'delete', [(pk, owner, None) for pk, owner in rows])
+
+
+def changes_since(user, since, limit):
+    """Up to ``limit`` entries for ``user`` after sequence number ``since``."""
+    return list(
+        ChangeLogEntry.objects.filter(owner=user, id__gt=since).order_by('id')[:limit]
+    )
+
+
+def seq_floor():
+    """
+    The sequence number before the first entry of the active log. Shards
+    number their entries from their own id range (see employees.sharding).
+    """
+    alias = current_shard()
+    return shard_id_floor(alias) if alias else 0
+
+
+def seq_bounds():
+    """
+    ``(oldest, latest)`` sequence numbers still in the log, across all users.
+    Compaction only removes a prefix of the log and always keeps the newest
+    entry, so any ``since`` below ``oldest - 1`` may have missed changes.
+    """
+    floor = seq_floor()
+    bounds = ChangeLogEntry.objects.aggregate(oldest=Min('id'), latest=Max('id'))
+    return bounds['oldest'] or floor, bounds['latest'] or floor
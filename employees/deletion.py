@@ -0,0 +1,131 @@
+"""
+Chunked cascade deletion for templates, fields and employees.
+
+Model.delete() goes through Django's Collector, which loads every related
+Employee and EmployeeData row into memory and deletes the whole tree in one
+transaction, holding SQLite's write lock throughout. The functions here delete
+descendants bottom-up with set-based ``DELETE ... WHERE id IN (...)``
+statements of at most DELETE_CHUNK_SIZE rows, each in its own transaction,
+pausing DELETE_CHUNK_PAUSE seconds in between so other writers get a turn.
+
+With DELETE_IN_BACKGROUND the views only hide the template/field (by setting
+``deleted_at``, which the default managers filter out) and queue the purge
+on the job queue (``manage.py runworker``).
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .activity import log as log_activity
+from .changes import record, record_deletes
+from .fingerprints import refresh_template
+from .jobs import enqueue
+from .models import FormTemplate, FormField, Employee, EmployeeData, ArchivedEmployee, FieldValueCode
+from .storage import strip_field, uses_document
+
+CHUNK_SIZE = getattr(settings, 'DELETE_CHUNK_SIZE', 1000)
+CHUNK_PAUSE = getattr(settings, 'DELETE_CHUNK_PAUSE', 0.01)
+
+
+def in_background():
+    return getattr(settings, 'DELETE_IN_BACKGROUND', False)
+
+
+def delete_in_chunks(queryset, chunk_size=None, pause=None, record=True):
+    """
+    Delete the rows of ``queryset`` without signals or cascades, one bounded
+    chunk per transaction, recording them in the change log unless ``record``
+    is off. Children must already be gone. Returns the count.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    pause = CHUNK_PAUSE if pause is None else pause
+    model = queryset.model
+    deleted = 0
+    while True:
+        with transaction.atomic(using=queryset.db):
+            ids = list(queryset.order_by().values_list('pk', flat=True)[:chunk_size])
+            if not ids:
+                break
+            # _raw_delete issues a single DELETE ... WHERE without collecting rows
+            chunk = model._base_manager.using(queryset.db).filter(pk__in=ids)
+            if record:
+                record_deletes(chunk)
+            deleted += chunk._raw_delete(queryset.db)
+        if len(ids) < chunk_size:
+            break
+        if pause:
+            time.sleep(pause)
+    return deleted
+
+
+def purge_employees(employee_ids):
+    """Delete the given employees and their data."""
+    employee_ids = list(employee_ids)
+    deleted = 0
+    for start in range(0, len(employee_ids), CHUNK_SIZE):
+        batch = employee_ids[start:start + CHUNK_SIZE]
+        deleted += delete_in_chunks(EmployeeData.all_objects.filter(employee_id__in=batch))
+        deleted += delete_in_chunks(Employee.all_objects.filter(pk__in=batch))
+    return deleted
+
+
+def purge_field(field_id):
+    field = FormField.all_objects.filter(pk=field_id).values('form_template_id', 'is_key').first()
+    if uses_document():
+        strip_field(field_id)
+    deleted = delete_in_chunks(EmployeeData.all_objects.filter(field_id=field_id))
+    deleted += delete_in_chunks(FieldValueCode.objects.filter(field_id=field_id))
+    deleted += _delete_hidden(FormField.all_objects.filter(pk=field_id))
+    if field and field['is_key']:
+        refresh_template(field['form_template_id'])
+    return deleted
+
+
+def purge_template(template_id):
+    deleted = delete_in_chunks(EmployeeData.all_objects.filter(employee__form_template_id=template_id))
+    deleted += delete_in_chunks(Employee.all_objects.filter(form_template_id=template_id))
+    deleted += delete_in_chunks(ArchivedEmployee.objects.filter(form_template_id=template_id))
+    # Data rows can only be left over for fields here if they were added concurrently
+    deleted += delete_in_chunks(EmployeeData.all_objects.filter(field__form_template_id=template_id))
+    deleted += delete_in_chunks(FieldValueCode.objects.filter(field__form_template_id=template_id))
+    deleted += _delete_hidden(FormField.all_objects.filter(form_template_id=template_id))
+    deleted += _delete_hidden(FormTemplate.all_objects.filter(pk=template_id))
+    return deleted
+
+
+def _delete_hidden(queryset):
+    # Soft-deleted rows were recorded when they were hidden
+    deleted = delete_in_chunks(queryset.filter(deleted_at__isnull=False), record=False)
+    return deleted + delete_in_chunks(queryset.filter(deleted_at__isnull=True))
+
+
+def delete_employee(employee):
+    log_activity(employee, 'delete')
+    return purge_employees([employee.pk])
+
+
+def delete_field(field, user=None):
+    """
+    Delete ``field`` and its values. Returns the purge Job when the work was
+    handed to the background, otherwise None.
+    """
+    log_activity(field, 'delete')
+    if not in_background():
+        purge_field(field.pk)
+        return None
+    FormField.all_objects.filter(pk=field.pk).update(deleted_at=timezone.now())
+    record(field, 'delete')
+    return enqueue(purge_field, field.pk, user=user)
+
+
+def delete_template(template, user=None):
+    """Like delete_field(), for a whole template with its fields and employees."""
+    log_activity(template, 'delete')
+    if not in_background():
+        purge_template(template.pk)
+        return None
+    FormTemplate.all_objects.filter(pk=template.pk).update(deleted_at=timezone.now())
+    record(template, 'delete')
+    return enqueue(purge_template, template.pk, user=user)
@@ -0,0 +1,182 @@
+"""
+Dictionary encoding of enumerated field values.
+
+Values of select, radio and checkbox fields repeat a handful of strings, so
+in the EmployeeData layout they are stored as small integer codes
+(``EmployeeData.code``, with ``value`` left empty) that index a per-field
+FieldValueCode table. Equality filters and group-by counts run on the
+indexed ``(field, code)`` pair; only the few distinct values are ever
+decoded.
+
+Each process keeps the dictionaries it has seen in memory. Codes are only
+ever added, never changed, so a cached dictionary can only be missing
+entries, and a miss simply reloads the field's dictionary. A dictionary
+read inside a transaction may hold entries that transaction added and may
+yet roll back, so it is only cached once the transaction commits; a code
+that is nowhere in the dictionary raises UnknownCode rather than reading
+as a blank value.
+
+``manage.py encode_field_values`` encodes rows written before this existed;
+until then rows with no code keep their plain value and read as before.
+"""
+import threading
+from collections import defaultdict
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, Exists, Max, OuterRef
+
+from .models import FormField, EmployeeData, FieldValueCode
+
+ENCODED_TYPES = ('select', 'radio', 'checkbox')
+ASSIGN_ATTEMPTS = 5
+
+# (alias, field id) -> {code: value} / {value: code}
+_values = {}
+_codes = {}
+_lock = threading.Lock()
+
+
+class UnknownCode(LookupError):
+    """A stored code that the field's dictionary doesn't have."""
+
+
+def _load(alias, field_id):
+    """Read a field's dictionary; returns ``({code: value}, {value: code})``."""
+    pairs = list(FieldValueCode.objects.using(alias).filter(field_id=field_id).values_list('code', 'value'))
+    values = dict(pairs)
+    codes = {value: code for code, value in pairs}
+
+    def cache():
+        with _lock:
+            _values[alias, field_id] = values
+            _codes[alias, field_id] = codes
+
+    if connections[alias].in_atomic_block:
+        # Only once it is certain that every entry read here exists
+        transaction.on_commit(cache, using=alias)
+    else:
+        cache()
+    return values, codes
+
+
+def preload(alias, limit=None):
+    """
+    Load the dictionaries of ``alias`` in one query, at most ``limit``
+    entries; returns how many were loaded. A field cut short by the limit
+    reloads on its first miss like any other.
+    """
+    rows = FieldValueCode.objects.using(alias).order_by('field_id', 'code').values_list('field_id', 'code', 'value')
+    if limit is not None:
+        rows = rows[:limit]
+    loaded = defaultdict(dict)
+    for field_id, code, value in rows:
+        loaded[field_id][code] = value
+    with _lock:
+        for field_id, values in loaded.items():
+            _values[alias, field_id] = values
+            _codes[alias, field_id] = {value: code for code, value in values.items()}
+    return sum(len(values) for values in loaded.values())
+
+
+def decode(alias, field_id, code):
+    values = _values.get((alias, field_id))
+    if values is None or code not in values:
+        values = _load(alias, field_id)[0]
+    if code not in values:
+        raise UnknownCode(f'Field {field_id} has no dictionary entry for code {code} on {alias}')
+    return values[code]
+
+
+def decode_value(alias, field_id, value, code):
+    """The stored value of an EmployeeData row, given its ``value`` and ``code`` columns."""
+    return value if code is None else decode(alias, field_id, code)
+
+
+def codes_for(alias, field_id, values):
+    """``{value: code}`` for ``values``, adding dictionary entries as needed."""
+    values = set(values)
+    known = _codes.get((alias, field_id), {})
+    for _ in range(ASSIGN_ATTEMPTS):
+        missing = values - known.keys()
+        if not missing:
+            return {value: known[value] for value in values}
+        known = _load(alias, field_id)[1]
+        missing = values - known.keys()
+        if missing:
+            try:
+                with transaction.atomic(using=alias):
+                    top = FieldValueCode.objects.using(alias).filter(field_id=field_id).aggregate(top=Max('code'))['top']
+                    FieldValueCode.objects.using(alias).bulk_create([
+                        FieldValueCode(field_id=field_id, code=(top or 0) + i, value=value)
+                        for i, value in enumerate(sorted(missing), 1)
+                    ])
+            except IntegrityError:
+                # Another writer added codes at the same time; reload and retry
+                pass
+            known = _load(alias, field_id)[1]
+    raise RuntimeError(f'Could not assign dictionary codes for field {field_id}')
+
+
+def encoded_field_ids(alias, field_ids):
+    return set(FormField.all_objects.using(alias).filter(
+        pk__in=field_ids, field_type__in=ENCODED_TYPES
+    ).values_list('pk', flat=True))
+
+
+def encode_data(rows, alias):
+    """
+    Set ``code`` (and blank ``value``) on the EmployeeData ``rows`` of
+    enumerated fields, in place; other rows get ``code = None``.
+    """
+    encoded = encoded_field_ids(alias, {row.field_id for row in rows})
+    by_field = defaultdict(list)
+    for row in rows:
+        if row.field_id in encoded:
+            by_field[row.field_id].append(row)
+        else:
+            row.code = None
+    for field_id, field_rows in by_field.items():
+        codes = codes_for(alias, field_id, {row.value for row in field_rows})
+        for row in field_rows:
+            row.code = codes[row.value]
+            row.value = ''
+
+
+def matching_rows(field_id, value):
+    """EmployeeData rows of ``field_id`` equal to ``value``, whether encoded or not."""
+    rows = EmployeeData.objects.filter(field_id=field_id)
+    alias = rows.db
+    code = _codes.get((alias, field_id), {}).get(value)
+    if code is None:
+        code = _load(alias, field_id)[1].get(value)
+    if code is None:
+        return rows.filter(code__isnull=True, value=value)
+    return rows.filter(code=code) | rows.filter(code__isnull=True, value=value)
+
+
+def value_counts(field_id, employees=None):
+    """
+    ``[(value, count)]`` for a field, most common first, grouped on codes;
+    only over the ``employees`` queryset when given.
+    """
+    rows = EmployeeData.objects.filter(field_id=field_id)
+    if employees is not None:
+        rows = rows.filter(employee__in=employees.values('pk'))
+    alias = rows.db
+    counts = defaultdict(int)
+    for code, n in rows.filter(code__isnull=False).values_list('code').annotate(n=Count('id')).order_by():
+        counts[decode(alias, field_id, code)] += n
+    # Rows written before the field was encoded
+    for value, n in rows.filter(code__isnull=True).values_list('value').annotate(n=Count('id')).order_by():
+        counts[value] += n
+    return sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+
+
+def search_expression(query):
+    """
+    For ``Employee`` filters: true when an encoded value of the employee
+    contains ``query`` (case-insensitive). Matches the dictionary, not the rows.
+    """
+    return Exists(EmployeeData.objects.filter(employee=OuterRef('pk')).filter(Exists(
+        FieldValueCode.objects.filter(field=OuterRef('field'), code=OuterRef('code'), value__icontains=query)
+    )))
@@ -0,0 +1,89 @@
+"""
+In-process pub/sub for the live activity stream (``activity_stream_view``).
+
+Signal handlers publish events for a user from whatever thread did the write;
+each connected SSE client holds a Subscription whose bounded asyncio queue
+lives on the ASGI event loop. Delivery is handed to that loop with one
+``call_soon_threadsafe`` per loop and publish, not per subscriber.
+
+A subscriber that falls ACTIVITY_STREAM_QUEUE_SIZE events behind has its
+backlog dropped and receives a single ``resync`` event instead, so a slow
+client can never make the server buffer without bound.
+
+Events only reach clients connected to the same worker process that made
+the change; cross-process consumers should use the change feed.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+QUEUE_SIZE = getattr(settings, 'ACTIVITY_STREAM_QUEUE_SIZE', 100)
+RESYNC_EVENT = {'type': 'resync'}
+
+
+class Subscription:
+    def __init__(self, user_id, loop, maxsize):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize)
+        self.dropped = 0
+
+    def deliver(self, event):
+        """Queue ``event``; must run on ``self.loop``."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize()
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self):
+        return await self.queue.get()
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+
+    def subscribe(self, user_id, maxsize=QUEUE_SIZE):
+        subscription = Subscription(user_id, asyncio.get_running_loop(), maxsize)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        by_loop = defaultdict(list)
+        for subscription in subscriptions:
+            by_loop[subscription.loop].append(subscription)
+        for loop, targets in by_loop.items():
+            try:
+                loop.call_soon_threadsafe(_deliver_all, targets, event)
+            except RuntimeError:
+                # The loop has shut down; its subscribers are gone with it
+                pass
+
+
+def _deliver_all(subscriptions, event):
+    for subscription in subscriptions:
+        subscription.deliver(event)
+
+
+broker = Broker()
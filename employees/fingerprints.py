@@ -0,0 +1,100 @@
+"""
+Duplicate detection.
+
+Each employee carries a fingerprint: a hash of the normalized values of its
+template's key fields (FormField.is_key). Employees sharing a non-empty
+fingerprint under the same template are duplicates, so finding them, or
+checking a new record before it is saved, is a lookup on the
+``(form_template, fingerprint)`` index instead of a pairwise comparison of
+values.
+
+storage.write_values() refreshes the fingerprint of the employee it wrote;
+changing a template's key fields refreshes all of its employees, and
+``manage.py fingerprint_employees`` backfills existing data.
+"""
+import hashlib
+import re
+import unicodedata
+
+from django.db.models import Count
+
+from .models import Employee, FormField
+from .storage import values_for
+
+CHUNK_SIZE = 500
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize(value):
+    """Case-, width- and whitespace-insensitive form of ``value``."""
+    value = unicodedata.normalize('NFKC', str(value)).casefold()
+    return WHITESPACE_RE.sub(' ', value).strip()
+
+
+def fingerprint(key_field_ids, values):
+    """
+    Fingerprint of ``values`` ({field_id: value}) over ``key_field_ids``;
+    '' when there are no key fields or none of them has a value.
+    """
+    parts = [normalize(values.get(field_id, '')) for field_id in key_field_ids]
+    if not any(parts):
+        return ''
+    data = '\x1f'.join(f'{field_id}\x1e{part}' for field_id, part in zip(key_field_ids, parts))
+    return hashlib.blake2b(data.encode(), digest_size=16).hexdigest()
+
+
+def key_field_ids(template_id):
+    return sorted(FormField.objects.filter(form_template_id=template_id, is_key=True).values_list('pk', flat=True))
+
+
+def refresh_fingerprints(template_id, employee_ids, key_ids=None):
+    """Recompute the fingerprints of ``employee_ids`` (all of one template)."""
+    if key_ids is None:
+        key_ids = key_field_ids(template_id)
+    values = values_for(employee_ids, key_ids) if key_ids else {pk: {} for pk in employee_ids}
+    current = dict(Employee.all_objects.filter(pk__in=employee_ids).values_list('pk', 'fingerprint'))
+    changed = [
+        Employee(pk=pk, fingerprint=new)
+        for pk, new in ((pk, fingerprint(key_ids, values[pk])) for pk in current)
+        if new != current[pk]
+    ]
+    # bulk_update, so derived data doesn't show up in the activity journal
+    Employee.all_objects.bulk_update(changed, ['fingerprint'])
+    return len(changed)
+
+
+def refresh_template(template_id, chunk_size=CHUNK_SIZE):
+    """Recompute every fingerprint of a template, in pk order. Returns the number changed."""
+    key_ids = key_field_ids(template_id)
+    employees = Employee.all_objects.filter(form_template_id=template_id).order_by('pk')
+    changed = 0
+    last_pk = 0
+    while True:
+        ids = list(employees.filter(pk__gt=last_pk).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return changed
+        changed += refresh_fingerprints(template_id, ids, key_ids)
+        last_pk = ids[-1]
+
+
+def duplicate_groups(template, limit=100):
+    """Up to ``limit`` lists of duplicate employee ids under ``template``."""
+    shared = list(
+        Employee.objects.filter(form_template=template).exclude(fingerprint='')
+        .values('fingerprint').annotate(n=Count('id')).filter(n__gt=1)
+        .order_by('-n', 'fingerprint').values_list('fingerprint', flat=True)[:limit]
+    )
+    groups = {fp: [] for fp in shared}
+    for pk, fp in Employee.objects.filter(form_template=template, fingerprint__in=shared).order_by('pk').values_list(
+        'pk', 'fingerprint'
+    ):
+        groups[fp].append(pk)
+    return [{'fingerprint': fp, 'employees': ids} for fp, ids in groups.items()]
+
+
+def find_duplicates(template, values):
+    """``(fingerprint, ids of existing employees with it)`` for unsaved ``values``."""
+    fp = fingerprint(key_field_ids(template.pk), {int(k): v for k, v in values.items()})
+    if not fp:
+        return fp, []
+    return fp, list(Employee.objects.filter(form_template=template, fingerprint=fp).values_list('pk', flat=True))
@@ -23,4 +23,4 @@ class FormTemplateForm(forms.ModelForm):
 class FormFieldForm(forms.ModelForm):
     class Meta:
         model = FormField
-        fields = ('label', 'field_type', 'required')
\ No newline at end of file
+        fields = ('label', 'field_type', 'required', 'is_key')
\ No newline at end of file
@@ -0,0 +1,81 @@
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Square edge length in pixels for each named avatar size. Sizes are roughly
+# twice the largest CSS size they are shown at so they stay sharp on HiDPI.
+THUMBNAIL_SIZES = getattr(settings, 'PROFILE_THUMBNAIL_SIZES', {
+    'sm': 64,
+    'md': 300,
+})
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+THUMBNAIL_DIR = 'profile_pics/thumbs'
+
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'PROFILE_THUMBNAIL_WORKERS', 2),
+    thread_name_prefix='thumbnails',
+)
+
+
+def thumbnail_name(digest, size, fmt):
+    return f'{THUMBNAIL_DIR}/{digest}_{THUMBNAIL_SIZES[size]}.{fmt}'
+
+
+def generate_thumbnails(user_id, picture_name):
+    """
+    Build every size/format thumbnail for ``picture_name`` and record its
+    content hash on the user. Thumbnail names are derived from the hash, so
+    existing files are reused and the URLs can be cached forever.
+    """
+    from .models import CustomUser
+
+    with default_storage.open(picture_name, 'rb') as fh:
+        original = fh.read()
+    digest = hashlib.sha256(original).hexdigest()[:16]
+
+    with Image.open(io.BytesIO(original)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGB')
+        for size, edge in THUMBNAIL_SIZES.items():
+            thumb = ImageOps.fit(image, (edge, edge), Image.Resampling.LANCZOS)
+            for fmt, (pil_format, options) in THUMBNAIL_FORMATS.items():
+                name = thumbnail_name(digest, size, fmt)
+                if default_storage.exists(name):
+                    continue
+                buffer = io.BytesIO()
+                thumb.save(buffer, pil_format, **options)
+                default_storage.save(name, ContentFile(buffer.getvalue()))
+
+    # Only record the hash if the picture wasn't replaced in the meantime.
+    CustomUser.objects.filter(pk=user_id, profile_picture=picture_name).update(
+        profile_picture_hash=digest
+    )
+    return digest
+
+
+def _run(user_id, picture_name):
+    try:
+        generate_thumbnails(user_id, picture_name)
+    except Exception:
+        logger.exception('Thumbnail generation failed for user %s', user_id)
+    finally:
+        connection.close()
+
+
+def schedule_thumbnails(user):
+    """Generate thumbnails for ``user`` in the background once the transaction commits."""
+    if not user.profile_picture:
+        return
+    user_id, picture_name = user.pk, user.profile_picture.name
+    transaction.on_commit(lambda: _executor.submit(_run, user_id, picture_name))
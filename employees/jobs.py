@@ -0,0 +1,203 @@
+"""
+A small database-backed job queue.
+
+Jobs are rows in ``employees_job``. Workers (``manage.py runworker``) claim
+one job at a time with a single ``UPDATE ... RETURNING`` statement, so two
+workers can never run the same job. While a job runs its worker refreshes
+the lock every JOB_HEARTBEAT_INTERVAL, so a job whose lock is older than
+JOB_LOCK_TIMEOUT lost its worker and is picked up again, or marked failed if
+it has used up ``max_attempts``. Failed jobs are retried with exponential
+backoff until ``max_attempts`` is reached.
+
+Tasks are plain module-level functions, referenced by dotted path::
+
+    job = enqueue('employees.images.generate_thumbnails', user.pk, name)
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import traceback
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, connection, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Job
+from .sharding import use_tenant
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+LOCK_TIMEOUT = getattr(settings, 'JOB_LOCK_TIMEOUT', timedelta(minutes=10))
+HEARTBEAT_INTERVAL = getattr(settings, 'JOB_HEARTBEAT_INTERVAL', LOCK_TIMEOUT / 3)
+RETRY_BASE_DELAY = getattr(settings, 'JOB_RETRY_BASE_DELAY', 5)
+RETRY_MAX_DELAY = getattr(settings, 'JOB_RETRY_MAX_DELAY', 3600)
+
+
+def _task_path(task):
+    if callable(task):
+        return f'{task.__module__}.{task.__qualname__}'
+    return task
+
+
+def enqueue(task, *args, user=None, delay=None, max_attempts=5, **kwargs):
+    """
+    Queue ``task`` (a function or its dotted path) to run with ``args`` and
+    ``kwargs``, which must be JSON serializable. Returns the Job row.
+    """
+    run_at = timezone.now() + (delay or timedelta())
+    return Job.objects.create(
+        task=_task_path(task),
+        args=list(args),
+        kwargs=kwargs,
+        run_at=run_at,
+        max_attempts=max_attempts,
+        created_by=user,
+    )
+
+
+def enqueue_on_commit(task, *args, **kwargs):
+    """Like enqueue(), but only once the surrounding transaction commits."""
+    transaction.on_commit(lambda: enqueue(task, *args, **kwargs))
+
+
+def retry_delay(attempts):
+    delay = min(RETRY_BASE_DELAY * 2 ** (attempts - 1), RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def fail_abandoned(now=None):
+    """
+    Mark failed the running jobs whose worker died on their last attempt;
+    claim() would never pick them up again. Returns how many there were.
+    """
+    now = now or timezone.now()
+    return Job.objects.filter(
+        status='running', locked_at__lt=now - LOCK_TIMEOUT, attempts__gte=F('max_attempts'),
+    ).update(
+        status='failed', finished_at=now,
+        last_error=f'Worker lost on the last attempt (no heartbeat for {LOCK_TIMEOUT}).',
+    )
+
+
+def claim(worker_id):
+    """Atomically lock the next due job for ``worker_id`` and return it, or None."""
+    now = timezone.now()
+    failed = fail_abandoned(now)
+    if failed:
+        logger.warning('Marked %s abandoned job(s) as failed', failed)
+    to_db = connection.ops.adapt_datetimefield_value
+    table = connection.ops.quote_name(Job._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            UPDATE {table}
+            SET status = 'running', attempts = attempts + 1, locked_by = %s, locked_at = %s
+            WHERE id = (
+                SELECT id FROM {table}
+                WHERE (status = 'queued' AND run_at <= %s)
+                   OR (status = 'running' AND locked_at < %s AND attempts < max_attempts)
+                ORDER BY run_at, id
+                LIMIT 1
+            )
+            RETURNING id
+            """,
+            [worker_id, to_db(now), to_db(now), to_db(now - LOCK_TIMEOUT)],
+        )
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return Job.objects.get(pk=row[0])
+
+
+def refresh_lock(job):
+    """Push back ``job``'s lock expiry; False once another worker or outcome took it over."""
+    return bool(Job.objects.filter(pk=job.pk, status='running', locked_by=job.locked_by).update(
+        locked_at=timezone.now(),
+    ))
+
+
+@contextmanager
+def heartbeat(job, interval=None):
+    """Refresh ``job``'s lock from a background thread until the block exits."""
+    interval = (interval or HEARTBEAT_INTERVAL).total_seconds()
+    stop = threading.Event()
+
+    def beat():
+        try:
+            while not stop.wait(interval):
+                try:
+                    if not refresh_lock(job):
+                        break
+                except DatabaseError:
+                    logger.warning('Could not refresh the lock of job %s', job.pk, exc_info=True)
+        finally:
+            connection.close()
+
+    thread = threading.Thread(target=beat, name=f'job-{job.pk}-heartbeat', daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome."""
+    try:
+        func = import_string(job.task)
+        with heartbeat(job), use_tenant(job.created_by_id):
+            result = func(*job.args, **job.kwargs)
+    except Exception:
+        error = traceback.format_exc()
+        logger.warning('Job %s (%s) failed on attempt %s', job.pk, job.task, job.attempts)
+        if job.attempts < job.max_attempts:
+            Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+                status='queued',
+                run_at=timezone.now() + retry_delay(job.attempts),
+                locked_by='',
+                locked_at=None,
+                last_error=error,
+            )
+        else:
+            Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+                status='failed', finished_at=timezone.now(), last_error=error,
+            )
+        return False
+
+    Job.objects.filter(pk=job.pk, locked_by=job.locked_by).update(
+        status='succeeded',
+        finished_at=timezone.now(),
+        result=result if _is_json(result) else repr(result),
+    )
+    return True
+
+
+def _is_json(value):
+    return value is None or isinstance(value, (str, int, float, bool, list, dict))
+
+
+def worker_loop(stop_event, worker_id=None, burst=False):
+    """
+    Claim and run jobs until ``stop_event`` is set. With ``burst`` the loop
+    exits as soon as the queue is empty.
+    """
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+    try:
+        while not stop_event.is_set():
+            job = claim(worker_id)
+            if job is None:
+                if burst:
+                    break
+                stop_event.wait(POLL_INTERVAL)
+                continue
+            run_job(job)
+    finally:
+        connections.close_all()
@@ -0,0 +1,56 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from employees.archive import CHUNK_SIZE, archive_employees, restore_employees
+from employees.models import Employee, EmployeeData, ArchivedEmployee
+from employees.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = 'Move inactive employees to the compressed archive table, or restore them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--inactive-days', type=int, help='Employees not updated for this many days')
+        parser.add_argument('--template', type=int, action='append', default=[], metavar='TEMPLATE_ID')
+        parser.add_argument('--user', type=int, action='append', default=[], metavar='USER_ID')
+        parser.add_argument('--ids', type=int, nargs='+', default=[], metavar='EMPLOYEE_ID')
+        parser.add_argument('--restore', action='store_true', help='Restore matching archived employees instead')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options['inactive_days'] is None and not any(options[name] for name in ('template', 'user', 'ids')):
+            raise CommandError('Pass at least one of --inactive-days, --template, --user, --ids')
+        for alias in each_shard():
+            self.stdout.write(f'{alias}: before: {self.hot_stats()}')
+            model = ArchivedEmployee if options['restore'] else Employee
+            queryset = self.select(model._default_manager.all(), options)
+            move = restore_employees if options['restore'] else archive_employees
+            moved = 0
+            for last_pk, count in move(queryset, options['chunk_size']):
+                moved += count
+                self.stdout.write(f'{alias}: {moved} moved, up to id {last_pk}')
+            self.stdout.write(f'{alias}: after: {self.hot_stats()}')
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def select(self, queryset, options):
+        if options['inactive_days'] is not None:
+            threshold = timezone.now() - timedelta(days=options['inactive_days'])
+            queryset = queryset.filter(updated_at__lt=threshold)
+        if options['template']:
+            queryset = queryset.filter(form_template_id__in=options['template'])
+        if options['user']:
+            queryset = queryset.filter(created_by_id__in=options['user'])
+        if options['ids']:
+            queryset = queryset.filter(pk__in=options['ids'])
+        return queryset
+
+    def hot_stats(self):
+        started = time.perf_counter()
+        employees = Employee.all_objects.count()
+        values = EmployeeData.all_objects.count()
+        elapsed = (time.perf_counter() - started) * 1000
+        archived = ArchivedEmployee.objects.count()
+        return f'{employees} employees / {values} values hot (counted in {elapsed:.1f}ms), {archived} archived'
@@ -0,0 +1,88 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from employee_portal import traffic
+from employees.backup import BackupError, backup, restore
+
+
+class Command(BaseCommand):
+    help = ('Back up the SQLite databases while they stay in use, and report how much '
+            'the backup slowed concurrent requests')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', action='append', default=[], metavar='ALIAS',
+                            help='Database alias to back up (default: all of them)')
+        parser.add_argument('--output', help='Backup directory (default: BACKUP_DIR)')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only keep the pages that differ from the latest full backup')
+        parser.add_argument('--compress', action='store_true', help='Gzip the backup')
+        parser.add_argument('--verify', action='store_true',
+                            help='Run an integrity check on the copy and a trial restore of snapshots')
+        parser.add_argument('--pages', type=int, help='Pages copied per step (default: BACKUP_PAGES)')
+        parser.add_argument('--sleep', type=float, help='Seconds between steps (default: BACKUP_SLEEP)')
+        parser.add_argument('--baseline', type=float, default=10,
+                            help='Seconds of traffic to measure before the backup, for comparison; 0 skips it')
+        parser.add_argument('--restore', metavar='MANIFEST', help='Rebuild the database of a backup instead')
+        parser.add_argument('--to', metavar='PATH', help='Where --restore writes the database')
+
+    def handle(self, *args, **options):
+        if options['restore']:
+            return self.restore(options)
+        aliases = options['database'] or list(settings.DATABASES)
+        unknown = [alias for alias in aliases if alias not in settings.DATABASES]
+        if unknown:
+            raise CommandError(f'Unknown database: {", ".join(unknown)}')
+
+        baseline = None
+        if options['baseline'] > 0:
+            self.stdout.write(f'Measuring {options["baseline"]:g}s of traffic before the backup...')
+            before = traffic.totals()
+            time.sleep(options['baseline'])
+            baseline = traffic.window(before, traffic.totals())
+        for alias in aliases:
+            try:
+                manifest = backup(
+                    alias, incremental=options['incremental'], compress=options['compress'],
+                    verify=options['verify'], directory=options['output'],
+                    pages=options['pages'], sleep=options['sleep'],
+                )
+            except BackupError as exc:
+                raise CommandError(str(exc))
+            copy = manifest['copy']
+            self.stdout.write(
+                f'{alias}: {manifest["kind"]} backup {manifest["file"]}: '
+                f'{manifest["pages_written"]}/{manifest["page_count"]} pages, {manifest["bytes"]} bytes, '
+                f'{copy["steps"]} steps in {copy["seconds"]}s, {copy["restarts"]} restarts'
+                + (', finished in one step' if copy['final_step'] else '')
+                + (f', integrity {manifest["integrity"]}' if manifest['integrity'] else '')
+            )
+            if baseline is not None:
+                self.report(baseline, copy['traffic'])
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def report(self, baseline, during):
+        if during is None:
+            self.stdout.write('  traffic: counters were reset during the copy, no comparison')
+            return
+        for label, window in (('before', baseline), ('during the copy', during)):
+            mean = f'{window["mean_ms"]} ms mean' if window['mean_ms'] is not None else 'no requests'
+            self.stdout.write(f'  traffic {label}: {window["per_second"]} req/s, {mean} over {window["seconds"]}s')
+        if baseline['mean_ms'] and during['mean_ms']:
+            slowdown = (during['mean_ms'] / baseline['mean_ms'] - 1) * 100
+            self.stdout.write(f'  mean request latency {slowdown:+.1f}% during the copy')
+
+    def restore(self, options):
+        if not options['to']:
+            raise CommandError('--restore needs --to PATH')
+        if os.path.exists(options['to']):
+            raise CommandError(f'{options["to"]} already exists; restore to a new path')
+        try:
+            manifest = restore(options['restore'], options['to'], options['output'])
+        except (BackupError, OSError) as exc:
+            raise CommandError(str(exc))
+        self.stdout.write(self.style.SUCCESS(
+            f'Restored {manifest["alias"]} ({manifest["kind"]} backup of {manifest["created"]}) to {options["to"]}'
+        ))
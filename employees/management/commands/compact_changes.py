@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+from django.utils import timezone
+
+from employees.deletion import delete_in_chunks
+from employees.models import ChangeLogEntry
+from employees.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = 'Trim old entries from the change feed log'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, help='Delete entries older than this many days')
+        parser.add_argument('--before-seq', type=int, help='Delete entries with a sequence number below this')
+
+    def handle(self, *args, **options):
+        if options['keep_days'] is None and options['before_seq'] is None:
+            raise CommandError('Pass --keep-days and/or --before-seq')
+        for alias in each_shard():
+            self.compact(alias, options)
+
+    def compact(self, alias, options):
+        latest = ChangeLogEntry.objects.aggregate(seq=Max('id'))['seq']
+        if latest is None:
+            return
+        # Only ever remove a prefix and keep the newest entry, so the feed can
+        # tell clients whose ``since`` was compacted away (see employees.changes)
+        cutoff = latest
+        if options['before_seq'] is not None:
+            cutoff = min(cutoff, options['before_seq'])
+        if options['keep_days'] is not None:
+            threshold = timezone.now() - timedelta(days=options['keep_days'])
+            newest_old = ChangeLogEntry.objects.filter(created_at__lt=threshold).aggregate(seq=Max('id'))['seq']
+            cutoff = min(cutoff, (newest_old or 0) + 1)
+
+        deleted = delete_in_chunks(ChangeLogEntry.objects.filter(id__lt=cutoff))
+        self.stdout.write(self.style.SUCCESS(f'{alias}: removed {deleted} change log entries below seq {cutoff}'))
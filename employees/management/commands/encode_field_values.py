@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Sum
+from django.db.models.functions import Length
+
+from employees.dictionary import ENCODED_TYPES, codes_for
+from employees.models import FormField, EmployeeData, FieldValueCode
+from employees.sharding import db_for_model, each_shard
+
+CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = 'Dictionary-encode existing select/radio/checkbox values and report the space saved'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--field', type=int, action='append', default=[], metavar='FIELD_ID')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        for alias in each_shard():
+            fields = FormField.all_objects.filter(field_type__in=ENCODED_TYPES).order_by('pk')
+            if options['field']:
+                fields = fields.filter(pk__in=options['field'])
+            field_ids = list(fields.values_list('pk', flat=True))
+            before = self.value_bytes(field_ids)
+            encoded = sum(self.encode(field_id, options['chunk_size']) for field_id in field_ids)
+            after = self.value_bytes(field_ids)
+            codes = FieldValueCode.objects.filter(field_id__in=field_ids)
+            dictionary = codes.aggregate(n=Sum(Length('value')))['n'] or 0
+            self.stdout.write(
+                f'{alias}: encoded {encoded} values of {len(field_ids)} fields; value text {before} -> {after} bytes, '
+                f'plus {codes.count()} dictionary entries ({dictionary} bytes) and one integer per row. '
+                f'Run VACUUM to return the freed pages to the filesystem.'
+            )
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def value_bytes(self, field_ids):
+        return EmployeeData.all_objects.filter(field_id__in=field_ids).aggregate(n=Sum(Length('value')))['n'] or 0
+
+    def encode(self, field_id, chunk_size):
+        plain = EmployeeData.all_objects.filter(field_id=field_id, code__isnull=True)
+        alias = db_for_model(EmployeeData)
+        codes_for(alias, field_id, plain.values_list('value', flat=True).distinct())
+        connection = connections[alias]
+        table = connection.ops.quote_name(EmployeeData._meta.db_table)
+        dictionary = connection.ops.quote_name(FieldValueCode._meta.db_table)
+        encoded = 0
+        while True:
+            with transaction.atomic(using=alias), connection.cursor() as cursor:
+                cursor.execute(
+                    f'UPDATE {table} SET "code" = (SELECT d."code" FROM {dictionary} d '
+                    f'WHERE d."field_id" = {table}."field_id" AND d."value" = {table}."value"), "value" = \'\' '
+                    f'WHERE id IN (SELECT id FROM {table} WHERE "field_id" = %s AND "code" IS NULL LIMIT %s)',
+                    [field_id, chunk_size],
+                )
+                rowcount = cursor.rowcount
+            encoded += rowcount
+            if rowcount < chunk_size:
+                return encoded
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from employees.fingerprints import CHUNK_SIZE, refresh_template
+from employees.models import FormTemplate
+from employees.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the duplicate-detection fingerprints of existing employees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', type=int, action='append', default=[], metavar='TEMPLATE_ID',
+                            help='Only this template (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        for alias in each_shard():
+            templates = FormTemplate.objects.order_by('pk')
+            if options['template']:
+                templates = templates.filter(pk__in=options['template'])
+            for template_id in templates.values_list('pk', flat=True):
+                changed = refresh_template(template_id, options['chunk_size'])
+                self.stdout.write(f'{alias}: template {template_id}: {changed} fingerprints updated')
+        self.stdout.write(self.style.SUCCESS('Fingerprints up to date'))
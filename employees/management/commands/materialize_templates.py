@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from employees import materialized
+from employees.models import FormTemplate
+from employees.reports import export, field_stats, report
+from employees.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = 'Build (or drop) the materialized report tables of form templates, and benchmark them against EAV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--template', type=int, action='append', default=[], metavar='TEMPLATE_ID')
+        parser.add_argument('--drop', action='store_true', help='Drop the tables instead')
+        parser.add_argument('--benchmark', action='store_true',
+                            help='Time report, stats and export queries on both paths instead of building')
+        parser.add_argument('--repeat', type=int, default=5, help='Benchmark runs per query; the best counts')
+
+    def handle(self, *args, **options):
+        if not (options['drop'] or options['benchmark'] or materialized.enabled()):
+            raise CommandError('Set MATERIALIZED_TABLES = True first, or the tables would go stale')
+        for alias in each_shard():
+            templates = FormTemplate.objects.order_by('pk')
+            if options['template']:
+                templates = templates.filter(pk__in=options['template'])
+            for template in templates:
+                if options['drop']:
+                    materialized.drop_table(template.pk)
+                    self.stdout.write(f'{alias}: dropped the table of template {template.pk}')
+                elif options['benchmark']:
+                    self.benchmark(alias, template, options['repeat'])
+                else:
+                    rows = 0
+                    for rows in materialized.rebuild(template.pk):
+                        pass
+                    self.stdout.write(f'{alias}: template {template.pk} ({template.name}): {rows} rows')
+        self.stdout.write(self.style.SUCCESS('Done'))
+
+    def benchmark(self, alias, template, repeat):
+        if not materialized.table_exists(template.pk):
+            self.stdout.write(f'{alias}: template {template.pk} has no table yet, skipped')
+            return
+        user = template.created_by
+        fields = materialized.active_fields(template.pk)
+        if not fields:
+            return
+        # Filter on the most common value of the first enumerated field, sort by the first field
+        filters = {}
+        for field in fields:
+            if field.field_type in ('select', 'radio'):
+                top = field_stats(template, user, field, backend='materialized')['top']
+                if top:
+                    filters = {field.pk: top[0][0]}
+                break
+        queries = {
+            'page': lambda backend: report(template, user, filters, fields[0].pk, True, 50, 0, backend),
+            'stats': lambda backend: [field_stats(template, user, f, filters, backend) for f in fields],
+            'export': lambda backend: sum(1 for _ in export(template, user, backend=backend)),
+        }
+        self.stdout.write(self.style.MIGRATE_HEADING(
+            f'{alias}: template {template.pk} ({template.name}), {len(fields)} fields, filter {filters or "none"}'
+        ))
+        for name, query in queries.items():
+            eav = self.best_of(repeat, query, 'eav')
+            table = self.best_of(repeat, query, 'materialized')
+            self.stdout.write(
+                f'  {name:<7} eav {eav:9.1f} ms   materialized {table:9.1f} ms   {eav / max(table, 0.001):6.1f}x'
+            )
+
+    def best_of(self, repeat, query, backend):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            query(backend)
+            elapsed = (time.perf_counter() - started) * 1000
+            best = elapsed if best is None else min(best, elapsed)
+        return best
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from employees.sharding import each_shard
+from employees.storage import (
+    BACKFILL_CHUNK_SIZE, backfill_documents, create_field_index, drop_field_index, storage_mode,
+)
+
+
+class Command(BaseCommand):
+    help = 'Backfill Employee.field_values from EmployeeData and manage JSON expression indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-after', type=int, default=0,
+                            help='Resume after this employee id')
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+        parser.add_argument('--index', type=int, action='append', default=[], metavar='FIELD_ID',
+                            help='Create a JSON1 expression index for this field id (repeatable)')
+        parser.add_argument('--drop-index', type=int, action='append', default=[], metavar='FIELD_ID',
+                            help='Drop the expression index for this field id (repeatable)')
+        parser.add_argument('--skip-backfill', action='store_true')
+
+    def handle(self, *args, **options):
+        if not options['skip_backfill'] and storage_mode() == 'eav':
+            raise CommandError("Set EMPLOYEE_STORAGE = 'dual' before backfilling so new writes aren't missed")
+        for alias in each_shard():
+            for field_id in options['index']:
+                create_field_index(field_id)
+                self.stdout.write(f'{alias}: indexed field {field_id}')
+            for field_id in options['drop_index']:
+                drop_field_index(field_id)
+                self.stdout.write(f'{alias}: dropped index for field {field_id}')
+            if options['skip_backfill']:
+                continue
+            for last_pk in backfill_documents(options['start_after'], options['chunk_size']):
+                self.stdout.write(f'{alias}: backfilled employees up to id {last_pk}')
+        if not options['skip_backfill']:
+            self.stdout.write(self.style.SUCCESS('Backfill complete'))
@@ -0,0 +1,114 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from employees import materialized
+from employees.deletion import delete_in_chunks
+from employees.models import (
+    CustomUser, TenantShard, FormTemplate, FormField, Employee, EmployeeData, ChangeLogEntry, ActivityEntry,
+    ArchivedEmployee, FieldValueCode,
+)
+from employees.sharding import (
+    OVERRIDE_CACHE_TIMEOUT, ensure_user_on_shard, forget_user, insert_rows, shard_aliases, shard_for_user,
+    use_shard,
+)
+
+COPY_CHUNK_SIZE = 500
+
+# Parents before children; deleted from the source in reverse order
+TENANT_ROWS = [
+    (FormTemplate, 'created_by_id'),
+    (FormField, 'form_template__created_by_id'),
+    (FieldValueCode, 'field__form_template__created_by_id'),
+    (Employee, 'created_by_id'),
+    (EmployeeData, 'employee__created_by_id'),
+    (ArchivedEmployee, 'created_by_id'),
+    (ActivityEntry, 'user_id'),
+]
+
+
+def _manager(model):
+    # Soft-deleted rows move too
+    return getattr(model, 'all_objects', model._default_manager)
+
+
+class Command(BaseCommand):
+    help = "Move a tenant's forms, employees and activity journal to another shard"
+
+    def add_arguments(self, parser):
+        parser.add_argument('user', help='User id or email')
+        parser.add_argument('--to', required=True, metavar='ALIAS', help='Target shard alias, e.g. shard_1')
+        parser.add_argument('--no-wait', action='store_true',
+                            help="Don't wait for cached shard assignments to expire after locking the tenant")
+
+    def handle(self, *args, **options):
+        target = options['to']
+        if target not in shard_aliases():
+            raise CommandError(f'{target} is not a shard; configured: {", ".join(shard_aliases()) or "none"}')
+        user = self.get_user(options['user'])
+        source = shard_for_user(user.pk)
+        if source == target:
+            self.stdout.write(f'User {user.pk} is already on {target}')
+            return
+
+        override, _ = TenantShard.objects.update_or_create(user=user, defaults={'shard': source, 'locked': True})
+        forget_user(user.pk)
+        if not options['no_wait']:
+            # Let other processes' cached assignments expire so they see the lock
+            self.stdout.write(f'Locked user {user.pk}, waiting {OVERRIDE_CACHE_TIMEOUT}s for caches to expire')
+            time.sleep(OVERRIDE_CACHE_TIMEOUT)
+
+        try:
+            ensure_user_on_shard(user.pk, target)
+            for model, owner_path in TENANT_ROWS:
+                copied = self.copy_rows(model, owner_path, user.pk, source, target)
+                self.stdout.write(f'Copied {copied} {model._meta.verbose_name_plural}')
+            if materialized.enabled():
+                # Copied rows bypass the change log, so build their tables directly
+                with use_shard(target):
+                    for template_id in _manager(FormTemplate).filter(created_by_id=user.pk).values_list('pk', flat=True):
+                        for _ in materialized.rebuild(template_id):
+                            pass
+            override.shard = target
+            override.save(update_fields=['shard'])
+        except Exception:
+            self.unlock(override)
+            raise
+
+        # The change log is not copied: the target numbers its own entries, so
+        # feed clients get a 410 and resync from the new shard
+        with use_shard(source):
+            for model, owner_path in reversed(TENANT_ROWS):
+                delete_in_chunks(_manager(model).filter(**{owner_path: user.pk}))
+            delete_in_chunks(ChangeLogEntry.objects.filter(owner_id=user.pk))
+        self.unlock(override)
+        self.stdout.write(self.style.SUCCESS(f'Moved user {user.pk} from {source} to {target}'))
+
+    def get_user(self, value):
+        lookup = {'pk': value} if value.isdigit() else {'email': value}
+        try:
+            return CustomUser.objects.get(**lookup)
+        except CustomUser.DoesNotExist:
+            raise CommandError(f'No user {value}')
+
+    def copy_rows(self, model, owner_path, user_id, source, target):
+        manager = _manager(model)
+        rows = manager.using(source).filter(**{owner_path: user_id}).order_by('pk')
+        copied = 0
+        last_pk = 0
+        while True:
+            chunk = list(rows.filter(pk__gt=last_pk)[:COPY_CHUNK_SIZE])
+            if not chunk:
+                return copied
+            # Ids are kept; a clash means the shards' id ranges overlapped and
+            # must fail loudly rather than drop rows
+            with transaction.atomic(using=target):
+                insert_rows(model, chunk, target)
+            copied += len(chunk)
+            last_pk = chunk[-1].pk
+
+    def unlock(self, override):
+        override.locked = False
+        override.save(update_fields=['locked'])
+        forget_user(override.user_id)
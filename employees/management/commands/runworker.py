@@ -0,0 +1,59 @@
+import multiprocessing
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from employees.jobs import worker_loop
+
+
+def _run_threads(threads, burst):
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *args: stop_event.set())
+    workers = [
+        threading.Thread(target=worker_loop, args=(stop_event,), kwargs={'burst': burst}, daemon=True)
+        for _ in range(threads)
+    ]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            while worker.is_alive():
+                worker.join(0.5)
+    except KeyboardInterrupt:
+        stop_event.set()
+        for worker in workers:
+            worker.join()
+
+
+class Command(BaseCommand):
+    help = 'Run background job workers from the database job queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=1, help='Worker threads per process')
+        parser.add_argument('--processes', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--burst', action='store_true', help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        threads, processes, burst = options['threads'], options['processes'], options['burst']
+        self.stdout.write(f'Starting {processes} process(es) x {threads} thread(s)')
+        if processes <= 1:
+            _run_threads(threads, burst)
+            return
+
+        # Children must not inherit the parent's open database connections
+        connections.close_all()
+        children = [
+            multiprocessing.Process(target=_run_threads, args=(threads, burst))
+            for _ in range(processes)
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+                child.join()
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from employees.models import SlowQuery
+
+ORDERINGS = {
+    'total': '-total_ms',
+    'max': '-max_ms',
+    'count': '-count',
+}
+
+
+class Command(BaseCommand):
+    help = 'Print the slowest recorded queries, aggregated by normalized SQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sort', choices=sorted(ORDERINGS), default='total',
+                            help='Rank by total time (default), worst single run or occurrences')
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--plan', action='store_true', help='Also print the sample and its query plan')
+        parser.add_argument('--reset', action='store_true', help='Clear the slow-query log')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.using('default').all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Cleared {deleted} slow queries'))
+            return
+        entries = SlowQuery.objects.using('default').order_by(ORDERINGS[options['sort']])[:options['limit']]
+        if not entries:
+            self.stdout.write('No slow queries recorded')
+            return
+        for rank, entry in enumerate(entries, 1):
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f'#{rank} {entry.fingerprint}: {entry.count}x, total {entry.total_ms:.0f} ms, '
+                f'avg {entry.total_ms / entry.count:.1f} ms, max {entry.max_ms:.1f} ms'
+            ))
+            self.stdout.write(f'  view: {entry.view or "-"} ({entry.database}), last seen {entry.last_seen:%Y-%m-%d %H:%M:%S}')
+            self.stdout.write(f'  {entry.sql}')
+            if options['plan']:
+                self.stdout.write(f'  params: {entry.sample_params}')
+                for line in entry.plan.splitlines():
+                    self.stdout.write(f'    {line}')
@@ -0,0 +1,39 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Q
+from django.utils import timezone
+
+from employees.deletion import delete_in_chunks
+from employees.models import ActivityEntry
+from employees.sharding import each_shard
+
+
+class Command(BaseCommand):
+    help = 'Apply the activity journal retention policy'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=getattr(settings, 'ACTIVITY_RETENTION_DAYS', 90),
+                            help='Delete entries older than this many days')
+        parser.add_argument('--max-per-user', type=int, default=getattr(settings, 'ACTIVITY_MAX_PER_USER', 1000),
+                            help='Keep at most this many of the newest entries per user')
+
+    def handle(self, *args, **options):
+        for alias in each_shard():
+            self.trim(alias, options)
+
+    def trim(self, alias, options):
+        threshold = timezone.now() - timedelta(days=options['keep_days'])
+        deleted = delete_in_chunks(ActivityEntry.objects.filter(ts__lt=threshold))
+
+        limit = max(options['max_per_user'], 1)
+        over_limit = ActivityEntry.objects.values('user').annotate(n=Count('id')).filter(n__gt=limit)
+        for row in over_limit:
+            # The oldest entry to keep; everything behind it in (ts, id) order goes
+            oldest_kept = ActivityEntry.objects.filter(user=row['user']).order_by('-ts', '-id')[limit - 1]
+            deleted += delete_in_chunks(ActivityEntry.objects.filter(user=row['user']).filter(
+                Q(ts__lt=oldest_kept.ts) | Q(ts=oldest_kept.ts, id__lt=oldest_kept.id)
+            ))
+
+        self.stdout.write(self.style.SUCCESS(f'{alias}: removed {deleted} activity entries'))
@@ -0,0 +1,39 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from employee_portal import warmup
+
+
+class Command(BaseCommand):
+    help = ('Run the worker warm-up steps in this fresh process and report what each costs, '
+            'i.e. what a new worker pays before it is ready')
+    # System checks would import every URLconf and view before the steps are timed
+    requires_system_checks = []
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the full report as JSON')
+
+    def handle(self, *args, **options):
+        report = warmup.run(time.perf_counter())
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, ms in report['steps'].items():
+            error = report['errors'].get(name)
+            self.stdout.write(f'{name:<10} {ms:>8} ms' + (f'  FAILED: {error}' if error else ''))
+        for timing in report.get('imports', {}).get('modules', []):
+            self.stdout.write(f'  import {timing["module"]}: {timing["ms"]} ms, {timing["loaded"]} modules')
+        templates = report.get('templates')
+        if templates:
+            self.stdout.write(f'  {templates["compiled"]} templates compiled, {templates["skipped"]} files skipped')
+        requests = report.get('requests', {})
+        for timing in requests.get('urls', []):
+            self.stdout.write(f'  GET {timing["path"]}: {timing["status"]}, first {timing["first_ms"]} ms, '
+                              f'then {timing["second_ms"]} ms')
+        if requests.get('lazy_imports'):
+            self.stdout.write(f'  imported by the first requests: {", ".join(requests["lazy_imports"])}')
+        for alias, ms in report.get('databases', {}).get('connect_ms', {}).items():
+            self.stdout.write(f'  database {alias}: {ms} ms')
+        self.stdout.write(self.style.SUCCESS(f'Ready in {report["time_to_ready_ms"]} ms'))
@@ -0,0 +1,264 @@
+"""
+Materialized per-template tables for reporting.
+
+With MATERIALIZED_TABLES on, every form template gets a plain SQL table
+``employees_mat_template_<id>`` with one row per employee and one typed
+column ``field_<id>`` per active field: REAL for numbers, INTEGER (1 or
+NULL) for checkboxes, TEXT for everything else. Filters, sorts and stats
+over several fields then become single-table scans instead of one EAV join
+per field (see employees.reports).
+
+The tables follow the change log: every path that records a change
+(employees.changes) also calls track(), which refreshes the affected rows
+once the transaction commits. Field changes bring the table's columns in
+line: added fields add a column, removed fields drop it, and a retyped
+field's column is rebuilt from the stored values. Tables are created for
+new templates; ``manage.py materialize_templates`` builds them for existing
+ones and can rebuild any table that drifted. Until a template's table
+exists, reports read the EAV tables as before.
+"""
+from functools import partial
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import FormTemplate, FormField, Employee, EmployeeData
+from .sharding import db_for_model, use_shard
+
+REBUILD_CHUNK_SIZE = 500
+SQL_TYPES = {'number': 'REAL', 'checkbox': 'INTEGER'}
+
+# Columns track() needs from the rows of each model
+TRACKED = {
+    FormTemplate: ('id',),
+    FormField: ('form_template_id',),
+    Employee: ('id', 'form_template_id'),
+    EmployeeData: ('employee_id',),
+}
+
+# (alias, template id) of tables known to exist in this process
+_ready = set()
+
+
+def enabled():
+    return getattr(settings, 'MATERIALIZED_TABLES', False)
+
+
+def table_name(template_id):
+    return f'employees_mat_template_{int(template_id)}'
+
+
+def column_name(field_id):
+    return f'field_{int(field_id)}'
+
+
+def sql_type(field_type):
+    return SQL_TYPES.get(field_type, 'TEXT')
+
+
+def to_column(field_type, value):
+    """A stored string value as it goes into the typed column."""
+    if value is None:
+        return None
+    if field_type == 'number':
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    if field_type == 'checkbox':
+        return 1 if value == 'on' else None
+    return value
+
+
+def database():
+    return db_for_model(Employee)
+
+
+def table_exists(template_id):
+    alias = database()
+    if (alias, template_id) in _ready:
+        return True
+    with connections[alias].cursor() as cursor:
+        exists = table_name(template_id) in connections[alias].introspection.table_names(cursor)
+    if exists:
+        _ready.add((alias, template_id))
+    return exists
+
+
+def preload(alias):
+    """Note every existing table of ``alias`` at once, instead of one lookup per template."""
+    prefix = table_name(0)[:-1]
+    with connections[alias].cursor() as cursor:
+        names = connections[alias].introspection.table_names(cursor)
+    _ready.update((alias, int(name[len(prefix):])) for name in names
+                  if name.startswith(prefix) and name[len(prefix):].isdigit())
+
+
+def ready(template_id):
+    """True when reports for the template can read its materialized table."""
+    return enabled() and table_exists(template_id)
+
+
+def active_fields(template_id):
+    return list(FormField.objects.filter(form_template_id=template_id).order_by('order', 'id'))
+
+
+def create_table(template_id):
+    """Create the (empty) table for a template, replacing any existing one."""
+    alias = database()
+    connection = connections[alias]
+    quote = connection.ops.quote_name
+    columns = ['"employee_id" INTEGER PRIMARY KEY'] + [
+        f'{quote(column_name(f.pk))} {sql_type(f.field_type)}' for f in active_fields(template_id)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {quote(table_name(template_id))}')
+        cursor.execute(f'CREATE TABLE {quote(table_name(template_id))} ({", ".join(columns)})')
+    _ready.add((alias, template_id))
+
+
+def drop_table(template_id):
+    alias = database()
+    connection = connections[alias]
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE IF EXISTS {connection.ops.quote_name(table_name(template_id))}')
+    _ready.discard((alias, template_id))
+
+
+def sync_schema(template_id):
+    """
+    Bring an existing table's columns in line with the template's active
+    fields. Retyped columns are dropped, re-added and refilled.
+    """
+    if not table_exists(template_id):
+        return
+    if not FormTemplate.objects.filter(pk=template_id).exists():
+        drop_table(template_id)
+        return
+    connection = connections[database()]
+    quote = connection.ops.quote_name
+    table = quote(table_name(template_id))
+    wanted = {column_name(f.pk): sql_type(f.field_type) for f in active_fields(template_id)}
+    with connection.cursor() as cursor:
+        existing = {
+            column.name: column.type_code.upper()
+            for column in connection.introspection.get_table_description(cursor, table_name(template_id))
+            if column.name != 'employee_id'
+        }
+        retyped = [name for name, type_ in wanted.items() if name in existing and existing[name] != type_]
+        for name in [name for name in existing if name not in wanted] + retyped:
+            cursor.execute(f'ALTER TABLE {table} DROP COLUMN {quote(name)}')
+        for name, type_ in wanted.items():
+            if name not in existing or name in retyped:
+                cursor.execute(f'ALTER TABLE {table} ADD COLUMN {quote(name)} {type_}')
+    # A new field has no values yet; a retyped one needs its values back
+    if retyped:
+        for _ in rebuild(template_id):
+            pass
+
+
+def _upsert(template_id, fields, employee_ids):
+    from .storage import values_for
+
+    values = values_for(employee_ids, [f.pk for f in fields])
+    connection = connections[database()]
+    quote = connection.ops.quote_name
+    columns = ['employee_id'] + [column_name(f.pk) for f in fields]
+    updates = ', '.join(f'{quote(c)} = excluded.{quote(c)}' for c in columns[1:])
+    sql = (
+        f'INSERT INTO {quote(table_name(template_id))} ({", ".join(quote(c) for c in columns)}) '
+        f'VALUES ({", ".join(["%s"] * len(columns))}) '
+        f'ON CONFLICT ("employee_id") ' + (f'DO UPDATE SET {updates}' if updates else 'DO NOTHING')
+    )
+    rows = [
+        [pk] + [to_column(f.field_type, values[pk].get(f.pk)) for f in fields]
+        for pk in employee_ids
+    ]
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def _delete(template_id, employee_ids):
+    connection = connections[database()]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {connection.ops.quote_name(table_name(template_id))} '
+            f'WHERE "employee_id" IN ({", ".join(["%s"] * len(employee_ids))})',
+            list(employee_ids),
+        )
+
+
+def refresh(employee_ids):
+    """Re-read the values of ``employee_ids`` into the tables of their templates."""
+    by_template = {}
+    for pk, template_id in Employee.all_objects.filter(pk__in=employee_ids).values_list('pk', 'form_template_id'):
+        by_template.setdefault(template_id, []).append(pk)
+    for template_id, ids in by_template.items():
+        if table_exists(template_id):
+            _upsert(template_id, active_fields(template_id), ids)
+
+
+def rebuild(template_id, chunk_size=REBUILD_CHUNK_SIZE):
+    """(Re)create a template's table from the stored values. Yields the rows done so far."""
+    create_table(template_id)
+    fields = active_fields(template_id)
+    employees = Employee.all_objects.filter(form_template_id=template_id)
+    last_pk, done = 0, 0
+    while True:
+        ids = list(employees.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return
+        with transaction.atomic(using=database()):
+            _upsert(template_id, fields, ids)
+        last_pk = ids[-1]
+        done += len(ids)
+        yield done
+
+
+def track(model, action, rows):
+    """
+    Note changed ``rows`` (dicts holding at least the TRACKED columns) of a
+    change-logged model; the tables catch up when the transaction commits.
+    """
+    if not enabled() or model not in TRACKED:
+        return
+    refreshed, removed, schemas, created, dropped = set(), {}, set(), set(), set()
+    for row in rows:
+        if model is Employee:
+            if action == 'delete':
+                removed.setdefault(row['form_template_id'], set()).add(row['id'])
+            else:
+                refreshed.add(row['id'])
+        elif model is EmployeeData:
+            refreshed.add(row['employee_id'])
+        elif model is FormField:
+            schemas.add(row['form_template_id'])
+        elif action == 'insert':
+            created.add(row['id'])
+        elif action == 'delete':
+            dropped.add(row['id'])
+    alias = database()
+    transaction.on_commit(
+        partial(_apply, alias, refreshed, removed, schemas, created, dropped), using=alias, robust=True
+    )
+
+
+def track_queryset(queryset, action):
+    """track() for the rows of ``queryset`` (call before deleting them)."""
+    if enabled() and queryset.model in TRACKED:
+        track(queryset.model, action, list(queryset.order_by().values(*TRACKED[queryset.model])))
+
+
+def _apply(alias, refreshed, removed, schemas, created, dropped):
+    with use_shard(alias):
+        for template_id in created:
+            create_table(template_id)
+        for template_id in schemas:
+            sync_schema(template_id)
+        for template_id, ids in removed.items():
+            if table_exists(template_id):
+                _delete(template_id, ids)
+        if refreshed:
+            refresh(refreshed)
+        for template_id in dropped:
+            drop_table(template_id)
@@ -0,0 +1,16 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("employees", "0001_initial")]
+
+    operations = [
+        migrations.AddField(
+            model_name="customuser",
+            name="profile_picture_hash",
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+    ]
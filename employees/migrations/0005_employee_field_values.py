@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:51
+
+import employees.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0004_soft_delete"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="employee",
+            name="field_values",
+            field=models.JSONField(
+                blank=True, default=dict, encoder=employees.models.UnicodeJSONEncoder
+            ),
+        ),
+    ]
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_creations(apps, schema_editor):
+    """Seed the journal with the creations the old recent activity page showed."""
+    FormTemplate = apps.get_model("employees", "FormTemplate")
+    Employee = apps.get_model("employees", "Employee")
+    ActivityEntry = apps.get_model("employees", "ActivityEntry")
+    entries = [
+        ActivityEntry(
+            user_id=t.created_by_id,
+            ts=t.created_at,
+            kind="form_template",
+            action="create",
+            object_id=t.pk,
+            label=t.name[:200],
+        )
+        for t in FormTemplate.objects.all().iterator()
+    ]
+    names = dict(FormTemplate.objects.values_list("pk", "name"))
+    entries += [
+        ActivityEntry(
+            user_id=e.created_by_id,
+            ts=e.created_at,
+            kind="employee",
+            action="create",
+            object_id=e.pk,
+            label=f"Employee #{e.pk} ({names.get(e.form_template_id, '')})"[:200],
+        )
+        for e in Employee.objects.all().iterator()
+    ]
+    ActivityEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0006_changelogentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ActivityEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("ts", models.DateTimeField(default=django.utils.timezone.now)),
+                (
+                    "kind",
+                    models.CharField(
+                        choices=[
+                            ("form_template", "Form"),
+                            ("form_field", "Field"),
+                            ("employee", "Employee"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("create", "Created"),
+                            ("update", "Updated"),
+                            ("delete", "Deleted"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("object_id", models.BigIntegerField()),
+                ("label", models.CharField(max_length=200)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["user", "ts"], name="activity_user_ts_idx")
+                ],
+            },
+        ),
+        migrations.RunPython(backfill_creations, migrations.RunPython.noop),
+    ]
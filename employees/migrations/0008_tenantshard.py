@@ -0,0 +1,32 @@
+# Generated by Django 5.2.5 on 2026-10-19 17:58
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0007_activityentry"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TenantShard",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("shard", models.CharField(max_length=20)),
+                ("locked", models.BooleanField(default=False)),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0008_tenantshard"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="employee",
+            name="fingerprint",
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.AddField(
+            model_name="formfield",
+            name="is_key",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name="employee",
+            index=models.Index(
+                fields=["form_template", "fingerprint"], name="employee_fingerprint_idx"
+            ),
+        ),
+    ]
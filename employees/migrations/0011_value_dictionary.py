@@ -0,0 +1,62 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0010_archivedemployee"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FieldValueCode",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("code", models.PositiveIntegerField()),
+                ("value", models.TextField()),
+            ],
+        ),
+        migrations.AddField(
+            model_name="employeedata",
+            name="code",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name="employeedata",
+            index=models.Index(
+                fields=["field", "code"], name="employeedata_field_code_idx"
+            ),
+        ),
+        migrations.AddField(
+            model_name="fieldvaluecode",
+            name="field",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="employees.formfield",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="fieldvaluecode",
+            constraint=models.UniqueConstraint(
+                fields=("field", "code"), name="fieldvaluecode_code_uniq"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="fieldvaluecode",
+            constraint=models.UniqueConstraint(
+                fields=("field", "value"), name="fieldvaluecode_value_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:14
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0011_value_dictionary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SlowQuery",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=16, unique=True)),
+                ("sql", models.TextField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                ("total_ms", models.FloatField(default=0)),
+                ("max_ms", models.FloatField(default=0)),
+                ("view", models.CharField(blank=True, max_length=200)),
+                ("database", models.CharField(blank=True, max_length=20)),
+                ("sample_sql", models.TextField(blank=True)),
+                ("sample_params", models.TextField(blank=True)),
+                ("plan", models.TextField(blank=True)),
+                ("first_seen", models.DateTimeField(default=django.utils.timezone.now)),
+                ("last_seen", models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-19 18:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("employees", "0012_slowquery"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="employeedata",
+            name="employeedata_field_code_idx",
+        ),
+        migrations.AddIndex(
+            model_name="employeedata",
+            index=models.Index(
+                fields=["field", "code", "value"], name="employeedata_field_value_idx"
+            ),
+        ),
+    ]
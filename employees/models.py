@@ -1,10 +1,14 @@
+from django.conf import settings
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib.auth.models import AbstractUser
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 class CustomUser(AbstractUser):
     email = models.EmailField(_('email address'), unique=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', null=True, blank=True)
+    profile_picture_hash = models.CharField(max_length=16, blank=True, editable=False)
     
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username']
@@ -12,6 +16,45 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.email
 
+class UnicodeJSONEncoder(DjangoJSONEncoder):
+    """Stores non-ASCII text as-is, so documents stay compact and LIKE-searchable."""
+    def __init__(self, *args, **kwargs):
+        kwargs['ensure_ascii'] = False
+        super().__init__(*args, **kwargs)
+
+def hides_deleted_parents():
+    """
+    Only background deletion (employees.deletion) ever soft-deletes a template
+    or field, so without it the default managers skip the joins to check the
+    parent rows.
+    """
+    return getattr(settings, 'DELETE_IN_BACKGROUND', False)
+
+class ActiveTemplateManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+class ActiveFieldManager(models.Manager):
+    def get_queryset(self):
+        queryset = super().get_queryset().filter(deleted_at__isnull=True)
+        if hides_deleted_parents():
+            queryset = queryset.filter(form_template__deleted_at__isnull=True)
+        return queryset
+
+class ActiveEmployeeManager(models.Manager):
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if hides_deleted_parents():
+            queryset = queryset.filter(form_template__deleted_at__isnull=True)
+        return queryset
+
+class ActiveEmployeeDataManager(models.Manager):
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if hides_deleted_parents():
+            queryset = queryset.filter(field__deleted_at__isnull=True, field__form_template__deleted_at__isnull=True)
+        return queryset
+
 class FormTemplate(models.Model):
     INPUT_TYPES = (
         ('text', 'Text'),
@@ -28,6 +71,11 @@ class FormTemplate(models.Model):
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Set while a background purge is removing the template (see employees.deletion)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    objects = ActiveTemplateManager()
+    all_objects = models.Manager()
     
     def __str__(self):
         return self.name
@@ -37,11 +85,24 @@ class FormField(models.Model):
     label = models.CharField(max_length=100)
     field_type = models.CharField(max_length=20, choices=FormTemplate.INPUT_TYPES)
     required = models.BooleanField(default=True)
+    # Key fields make up the employee's duplicate fingerprint (see employees.fingerprints)
+    is_key = models.BooleanField(default=False)
     order = models.PositiveIntegerField(default=0)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    
+    objects = ActiveFieldManager()
+    all_objects = models.Manager()
     
     class Meta:
         ordering = ['order']
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets the post_save handler tell whether is_key changed
+        instance.loaded_is_key = instance.__dict__.get('is_key')
+        return instance
+    
     def __str__(self):
         return f"{self.label} ({self.field_type})"
 
@@ -50,6 +111,17 @@ class Employee(models.Model):
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # {"<field id>": value}, used instead of EmployeeData depending on
+    # EMPLOYEE_STORAGE (see employees.storage)
+    field_values = models.JSONField(default=dict, blank=True, encoder=UnicodeJSONEncoder)
+    # Hash of the normalized key field values, '' when the template has none
+    fingerprint = models.CharField(max_length=32, blank=True, editable=False)
+    
+    objects = ActiveEmployeeManager()
+    all_objects = models.Manager()
+    
+    class Meta:
+        indexes = [models.Index(fields=['form_template', 'fingerprint'], name='employee_fingerprint_idx')]
     
     def __str__(self):
         return f"Employee {self.id} - {self.form_template.name}"
@@ -58,9 +130,164 @@ class EmployeeData(models.Model):
     employee = models.ForeignKey(Employee, related_name='data', on_delete=models.CASCADE)
     field = models.ForeignKey(FormField, on_delete=models.CASCADE)
     value = models.TextField()
+    # For select/radio/checkbox fields: the FieldValueCode of the value, with
+    # ``value`` left empty (see employees.dictionary)
+    code = models.PositiveIntegerField(null=True, blank=True)
+    
+    objects = ActiveEmployeeDataManager()
+    all_objects = models.Manager()
     
     class Meta:
         unique_together = ('employee', 'field')
+        # Also covers the value GROUP BY of dictionary.value_counts()
+        indexes = [models.Index(fields=['field', 'code', 'value'], name='employeedata_field_value_idx')]
+    
+    def __str__(self):
+        return f"{self.employee} - {self.field.label}: {self.value}"
+
+class FieldValueCode(models.Model):
+    """One entry of a field's value dictionary. Codes are never reassigned."""
+    field = models.ForeignKey(FormField, on_delete=models.CASCADE, related_name='+')
+    code = models.PositiveIntegerField()
+    value = models.TextField()
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['field', 'code'], name='fieldvaluecode_code_uniq'),
+            models.UniqueConstraint(fields=['field', 'value'], name='fieldvaluecode_value_uniq'),
+        ]
+    
+    def __str__(self):
+        return f"{self.field_id}:{self.code} = {self.value}"
+
+class ArchivedEmployee(models.Model):
+    """
+    An employee moved out of the hot tables, with its values in one
+    compressed blob (see employees.archive). Keeps the employee's id.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    form_template = models.ForeignKey(FormTemplate, on_delete=models.CASCADE, related_name='+')
+    created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(default=timezone.now)
+    # zlib-compressed JSON: {"field_values": {...}, "data": [[id, field id, value], ...]}
+    payload = models.BinaryField()
+    
+    class Meta:
+        indexes = [models.Index(fields=['created_by', 'form_template'], name='archive_owner_idx')]
+    
+    def __str__(self):
+        return f"Archived employee {self.id}"
+
+class Job(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed'),
+    )
+    
+    task = models.CharField(max_length=200)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_by = models.ForeignKey(CustomUser, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['status', 'run_at'], name='job_status_run_at_idx')]
+    
+    def __str__(self):
+        return f"Job {self.id} - {self.task} ({self.status})"
+
+
+class ChangeLogEntry(models.Model):
+    """
+    One insert/update/delete of a tracked model. The auto-increment primary
+    key is the feed's sequence number (see employees.changes).
+    """
+    ACTION_CHOICES = (
+        ('insert', 'Insert'),
+        ('update', 'Update'),
+        ('delete', 'Delete'),
+    )
+    
+    owner = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    model = models.CharField(max_length=30)
+    object_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    data = models.JSONField(null=True, blank=True, encoder=UnicodeJSONEncoder)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        indexes = [models.Index(fields=['owner', 'id'], name='changelog_owner_seq_idx')]
+    
+    def __str__(self):
+        return f"#{self.id} {self.action} {self.model} {self.object_id}"
+
+
+class ActivityEntry(models.Model):
+    """A user-facing journal line for the recent activity feed (see employees.activity)."""
+    KIND_CHOICES = (
+        ('form_template', 'Form'),
+        ('form_field', 'Field'),
+        ('employee', 'Employee'),
+    )
+    ACTION_CHOICES = (
+        ('create', 'Created'),
+        ('update', 'Updated'),
+        ('delete', 'Deleted'),
+    )
+    
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='+')
+    ts = models.DateTimeField(default=timezone.now)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    object_id = models.BigIntegerField()
+    label = models.CharField(max_length=200)
+    
+    class Meta:
+        indexes = [models.Index(fields=['user', 'ts'], name='activity_user_ts_idx')]
+    
+    def __str__(self):
+        return f"{self.get_action_display()} {self.label}"
+
+
+class TenantShard(models.Model):
+    """Pins a user's data to a shard instead of the hashed default (see employees.sharding)."""
+    user = models.OneToOneField(CustomUser, on_delete=models.CASCADE, primary_key=True, related_name='+')
+    shard = models.CharField(max_length=20)
+    # Requests for a locked tenant get 503 while rebalance_tenant moves its rows
+    locked = models.BooleanField(default=False)
+    
+    def __str__(self):
+        return f"{self.user_id} -> {self.shard}"
+
+
+class SlowQuery(models.Model):
+    """Aggregated statistics for one normalized slow statement (see employees.slowqueries)."""
+    fingerprint = models.CharField(max_length=16, unique=True)
+    sql = models.TextField()
+    count = models.PositiveIntegerField(default=0)
+    total_ms = models.FloatField(default=0)
+    max_ms = models.FloatField(default=0)
+    # The slowest occurrence seen so far
+    view = models.CharField(max_length=200, blank=True)
+    database = models.CharField(max_length=20, blank=True)
+    sample_sql = models.TextField(blank=True)
+    sample_params = models.TextField(blank=True)
+    plan = models.TextField(blank=True)
+    first_seen = models.DateTimeField(default=timezone.now)
+    last_seen = models.DateTimeField(default=timezone.now)
     
     def __str__(self):
-        return f"{self.employee} - {self.field.label}: {self.value}"
\ No newline at end of file
+        return f"{self.fingerprint} ({self.count}x, max {self.max_ms:.0f} ms)"
@@ -0,0 +1,207 @@
+"""
+Filtered, sorted and aggregated views over a template's employees.
+
+Each report runs against the template's materialized table when it has one
+(see employees.materialized), and otherwise against the EAV or document
+storage through the ORM. Both return the same shape. Values come back typed
+the way the materialized columns hold them: numbers as floats, checked boxes
+as 1, everything else as text.
+
+Filters are ``{field_id: value}`` equality tests on the submitted value.
+``manage.py materialize_templates --benchmark`` times both paths on real data.
+"""
+from collections import Counter
+
+from django.db import connections
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from . import materialized
+from .models import Employee
+from .storage import filter_value, value_counts, value_expression, values_for
+
+EXPORT_CHUNK_SIZE = 1000
+TOP_VALUES = 10
+
+
+def _backend(template, backend):
+    if backend is None:
+        return 'materialized' if materialized.ready(template.pk) else 'eav'
+    return backend
+
+
+def _sort_field(fields, sort):
+    return next((f for f in fields if f.pk == int(sort)), None) if sort is not None else None
+
+
+def _clean_filters(fields, filters):
+    """``[(field, value)]`` for the filters on active fields."""
+    by_id = {f.pk: f for f in fields}
+    return [(by_id[int(k)], v) for k, v in (filters or {}).items() if int(k) in by_id]
+
+
+def report(template, user, filters=None, sort=None, descending=False, limit=50, offset=0, backend=None):
+    """
+    ``(count, rows)``: how many of ``user``'s employees of ``template`` match
+    ``filters``, and the page of them at ``offset``, ordered by the field
+    ``sort`` (else by id). Rows are ``{'id', 'created_at', 'values'}``.
+    """
+    fields = materialized.active_fields(template.pk)
+    filters = _clean_filters(fields, filters)
+    sort = _sort_field(fields, sort)
+    if _backend(template, backend) == 'materialized':
+        count = _materialized_count(template, user, filters)
+        rows = _materialized_rows(template, user, fields, filters, sort, descending, limit, offset)
+    else:
+        count = _orm_employees(template, user, filters).count()
+        rows = _orm_rows(template, user, fields, filters, sort, descending, limit, offset)
+    return count, list(rows)
+
+
+def export(template, user, filters=None, sort=None, descending=False, backend=None):
+    """Every matching row, shaped like report() rows, streamed."""
+    fields = materialized.active_fields(template.pk)
+    filters = _clean_filters(fields, filters)
+    sort = _sort_field(fields, sort)
+    if _backend(template, backend) == 'materialized':
+        yield from _materialized_rows(template, user, fields, filters, sort, descending)
+        return
+    offset = 0
+    while True:
+        rows = _orm_rows(template, user, fields, filters, sort, descending, EXPORT_CHUNK_SIZE, offset)
+        yield from rows
+        if len(rows) < EXPORT_CHUNK_SIZE:
+            return
+        offset += EXPORT_CHUNK_SIZE
+
+
+def field_stats(template, user, field, filters=None, backend=None):
+    """
+    ``{'count', 'distinct', 'min', 'max', 'avg', 'top'}`` of ``field`` over
+    the matching employees; ``avg`` only for numbers, ``top`` the most
+    common values with their counts.
+    """
+    filters = _clean_filters(materialized.active_fields(template.pk), filters)
+    if _backend(template, backend) == 'materialized':
+        return _materialized_stats(template, user, field, filters)
+    # Grouped in SQL; only the distinct values come back to be typed
+    counts = Counter()
+    for stored, n in value_counts(field, _orm_employees(template, user, filters)):
+        value = materialized.to_column(field.field_type, stored)
+        if value is not None:
+            counts[value] += n
+    present = sum(counts.values())
+    return {
+        'count': present,
+        'distinct': len(counts),
+        'min': min(counts, default=None),
+        'max': max(counts, default=None),
+        'avg': sum(v * n for v, n in counts.items()) / present if present and field.field_type == 'number' else None,
+        'top': sorted(counts.items(), key=lambda item: (-item[1], str(item[0])))[:TOP_VALUES],
+    }
+
+
+# ORM path
+
+def _orm_employees(template, user, filters):
+    employees = Employee.objects.filter(form_template=template, created_by=user)
+    for field, value in filters:
+        employees = filter_value(employees, field.pk, value)
+    return employees
+
+
+def _orm_rows(template, user, fields, filters, sort, descending, limit, offset):
+    employees = _orm_employees(template, user, filters)
+    ordering = ['-pk' if descending and sort is None else 'pk']
+    if sort is not None:
+        key = value_expression(sort.pk)
+        if sort.field_type == 'number':
+            key = Cast(key, FloatField())
+        employees = employees.annotate(sort_key=key)
+        ordering = [F('sort_key').desc() if descending else F('sort_key').asc(), 'pk']
+    page = list(employees.order_by(*ordering).values_list('pk', 'created_at')[offset:offset + limit])
+    values = values_for([pk for pk, _ in page], [f.pk for f in fields])
+    return [
+        {'id': pk, 'created_at': created_at,
+         'values': {f.pk: materialized.to_column(f.field_type, values[pk].get(f.pk)) for f in fields}}
+        for pk, created_at in page
+    ]
+
+
+# Materialized path
+
+def _materialized_from(template, user, filters, connection):
+    quote = connection.ops.quote_name
+    sql = (
+        f'FROM {quote(Employee._meta.db_table)} e '
+        f'JOIN {quote(materialized.table_name(template.pk))} m ON m."employee_id" = e."id" '
+        f'WHERE e."form_template_id" = %s AND e."created_by_id" = %s'
+    )
+    params = [template.pk, user.pk]
+    for field, value in filters:
+        sql += f' AND m.{quote(materialized.column_name(field.pk))} = %s'
+        params.append(materialized.to_column(field.field_type, value))
+    return sql, params
+
+
+def _materialized_count(template, user, filters):
+    connection = connections[materialized.database()]
+    from_sql, params = _materialized_from(template, user, filters, connection)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT COUNT(*) {from_sql}', params)
+        return cursor.fetchone()[0]
+
+
+def _materialized_rows(template, user, fields, filters, sort, descending, limit=None, offset=0):
+    connection = connections[materialized.database()]
+    quote = connection.ops.quote_name
+    from_sql, params = _materialized_from(template, user, filters, connection)
+    direction = 'DESC' if descending else 'ASC'
+    if sort is not None:
+        order = f'm.{quote(materialized.column_name(sort.pk))} {direction}, e."id"'
+    else:
+        order = f'e."id" {direction}'
+    columns = ''.join(f', m.{quote(materialized.column_name(f.pk))}' for f in fields)
+    sql = f'SELECT e."id", e."created_at"{columns} {from_sql} ORDER BY {order}'
+    if limit is not None:
+        sql += ' LIMIT %s OFFSET %s'
+        params += [limit, offset]
+    # Raw rows skip the ORM, so apply the backend's datetime conversion here
+    created_at = Employee._meta.get_field('created_at')
+    converters = connection.ops.get_db_converters(created_at.get_col(Employee._meta.db_table))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while True:
+            chunk = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not chunk:
+                return
+            for row in chunk:
+                created = row[1]
+                for converter in converters:
+                    created = converter(created, created_at, connection)
+                yield {'id': row[0], 'created_at': created, 'values': dict(zip((f.pk for f in fields), row[2:]))}
+
+
+def _materialized_stats(template, user, field, filters):
+    connection = connections[materialized.database()]
+    column = f'm.{connection.ops.quote_name(materialized.column_name(field.pk))}'
+    from_sql, params = _materialized_from(template, user, filters, connection)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT COUNT({column}), COUNT(DISTINCT {column}), MIN({column}), MAX({column}), AVG({column}) '
+            f'{from_sql}', params
+        )
+        count, distinct, low, high, avg = cursor.fetchone()
+        cursor.execute(
+            f'SELECT {column}, COUNT(*) {from_sql} AND {column} IS NOT NULL '
+            f'GROUP BY {column} ORDER BY 2 DESC, 1 LIMIT %s', params + [TOP_VALUES]
+        )
+        top = [tuple(row) for row in cursor.fetchall()]
+    return {
+        'count': count,
+        'distinct': distinct,
+        'min': low,
+        'max': high,
+        'avg': avg if field.field_type == 'number' else None,
+        'top': top,
+    }
@@ -0,0 +1,268 @@
+"""
+Per-tenant database sharding.
+
+With TENANT_SHARDS = N > 0, every user's forms, fields, employees, values,
+change log and activity journal live in one of N SQLite files (database
+aliases ``shard_0`` .. ``shard_{N-1}``). Users, sessions, auth, jobs and the
+override table stay on ``default``. A user's shard is a stable hash of their
+id unless a TenantShard row overrides it (``manage.py rebalance_tenant``).
+
+TenantRouter sends queries for the sharded models to the shard of the tenant
+active in the current context. TenantMiddleware activates the request user
+(session or JWT) for each request, run_job() activates the job's user, and
+maintenance code can use ``use_tenant()``/``use_shard()`` directly. Without
+an active tenant those models fall back to ``default``.
+
+Each shard hands out primary keys from its own range (SHARD_ID_RANGE ids per
+shard, set up by ``prepare_shard``), so rows keep their ids when a tenant
+moves between shards.
+"""
+import contextvars
+import zlib
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections, router
+from django.http import JsonResponse
+
+SHARDED_MODELS = {
+    'formtemplate', 'formfield', 'fieldvaluecode', 'employee', 'employeedata', 'archivedemployee',
+    'changelogentry', 'activityentry',
+}
+SHARD_ID_RANGE = 10 ** 12
+OVERRIDE_CACHE_TIMEOUT = 60
+
+_current_shard = contextvars.ContextVar('current_shard', default=None)
+
+
+def shard_count():
+    return getattr(settings, 'TENANT_SHARDS', 0)
+
+
+def enabled():
+    return shard_count() > 0
+
+
+def shard_aliases():
+    return [f'shard_{i}' for i in range(shard_count())]
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'employees' and model._meta.model_name in SHARDED_MODELS
+
+
+def hashed_shard(user_id):
+    return f'shard_{zlib.crc32(str(user_id).encode()) % shard_count()}'
+
+
+def _cache_key(user_id):
+    return f'tenant-shard:{user_id}'
+
+
+def tenant_state(user_id):
+    """
+    ``(alias, locked)`` for ``user_id``. Cached for OVERRIDE_CACHE_TIMEOUT
+    seconds, which is how long rebalance_tenant waits after locking a tenant
+    before it starts moving rows.
+    """
+    from .models import TenantShard
+
+    key = _cache_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        override = TenantShard.objects.using('default').filter(user_id=user_id).first()
+        state = (override.shard, override.locked) if override else (hashed_shard(user_id), False)
+        cache.set(key, state, OVERRIDE_CACHE_TIMEOUT)
+    return state
+
+
+def shard_for_user(user_id):
+    """The database alias holding ``user_id``'s data."""
+    return tenant_state(user_id)[0]
+
+
+def forget_user(user_id):
+    cache.delete(_cache_key(user_id))
+
+
+def current_shard():
+    return _current_shard.get()
+
+
+@contextmanager
+def use_shard(alias):
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+@contextmanager
+def use_tenant(user_id):
+    """Route sharded models to ``user_id``'s shard for the duration of the block."""
+    if not enabled() or user_id is None:
+        yield None
+        return
+    alias = shard_for_user(user_id)
+    ensure_user_on_shard(user_id, alias)
+    with use_shard(alias):
+        yield alias
+
+
+def ensure_user_on_shard(user_id, alias):
+    """
+    Copy the user row onto ``alias`` so the shard's foreign keys to the user
+    table hold. Only the id matters there; profile edits are not synced.
+    """
+    from .models import CustomUser
+
+    key = f'tenant-user-mirrored:{alias}:{user_id}'
+    if cache.get(key):
+        return
+    if not CustomUser.objects.using(alias).filter(pk=user_id).exists():
+        user = CustomUser.objects.using('default').get(pk=user_id)
+        user.save(using=alias, force_insert=True)
+    cache.set(key, True, None)
+
+
+def insert_rows(model, objs, using):
+    """
+    bulk_create ``objs`` into ``using`` exactly as given. bulk_create runs
+    pre_save, which would stamp auto_now/auto_now_add fields with the current
+    time, so those are written back afterwards.
+    """
+    stamped = [
+        f for f in model._meta.concrete_fields
+        if getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)
+    ]
+    original = [[getattr(obj, f.attname) for f in stamped] for obj in objs]
+    model._base_manager.using(using).bulk_create(objs)
+    if stamped:
+        for obj, values in zip(objs, original):
+            for f, value in zip(stamped, values):
+                setattr(obj, f.attname, value)
+        model._base_manager.using(using).bulk_update(objs, [f.name for f in stamped])
+
+
+def shard_id_floor(alias):
+    return (shard_aliases().index(alias) + 1) * SHARD_ID_RANGE
+
+
+def prepare_shard(alias):
+    """Start the sharded tables' AUTOINCREMENT counters at this shard's id range."""
+    from django.apps import apps
+
+    floor = shard_id_floor(alias)
+    with connections[alias].cursor() as cursor:
+        for model in apps.get_app_config('employees').get_models():
+            if not is_sharded(model):
+                continue
+            table = model._meta.db_table
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)', [table, floor])
+            elif row[0] < floor:
+                cursor.execute('UPDATE sqlite_sequence SET seq = %s WHERE name = %s', [floor, table])
+
+
+def db_for_model(model):
+    """The alias queries for ``model`` go to in the current context."""
+    return router.db_for_write(model)
+
+
+def each_shard():
+    """
+    Yield every database holding tenant data (just ``default`` when sharding
+    is off), with it active for the sharded models while the caller runs.
+    """
+    for alias in shard_aliases() or ['default']:
+        with use_shard(alias if enabled() else None):
+            yield alias
+
+
+class TenantRouter:
+    def _route(self, model, **hints):
+        if not enabled() or not is_sharded(model):
+            return None
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)) and instance._state.db:
+            return instance._state.db
+        return current_shard()
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Users are mirrored onto every shard that holds their data
+        if enabled() and (is_sharded(type(obj1)) or is_sharded(type(obj2))):
+            return True
+        return None
+
+
+class TenantMiddleware:
+    """Activates the shard of the session or JWT user for the rest of the request."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not enabled():
+            return self.get_response(request)
+        user_id = self._user_id(request)
+        if user_id is not None and tenant_state(user_id)[1]:
+            return self._moving()
+        with use_tenant(user_id):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        if not enabled():
+            return await self.get_response(request)
+        alias, locked = await sync_to_async(self._tenant)(request)
+        if locked:
+            return self._moving()
+        if alias is None:
+            return await self.get_response(request)
+        # The context variable follows the request into sync_to_async threads
+        with use_shard(alias):
+            return await self.get_response(request)
+
+    def _tenant(self, request):
+        # ``(alias, locked)`` of the request's tenant, as use_tenant() would pick it
+        user_id = self._user_id(request)
+        if user_id is None:
+            return None, False
+        alias, locked = tenant_state(user_id)
+        if not locked:
+            ensure_user_on_shard(user_id, alias)
+        return alias, locked
+
+    def _moving(self):
+        response = JsonResponse({'error': 'Tenant is being moved, try again shortly'}, status=503)
+        response['Retry-After'] = '30'
+        return response
+
+    def _user_id(self, request):
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            return user.pk
+        header = request.headers.get('Authorization', '')
+        if header.startswith('Bearer '):
+            from rest_framework_simplejwt.authentication import JWTAuthentication
+            from rest_framework_simplejwt.exceptions import InvalidToken
+            from rest_framework_simplejwt.settings import api_settings
+            try:
+                token = JWTAuthentication().get_validated_token(header.split(' ', 1)[1].encode())
+            except InvalidToken:
+                return None
+            return token.get(api_settings.USER_ID_CLAIM)
+        return None
@@ -1,10 +1,73 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, post_migrate
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
+from django.urls import reverse
+
+from . import activity
+from .changes import MODEL_NAMES, record
+from .events import broker
+from .sharding import shard_aliases, prepare_shard
+from .fingerprints import refresh_template
+from .models import FormTemplate, FormField, Employee
 
 CustomUser = get_user_model()
 
 @receiver(post_save, sender=CustomUser)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
-        pass
\ No newline at end of file
+        pass
+
+@receiver(post_save)
+def record_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if sender in MODEL_NAMES:
+        record(instance, 'insert' if created else 'update')
+    if sender in activity.KINDS:
+        activity.log(instance, 'create' if created else 'update')
+
+@receiver(post_delete)
+def record_delete(sender, instance, **kwargs):
+    if sender in MODEL_NAMES:
+        record(instance, 'delete')
+    if sender in activity.KINDS:
+        activity.log(instance, 'delete')
+
+@receiver(post_save, sender=FormTemplate)
+def publish_form_template(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        event = {
+            'type': 'form_template',
+            'id': instance.pk,
+            'name': instance.name,
+            'created_at': instance.created_at.isoformat(),
+            'url': reverse('form_design_edit', args=[instance.pk]),
+        }
+        transaction.on_commit(lambda: broker.publish(instance.created_by_id, event))
+
+@receiver(post_save, sender=Employee)
+def publish_employee(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        event = {
+            'type': 'employee',
+            'id': instance.pk,
+            'form_template': instance.form_template.name,
+            'created_at': instance.created_at.isoformat(),
+            'url': reverse('employee_detail', args=[instance.pk]),
+        }
+        transaction.on_commit(lambda: broker.publish(instance.created_by_id, event))
+
+@receiver(post_save, sender=FormField)
+def refresh_key_fingerprints(sender, instance, created, raw=False, **kwargs):
+    # Key fields were added or removed: every fingerprint of the template changes
+    if raw or instance.is_key == getattr(instance, 'loaded_is_key', False):
+        return
+    instance.loaded_is_key = instance.is_key
+    template_id = instance.form_template_id
+    transaction.on_commit(lambda: refresh_template(template_id), using=instance._state.db)
+
+@receiver(post_migrate)
+def prepare_tenant_shard(sender, using, **kwargs):
+    if sender.name == 'employees' and using in shard_aliases():
+        prepare_shard(using)
@@ -0,0 +1,175 @@
+"""
+Slow-query log.
+
+SlowQueryMiddleware times every statement a request runs, on every
+database, with ``connection.execute_wrapper``. Statements slower than
+SLOW_QUERY_MS are recorded once the response is ready, so the log never
+joins the request's transactions. Each is reduced to a fingerprint: the SQL
+with literals and parameter lists normalized, so ``IN (%s, %s)`` and
+``IN (%s, %s, %s)`` count as the same query. SlowQuery keeps one row per
+fingerprint with count/total/max. For the slowest occurrence it also keeps
+the view, a sample of the parameters and the ``EXPLAIN QUERY PLAN``.
+
+``manage.py slow_queries`` prints the top offenders.
+"""
+import hashlib
+import logging
+import re
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import async_to_sync, iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DatabaseError, IntegrityError, connections
+from django.db.models import F
+from django.utils import timezone
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+PARAM_SAMPLE_SIZE = 20
+PARAM_MAX_LENGTH = 100
+
+STRING_RE = re.compile(r"'(?:[^']|'')*'")
+NUMBER_RE = re.compile(r'(?<![\w."])-?\d+(?:\.\d+)?\b')
+PLACEHOLDER_RE = re.compile(r'%s|\?')
+LIST_RE = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+SPACE_RE = re.compile(r'\s+')
+
+
+def normalize(sql):
+    sql = STRING_RE.sub('?', sql)
+    sql = NUMBER_RE.sub('?', sql)
+    sql = PLACEHOLDER_RE.sub('?', sql)
+    sql = LIST_RE.sub('(...)', sql)
+    return SPACE_RE.sub(' ', sql).strip()
+
+
+def fingerprint(normalized):
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+
+def sample_params(params, many):
+    if many:
+        # executemany: the first row stands for the rest
+        params = next(iter(params or ()), ())
+    if isinstance(params, dict):
+        params = list(params.values())
+    sample = [
+        value[:PARAM_MAX_LENGTH] if isinstance(value, str) else value
+        for value in list(params or ())[:PARAM_SAMPLE_SIZE]
+    ]
+    return repr(sample)
+
+
+def explain(alias, sql, params, many):
+    """The query plan of a statement, or '' when it can't be had."""
+    connection = connections[alias]
+    if connection.vendor != 'sqlite':
+        return ''
+    if many:
+        params = next(iter(params or ()), ())
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            rows = cursor.fetchall()
+    except DatabaseError:
+        return ''
+    # (id, parent, notused, detail) rows; indent children under their parent
+    depth = {0: -1}
+    lines = []
+    for node, parent, _, detail in rows:
+        depth[node] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node] + detail)
+    return '\n'.join(lines)
+
+
+class QueryTimer:
+    """An execute_wrapper collecting the statements of one request that exceed ``threshold`` ms."""
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.view = ''
+        self.slow = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            if duration >= self.threshold:
+                self.slow.append((context['connection'].alias, sql, params, many, duration, self.view))
+
+
+def record(alias, sql, params, many, duration, view):
+    normalized = normalize(sql)
+    key = fingerprint(normalized)
+    now = timezone.now()
+    slow_queries = SlowQuery.objects.using('default')
+    aggregated = slow_queries.filter(fingerprint=key).update(
+        count=F('count') + 1, total_ms=F('total_ms') + duration, last_seen=now,
+    )
+    worst = None
+    if not aggregated or slow_queries.filter(fingerprint=key, max_ms__lt=duration).exists():
+        worst = {
+            'view': view[:200], 'database': alias, 'sample_sql': sql,
+            'sample_params': sample_params(params, many), 'plan': explain(alias, sql, params, many),
+        }
+    if not aggregated:
+        try:
+            slow_queries.create(
+                fingerprint=key, sql=normalized, count=1, total_ms=duration, max_ms=duration,
+                first_seen=now, last_seen=now, **worst,
+            )
+            return
+        except IntegrityError:
+            # Another request recorded it first
+            slow_queries.filter(fingerprint=key).update(
+                count=F('count') + 1, total_ms=F('total_ms') + duration, last_seen=now,
+            )
+    if worst:
+        slow_queries.filter(fingerprint=key, max_ms__lt=duration).update(max_ms=duration, **worst)
+
+
+class SlowQueryMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.threshold = getattr(settings, 'SLOW_QUERY_MS', None)
+        if not self.threshold:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.timed(request, self.get_response)
+
+    async def __acall__(self, request):
+        # The wrappers go on the connections of the thread the request's sync
+        # code (views, ORM) runs on, which is the one sync_to_async uses
+        return await sync_to_async(self.timed)(request, async_to_sync(self.get_response))
+
+    def timed(self, request, get_response):
+        timer = request._query_timer = QueryTimer(self.threshold)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(timer))
+            response = get_response(request)
+        for entry in timer.slow:
+            try:
+                record(*entry)
+            except DatabaseError:
+                logger.exception('Could not record a slow query')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+        target = view_class or view_func
+        request._query_timer.view = f'{target.__module__}.{target.__qualname__}'
@@ -0,0 +1,319 @@
+"""
+Where employee field values live.
+
+EMPLOYEE_STORAGE selects the layout:
+
+- ``'eav'``: one EmployeeData row per value (the original layout).
+- ``'dual'``: written to both EmployeeData and ``Employee.field_values``, read
+  from ``field_values``. Use this while ``manage.py migrate_employee_storage``
+  backfills existing employees.
+- ``'json'``: only ``Employee.field_values``, a ``{"<field id>": value}``
+  document, so reading a record is a single row.
+
+Hot keys can get SQLite JSON1 expression indexes with
+``manage.py migrate_employee_storage --index <field id>``.
+"""
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from django.db.models import BooleanField, Count, IntegerField, OuterRef, Q, Subquery, TextField
+from django.db.models.functions import Coalesce
+from django.db.models.expressions import RawSQL
+
+from .changes import record_deletes, record_many, snapshot
+from .dictionary import decode_value, encode_data, matching_rows, value_counts as dictionary_value_counts
+from .models import Employee, EmployeeData, FieldValueCode
+from .sharding import db_for_model
+
+BACKFILL_CHUNK_SIZE = 500
+
+
+def storage_mode():
+    return getattr(settings, 'EMPLOYEE_STORAGE', 'eav')
+
+
+def uses_document():
+    return storage_mode() in ('dual', 'json')
+
+
+def uses_eav():
+    return storage_mode() in ('eav', 'dual')
+
+
+def write_values(employee, values):
+    """
+    Store ``{field_id: value}`` for ``employee``, replacing any existing value
+    of those fields.
+    """
+    from .fingerprints import refresh_fingerprints
+
+    values = {int(field_id): value for field_id, value in values.items()}
+    if not values:
+        return
+    with transaction.atomic(using=db_for_model(Employee)):
+        if uses_eav():
+            existing = set(
+                EmployeeData.all_objects.filter(employee=employee, field_id__in=values).values_list('field_id', flat=True)
+            )
+            rows = [EmployeeData(employee=employee, field_id=field_id, value=value)
+                    for field_id, value in values.items()]
+            encode_data(rows, db_for_model(EmployeeData))
+            rows = EmployeeData.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=['employee', 'field'],
+                update_fields=['value', 'code'],
+            )
+            for action in ('insert', 'update'):
+                record_many(EmployeeData, action, [
+                    (row.pk, employee.created_by_id, dict(snapshot(row), value=values[row.field_id]))
+                    for row in rows if (row.field_id in existing) == (action == 'update')
+                ])
+        if uses_document():
+            # A queryset update, so value writes don't show up as employee
+            # edits in the activity journal; the change feed gets one entry
+            employee.field_values.update({str(field_id): value for field_id, value in values.items()})
+            employee.updated_at = timezone.now()
+            Employee.all_objects.filter(pk=employee.pk).update(
+                field_values=employee.field_values, updated_at=employee.updated_at
+            )
+            record_many(Employee, 'update', [(employee.pk, employee.created_by_id, snapshot(employee))])
+        refresh_fingerprints(employee.form_template_id, [employee.pk])
+
+
+
+def update_values(changes):
+    """
+    Apply ``changes``, a list of ``(employee, {field_id: value})`` where a
+    value of None removes it, in one transaction. Values equal to what is
+    stored are skipped, and only employees with an actual change get a new
+    ``updated_at`` and an activity entry. Returns ``{employee_id: [changed
+    field ids]}``.
+    """
+    from .activity import log_many
+    from .fingerprints import refresh_fingerprints
+
+    changes = [(employee, {int(field_id): value for field_id, value in values.items()})
+               for employee, values in changes]
+    current = values_for(
+        [employee.pk for employee, _ in changes],
+        {field_id for _, values in changes for field_id in values},
+    )
+    upserts, removals, changed = [], [], {}
+    for employee, values in changes:
+        stored = current[employee.pk]
+        for field_id, value in values.items():
+            if value is None and field_id in stored:
+                removals.append((employee, field_id))
+            elif value is not None and stored.get(field_id) != value:
+                upserts.append((employee, field_id, value))
+            else:
+                continue
+            changed.setdefault(employee.pk, []).append(field_id)
+    if not changed:
+        return changed
+
+    employees = [employee for employee, _ in changes if employee.pk in changed]
+    now = timezone.now()
+    with transaction.atomic(using=db_for_model(Employee)):
+        if uses_eav():
+            if upserts:
+                rows = [EmployeeData(employee=employee, field_id=field_id, value=value)
+                        for employee, field_id, value in upserts]
+                owners = {employee.pk: employee.created_by_id for employee in employees}
+                encode_data(rows, db_for_model(EmployeeData))
+                rows = EmployeeData.all_objects.bulk_create(
+                    rows,
+                    update_conflicts=True,
+                    unique_fields=['employee', 'field'],
+                    update_fields=['value', 'code'],
+                )
+                for action in ('insert', 'update'):
+                    record_many(EmployeeData, action, [
+                        (row.pk, owners[row.employee_id], dict(snapshot(row), value=value))
+                        for row, (_, field_id, value) in zip(rows, upserts)
+                        if (field_id in current[row.employee_id]) == (action == 'update')
+                    ])
+            if removals:
+                condition = Q()
+                for employee, field_id in removals:
+                    condition |= Q(employee_id=employee.pk, field_id=field_id)
+                removed = EmployeeData.all_objects.filter(condition)
+                record_deletes(removed)
+                removed._raw_delete(removed.db)
+        update_fields = ['updated_at']
+        if uses_document():
+            update_fields.append('field_values')
+            for employee, field_id, value in upserts:
+                employee.field_values[str(field_id)] = value
+            for employee, field_id in removals:
+                employee.field_values.pop(str(field_id), None)
+        for employee in employees:
+            employee.updated_at = now
+        Employee.all_objects.bulk_update(employees, update_fields)
+        record_many(Employee, 'update', [(e.pk, e.created_by_id, snapshot(e)) for e in employees])
+        log_many(employees, 'update')
+        by_template = {}
+        for employee in employees:
+            by_template.setdefault(employee.form_template_id, []).append(employee.pk)
+        for template_id, employee_ids in by_template.items():
+            refresh_fingerprints(template_id, employee_ids)
+    return changed
+
+def field_rows(employee):
+    """
+    The values of ``employee`` as dicts shaped like EmployeeDataSerializer
+    output, in field order. Document rows have no EmployeeData id.
+    """
+    if not uses_document():
+        data = EmployeeData.objects.filter(employee=employee).select_related('field').order_by('field__order', 'field_id')
+        return [
+            {'id': d.pk, 'employee': employee.pk, 'field': d.field_id, 'field_label': d.field.label,
+             'field_type': d.field.field_type, 'value': decode_value(data.db, d.field_id, d.value, d.code)}
+            for d in data
+        ]
+    doc = employee.field_values
+    return [
+        {'id': None, 'employee': employee.pk, 'field': f.pk, 'field_label': f.label,
+         'field_type': f.field_type, 'value': doc[str(f.pk)]}
+        for f in employee.form_template.fields.order_by('order', 'pk')
+        if str(f.pk) in doc
+    ]
+
+
+def values_for(employee_ids, field_ids):
+    """``{employee_id: {field_id: value}}`` for the given employees and fields."""
+    values = {pk: {} for pk in employee_ids}
+    if uses_document():
+        keys = [str(field_id) for field_id in field_ids]
+        for pk, doc in Employee.all_objects.filter(pk__in=employee_ids).values_list('pk', 'field_values'):
+            values[pk] = {int(key): doc[key] for key in keys if key in doc}
+    else:
+        rows = EmployeeData.all_objects.filter(employee_id__in=employee_ids, field_id__in=field_ids)
+        for employee_id, field_id, value, code in rows.values_list('employee_id', 'field_id', 'value', 'code'):
+            values[employee_id][field_id] = decode_value(rows.db, field_id, value, code)
+    return values
+
+
+def _connection():
+    return connections[db_for_model(Employee)]
+
+
+def _table():
+    return _connection().ops.quote_name(Employee._meta.db_table)
+
+
+def value_count_expression():
+    """Number of stored values per employee, for ``annotate()``."""
+    return RawSQL(f'(SELECT COUNT(*) FROM json_each({_table()}."field_values"))', [], output_field=IntegerField())
+
+
+def value_search_expression(query):
+    """True when any stored value contains ``query`` (case-insensitive), for ``filter()``."""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return RawSQL(
+        f"EXISTS (SELECT 1 FROM json_each({_table()}.\"field_values\") "
+        f"WHERE json_each.value LIKE %s ESCAPE '\\')",
+        [f'%{escaped}%'],
+        output_field=BooleanField(),
+    )
+
+
+def _value_path_sql(field_id):
+    return f'json_extract({_table()}."field_values", \'$."{int(field_id)}"\')'
+
+
+def filter_value(employees, field_id, value):
+    """Narrow an Employee queryset to those whose ``field_id`` value equals ``value``."""
+    if uses_document():
+        return employees.filter(RawSQL(f'{_value_path_sql(field_id)} = %s', [value], output_field=BooleanField()))
+    return employees.filter(pk__in=matching_rows(field_id, value).values('employee_id'))
+
+
+def value_expression(field_id):
+    """The stored value of ``field_id`` (or NULL) per employee, for ``annotate()``."""
+    if uses_document():
+        return RawSQL(_value_path_sql(field_id), [], output_field=TextField())
+    decoded = FieldValueCode.objects.filter(field_id=field_id, code=OuterRef('code')).values('value')[:1]
+    return Subquery(
+        EmployeeData.objects.filter(employee=OuterRef('pk'), field_id=field_id)
+        .annotate(stored=Coalesce(Subquery(decoded), 'value')).values('stored')[:1],
+        output_field=TextField(),
+    )
+
+
+def value_counts(field, employees=None):
+    """
+    ``[(value, count)]`` for ``field`` across its template's employees, or
+    the ``employees`` queryset when given, most common first.
+    """
+    if not uses_document():
+        return dictionary_value_counts(field.pk, employees)
+    if employees is None:
+        employees = Employee.objects.filter(form_template_id=field.form_template_id)
+    rows = employees.annotate(
+        field_value=RawSQL(_value_path_sql(field.pk), [], output_field=TextField())
+    ).filter(field_value__isnull=False).values('field_value').annotate(n=Count('id')).order_by('-n', 'field_value')
+    return [(row['field_value'], row['n']) for row in rows]
+
+
+def strip_field(field_id, chunk_size=BACKFILL_CHUNK_SIZE):
+    """Remove ``field_id`` from every document that has it, one chunk per transaction."""
+    path = f'$."{int(field_id)}"'
+    table = _table()
+    stripped = 0
+    while True:
+        connection = _connection()
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(
+                f'UPDATE {table} SET "field_values" = json_remove("field_values", %s) '
+                f'WHERE id IN (SELECT id FROM {table} '
+                f'WHERE json_type("field_values", %s) IS NOT NULL LIMIT %s)',
+                [path, path, chunk_size],
+            )
+            rowcount = cursor.rowcount
+        stripped += rowcount
+        if rowcount < chunk_size:
+            return stripped
+
+
+def backfill_documents(start_after=0, chunk_size=BACKFILL_CHUNK_SIZE):
+    """
+    Copy EmployeeData into ``field_values`` for every employee with
+    ``pk > start_after``, in pk order. Yields the last pk of each chunk so the
+    caller can report progress and resume.
+    """
+    last_pk = start_after
+    while True:
+        ids = list(
+            Employee.all_objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        docs = {pk: {} for pk in ids}
+        rows = EmployeeData.all_objects.filter(employee_id__in=ids)
+        for employee_id, field_id, value, code in rows.values_list('employee_id', 'field_id', 'value', 'code'):
+            docs[employee_id][str(field_id)] = decode_value(rows.db, field_id, value, code)
+        with transaction.atomic(using=db_for_model(Employee)):
+            Employee.all_objects.bulk_update(
+                [Employee(pk=pk, field_values=doc) for pk, doc in docs.items()], ['field_values']
+            )
+        last_pk = ids[-1]
+        yield last_pk
+
+
+def index_name(field_id):
+    return f'employee_field_values_{int(field_id)}_idx'
+
+
+def create_field_index(field_id):
+    with _connection().cursor() as cursor:
+        cursor.execute(
+            f'CREATE INDEX IF NOT EXISTS {index_name(field_id)} ON {_table()} '
+            f'(json_extract("field_values", \'$."{int(field_id)}"\'))'
+        )
+
+
+def drop_field_index(field_id):
+    with _connection().cursor() as cursor:
+        cursor.execute(f'DROP INDEX IF EXISTS {index_name(field_id)}')
@@ -0,0 +1,182 @@
+"""
+Value suggestions for autocomplete.
+
+suggest() answers from an in-memory index per field: the field's distinct
+values sorted by their casefolded form, each with the number of employees
+holding it. A prefix is a contiguous range of that list, found with two
+binary searches. To rank a range without scanning it, the list is cut into
+blocks of BLOCK_SIZE values, and blocks are grouped by BLOCK_FANOUT into
+larger ones, level by level; each block keeps its MAX_LIMIT most common
+values. A range is covered by a few dozen whole blocks plus at most two
+partial ones, so a query reads a few thousand candidates however many values
+match.
+
+An index is built from storage.value_counts() the first time its field is
+asked for (one GROUP BY over the ``(field, code, value)`` index) and kept in
+a per-process LRU holding up to SUGGEST_CACHE_VALUES values in total.
+Values inserted by this process are added as they commit: the same
+change-log calls that feed employees.materialized call track(), so a value
+just saved is suggested at once. Removed or replaced values, and writes from
+other processes, are picked up when the index is rebuilt, SUGGEST_TTL
+seconds after it was built.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import EmployeeData
+from .sharding import db_for_model
+
+# Field types worth suggesting; never passwords
+FIELD_TYPES = ('text', 'email', 'number', 'date', 'select', 'radio')
+MAX_LIMIT = 20
+BLOCK_SIZE = 256
+BLOCK_FANOUT = 32
+# Values added since the build; beyond this the index is rebuilt instead
+MAX_ADDED = 1000
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def suggestible(field):
+    return field.field_type in FIELD_TYPES
+
+
+def _top(counts, candidates):
+    """The MAX_LIMIT most common of ``candidates`` (positions), ties in list order."""
+    return sorted(sorted(candidates), key=counts.__getitem__, reverse=True)[:MAX_LIMIT]
+
+
+class ValueIndex:
+    def __init__(self, counts):
+        entries = sorted((value.casefold(), value, n) for value, n in counts if value)
+        self.keys = [key for key, _, _ in entries]
+        self.values = [value for _, value, _ in entries]
+        self.counts = [n for _, _, n in entries]
+        # levels[l][b]: the top positions of block b, which spans BLOCK_SIZE * BLOCK_FANOUT**l values
+        size = len(self.keys)
+        self.levels = [[
+            _top(self.counts, range(start, min(start + BLOCK_SIZE, size)))
+            for start in range(0, size, BLOCK_SIZE)
+        ]]
+        while len(self.levels[-1]) > 1:
+            below = self.levels[-1]
+            self.levels.append([
+                _top(self.counts, [i for block in below[start:start + BLOCK_FANOUT] for i in block])
+                for start in range(0, len(below), BLOCK_FANOUT)
+            ])
+        # {value: count} written since the build
+        self.added = {}
+        self.built = time.monotonic()
+
+    def __len__(self):
+        return len(self.keys) + len(self.added)
+
+    def _candidates(self, start, end):
+        """Positions in ``[start, end)`` that include its MAX_LIMIT most common."""
+        size = len(self.keys)
+        candidates = []
+        i = start
+        while i < end:
+            # The largest block starting at i that ends by end, else the single value at i
+            for level in reversed(range(len(self.levels))):
+                span = BLOCK_SIZE * BLOCK_FANOUT ** level
+                if i % span == 0 and min(i + span, size) <= end:
+                    candidates.extend(self.levels[level][i // span])
+                    i += span
+                    break
+            else:
+                candidates.append(i)
+                i += 1
+        return candidates
+
+    def _position(self, value):
+        key = value.casefold()
+        i = bisect_left(self.keys, key)
+        while i < len(self.keys) and self.keys[i] == key:
+            if self.values[i] == value:
+                return i
+            i += 1
+        return None
+
+    def suggest(self, prefix, limit):
+        """``[(value, count)]``: the ``limit`` most common values starting with ``prefix``, any case."""
+        key = prefix.casefold()
+        start = bisect_left(self.keys, key)
+        end = bisect_left(self.keys, key + '\U0010ffff', start)
+        found = {self.values[i]: self.counts[i] for i in _top(self.counts, self._candidates(start, end))}
+        for value, n in self.added.items():
+            if value.casefold().startswith(key):
+                i = self._position(value)
+                found[value] = n + (0 if i is None else self.counts[i])
+        # Most common first, ties in alphabetical order
+        return sorted(found.items(), key=lambda item: (-item[1], item[0].casefold(), item[0]))[:limit]
+
+    def add(self, value, n=1):
+        self.added[value] = self.added.get(value, 0) + n
+
+    def stale(self):
+        ttl = getattr(settings, 'SUGGEST_TTL', 300)
+        return len(self.added) > MAX_ADDED or time.monotonic() - self.built >= ttl
+
+
+def _evict():
+    budget = getattr(settings, 'SUGGEST_CACHE_VALUES', 1_000_000)
+    total = sum(len(index) for index in _indexes.values())
+    while total > budget and len(_indexes) > 1:
+        _, index = _indexes.popitem(last=False)
+        total -= len(index)
+
+
+def get_index(field):
+    """The field's index on the active shard, built or rebuilt as needed."""
+    from .storage import value_counts
+
+    cache_key = (db_for_model(EmployeeData), field.pk)
+    with _lock:
+        index = _indexes.get(cache_key)
+        if index is not None and not index.stale():
+            _indexes.move_to_end(cache_key)
+            return index
+    # Build outside the lock; a concurrent build of the same field just loses the race
+    index = ValueIndex(value_counts(field))
+    with _lock:
+        _indexes[cache_key] = index
+        _evict()
+    return index
+
+
+def suggest(field, prefix, limit=10):
+    """``[(value, count)]`` completing ``prefix`` for ``field``, most common first."""
+    index = get_index(field)
+    with _lock:
+        return index.suggest(prefix, min(limit, MAX_LIMIT))
+
+
+def track(model, action, rows):
+    """
+    Note inserted EmployeeData ``rows``; their values join the cached indexes
+    on commit. An update would also have to take one off the old value's
+    count, which the change log doesn't carry, so updates wait for the
+    rebuild rather than inflate the new value's count.
+    """
+    if model is not EmployeeData or action != 'insert':
+        return
+    values = [(row['field_id'], row['value']) for row in rows if row.get('value')]
+    if values:
+        alias = db_for_model(EmployeeData)
+        transaction.on_commit(partial(_apply, alias, values), using=alias, robust=True)
+
+
+def _apply(alias, values):
+    with _lock:
+        for field_id, value in values:
+            index = _indexes.get((alias, field_id))
+            if index is not None:
+                index.add(value)
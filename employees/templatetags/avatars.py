@@ -0,0 +1,21 @@
+from django import template
+from django.core.files.storage import default_storage
+
+from employees.images import THUMBNAIL_SIZES, thumbnail_name
+
+register = template.Library()
+
+
+@register.simple_tag
+def avatar_url(user, size='sm', fmt='webp'):
+    """
+    URL of ``user``'s profile picture at a named size (see THUMBNAIL_SIZES).
+    Falls back to the original upload while thumbnails are still being built.
+
+    Usage: ``{% avatar_url request.user 'md' %}``
+    """
+    if not user.profile_picture:
+        return ''
+    if user.profile_picture_hash and size in THUMBNAIL_SIZES:
+        return default_storage.url(thumbnail_name(user.profile_picture_hash, size, fmt))
+    return user.profile_picture.url
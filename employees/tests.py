@@ -1,3 +1,929 @@
-from django.test import TestCase
+import io
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from PIL import Image
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import (
+    activity, backup, deletion, dictionary, images, jobs, materialized, reports, sharding, slowqueries, suggest,
+)
+from .admin import JobAdmin
+from .models import (
+    ActivityEntry, ArchivedEmployee, ChangeLogEntry, CustomUser, Employee, EmployeeData, FormField, FormTemplate, Job,
+    FieldValueCode, SlowQuery, TenantShard,
+)
+from .storage import field_rows, update_values, values_for, write_values
+from .templatetags.avatars import avatar_url
+from .validation import InvalidValue, PARSERS, TemplateValidator
+
+
+def picture(color='red', size=(400, 200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile('me.png', buffer.getvalue(), content_type='image/png')
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x',
+                                                   profile_picture=picture())
+
+    def test_every_size_and_format_is_built(self):
+        digest = images.generate_thumbnails(self.user.pk, self.user.profile_picture.name)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_picture_hash, digest)
+        for size, edge in images.THUMBNAIL_SIZES.items():
+            for fmt in images.THUMBNAIL_FORMATS:
+                name = images.thumbnail_name(digest, size, fmt)
+                with default_storage.open(name) as fh, Image.open(fh) as thumb:
+                    self.assertEqual(thumb.size, (edge, edge), name)
+        self.assertTrue(avatar_url(self.user, 'md').endswith(f'{digest}_300.webp'))
+
+    def test_original_is_served_until_thumbnails_exist(self):
+        self.assertEqual(avatar_url(self.user), self.user.profile_picture.url)
+        self.assertEqual(avatar_url(CustomUser(username='nobody')), '')
+
+    def test_replaced_picture_keeps_no_stale_hash(self):
+        old_name = self.user.profile_picture.name
+        self.user.profile_picture = picture('blue')
+        self.user.save()
+        images.generate_thumbnails(self.user.pk, old_name)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.profile_picture_hash, '')
+
+    def test_scheduled_after_commit(self):
+        with mock.patch.object(images, '_executor') as executor:
+            with self.captureOnCommitCallbacks() as callbacks:
+                images.schedule_thumbnails(self.user)
+            executor.submit.assert_not_called()
+            callbacks[0]()
+        executor.submit.assert_called_once_with(images._run, self.user.pk, self.user.profile_picture.name)
+
+
+def succeeding_task(value):
+    return value * 2
+
+
+def failing_task():
+    raise ValueError('boom')
+
+
+class JobQueueTests(TestCase):
+    def test_claim_is_exclusive(self):
+        job = jobs.enqueue(succeeding_task, 1)
+        claimed = jobs.claim('worker-a')
+        self.assertEqual(claimed.pk, job.pk)
+        self.assertEqual((claimed.status, claimed.locked_by, claimed.attempts), ('running', 'worker-a', 1))
+        self.assertIsNone(jobs.claim('worker-b'))
+
+    def test_claims_take_distinct_jobs_in_run_at_order(self):
+        later = jobs.enqueue(succeeding_task, 1)
+        sooner = jobs.enqueue(succeeding_task, 2)
+        Job.objects.filter(pk=sooner.pk).update(run_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(jobs.claim('worker-a').pk, sooner.pk)
+        self.assertEqual(jobs.claim('worker-b').pk, later.pk)
+        self.assertIsNone(jobs.claim('worker-c'))
+
+    def test_future_job_is_not_claimed(self):
+        jobs.enqueue(succeeding_task, 1, delay=timedelta(minutes=5))
+        self.assertIsNone(jobs.claim('worker-a'))
+
+    def test_stale_lock_is_reclaimed(self):
+        job = jobs.enqueue(succeeding_task, 1)
+        jobs.claim('dead-worker')
+        self.assertIsNone(jobs.claim('worker-b'))
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - jobs.LOCK_TIMEOUT - timedelta(seconds=1))
+        reclaimed = jobs.claim('worker-b')
+        self.assertEqual(reclaimed.pk, job.pk)
+        self.assertEqual((reclaimed.locked_by, reclaimed.attempts), ('worker-b', 2))
+
+    def test_stale_lock_past_max_attempts_fails_the_job(self):
+        job = jobs.enqueue(succeeding_task, 1, max_attempts=1)
+        jobs.claim('dead-worker')
+        self.assertIsNone(jobs.claim('worker-b'))
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'running')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - jobs.LOCK_TIMEOUT - timedelta(seconds=1))
+        with self.assertLogs('employees.jobs', 'WARNING'):
+            self.assertIsNone(jobs.claim('worker-b'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.locked_by), ('failed', 1, 'dead-worker'))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIn('Worker lost', job.last_error)
+
+    def test_refresh_lock_keeps_a_running_job_claimed(self):
+        job = jobs.enqueue(succeeding_task, 1)
+        claimed = jobs.claim('worker-a')
+        Job.objects.filter(pk=job.pk).update(locked_at=timezone.now() - jobs.LOCK_TIMEOUT - timedelta(seconds=1))
+        self.assertTrue(jobs.refresh_lock(claimed))
+        self.assertIsNone(jobs.claim('worker-b'))
+        jobs.run_job(claimed)
+        self.assertFalse(jobs.refresh_lock(claimed))
+
+    def test_heartbeat_beats_while_the_job_runs(self):
+        jobs.enqueue(succeeding_task, 1)
+        job = jobs.claim('worker-a')
+        beats = threading.Semaphore(0)
+        with mock.patch.object(jobs, 'refresh_lock', side_effect=lambda job: beats.release() or True) as refresh:
+            with jobs.heartbeat(job, timedelta(milliseconds=10)):
+                self.assertTrue(beats.acquire(timeout=5))
+                self.assertTrue(beats.acquire(timeout=5))
+            # The thread is gone once the block exits
+            calls = refresh.call_count
+            time.sleep(0.05)
+            self.assertEqual(refresh.call_count, calls)
+        refresh.assert_called_with(job)
+
+    def test_success_records_result(self):
+        job = jobs.enqueue(succeeding_task, 21)
+        self.assertTrue(jobs.run_job(jobs.claim('worker-a')))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.result, job.locked_by), ('succeeded', 42, 'worker-a'))
+        self.assertIsNotNone(job.finished_at)
+
+    def test_retry_delay_grows_and_is_capped(self):
+        for attempts in range(1, 20):
+            delay = min(jobs.RETRY_BASE_DELAY * 2 ** (attempts - 1), jobs.RETRY_MAX_DELAY)
+            seconds = jobs.retry_delay(attempts).total_seconds()
+            self.assertGreaterEqual(seconds, delay * 0.8)
+            self.assertLessEqual(seconds, delay * 1.2)
+
+    def test_failures_back_off_until_max_attempts(self):
+        job = jobs.enqueue(failing_task, max_attempts=3)
+        for attempt in (1, 2):
+            before = timezone.now()
+            with self.assertLogs('employees.jobs', 'WARNING'):
+                jobs.worker_loop(threading.Event(), 'worker-a', burst=True)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.attempts, job.locked_by), ('queued', attempt, ''))
+            self.assertIn('ValueError: boom', job.last_error)
+            delay = (job.run_at - before).total_seconds()
+            base = jobs.RETRY_BASE_DELAY * 2 ** (attempt - 1)
+            self.assertGreaterEqual(delay, base * 0.8 - 1)
+            self.assertLessEqual(delay, base * 1.2 + 1)
+            # Not due yet: a burst worker finds nothing to do
+            jobs.worker_loop(threading.Event(), 'worker-a', burst=True)
+            job.refresh_from_db()
+            self.assertEqual(job.attempts, attempt)
+            Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        with self.assertLogs('employees.jobs', 'WARNING'):
+            jobs.worker_loop(threading.Event(), 'worker-a', burst=True)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertIsNotNone(job.finished_at)
+        self.assertIsNone(jobs.claim('worker-a'))
+
+
+class SoftDeleteManagerTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        cls.field = FormField.objects.create(form_template=cls.template, label='Name', field_type='text')
+        cls.employee = Employee.objects.create(form_template=cls.template, created_by=cls.user)
+        EmployeeData.objects.create(employee=cls.employee, field=cls.field, value='Ada')
+
+    @override_settings(DELETE_IN_BACKGROUND=False)
+    def test_no_parent_joins_without_background_deletion(self):
+        for queryset in (Employee.objects.all(), EmployeeData.objects.all(), FormField.objects.all()):
+            self.assertNotIn('JOIN', str(queryset.query))
+
+    @override_settings(DELETE_IN_BACKGROUND=True)
+    def test_deleted_template_hides_its_rows(self):
+        FormTemplate.all_objects.filter(pk=self.template.pk).update(deleted_at=timezone.now())
+        self.assertFalse(FormTemplate.objects.exists())
+        self.assertFalse(FormField.objects.exists())
+        self.assertFalse(Employee.objects.exists())
+        self.assertFalse(EmployeeData.objects.exists())
+        self.assertEqual(EmployeeData.all_objects.count(), 1)
+
+    @override_settings(DELETE_IN_BACKGROUND=True)
+    def test_deleted_field_hides_its_values(self):
+        FormField.all_objects.filter(pk=self.field.pk).update(deleted_at=timezone.now())
+        self.assertFalse(EmployeeData.objects.exists())
+        self.assertTrue(Employee.objects.exists())
+
+    def delete_entries(self, model, object_id):
+        return ChangeLogEntry.objects.filter(model=model, object_id=object_id, action='delete').count()
+
+    def test_deletes_are_recorded_once(self):
+        for background in (False, True):
+            with self.subTest(background=background), override_settings(DELETE_IN_BACKGROUND=background):
+                template = FormTemplate.objects.create(name='Other', created_by=self.user)
+                field = FormField.objects.create(form_template=template, label='Name', field_type='text')
+                other = FormField.objects.create(form_template=template, label='City', field_type='text')
+                employee = Employee.objects.create(form_template=template, created_by=self.user)
+                job = deletion.delete_field(field, self.user)
+                if job:
+                    jobs.run_job(jobs.claim('worker-a'))
+                job = deletion.delete_template(template, self.user)
+                if job:
+                    jobs.run_job(jobs.claim('worker-a'))
+                self.assertFalse(FormTemplate.all_objects.filter(pk=template.pk).exists())
+                self.assertEqual(self.delete_entries('form_template', template.pk), 1)
+                self.assertEqual(self.delete_entries('form_field', field.pk), 1)
+                self.assertEqual(self.delete_entries('form_field', other.pk), 1)
+                self.assertEqual(self.delete_entries('employee', employee.pk), 1)
+
+
+class FieldRowsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        # Created out of display order, with a tie broken by id
+        cls.fields = [
+            FormField.objects.create(form_template=cls.template, label=label, field_type='text', order=order)
+            for label, order in (('Last', 2), ('First', 0), ('Middle', 1), ('Middle 2', 1))
+        ]
+
+    def check_order(self):
+        employee = Employee.objects.create(form_template=self.template, created_by=self.user)
+        write_values(employee, {field.pk: field.label for field in reversed(self.fields)})
+        employee.refresh_from_db()
+        labels = [row['field_label'] for row in field_rows(employee)]
+        self.assertEqual(labels, ['First', 'Middle', 'Middle 2', 'Last'])
+
+    @override_settings(EMPLOYEE_STORAGE='eav')
+    def test_eav_rows_in_field_order(self):
+        self.check_order()
+
+    @override_settings(EMPLOYEE_STORAGE='json')
+    def test_document_rows_in_field_order(self):
+        self.check_order()
+
+
+class CompactChangesCommandTests(TestCase):
+    def setUp(self):
+        user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        for name in ('A', 'B', 'C'):
+            FormTemplate.objects.create(name=name, created_by=user)
+        self.seqs = list(ChangeLogEntry.objects.order_by('id').values_list('id', flat=True))
+
+    def compact(self, *args):
+        call_command('compact_changes', *args, stdout=io.StringIO())
+        return list(ChangeLogEntry.objects.order_by('id').values_list('id', flat=True))
+
+    def test_arguments_required(self):
+        with self.assertRaises(CommandError):
+            self.compact()
+
+    def test_before_seq_removes_a_prefix(self):
+        self.assertEqual(self.compact('--before-seq', str(self.seqs[1])), self.seqs[1:])
+
+    def test_newest_entry_is_always_kept(self):
+        self.assertEqual(self.compact('--before-seq', str(self.seqs[-1] + 10)), self.seqs[-1:])
+        self.assertEqual(self.compact('--keep-days', '0'), self.seqs[-1:])
+
+    def test_keep_days(self):
+        ChangeLogEntry.objects.filter(id=self.seqs[0]).update(created_at=timezone.now() - timedelta(days=40))
+        # With both, an entry must be old enough by both measures
+        self.assertEqual(self.compact('--keep-days', '30', '--before-seq', str(self.seqs[2])), self.seqs[1:])
+        self.assertEqual(self.compact('--keep-days', '30'), self.seqs[1:])
+
+
+class ActivityStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+
+    def test_stream_refused_under_wsgi(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/recent-activity/stream/').status_code, 501)
+        self.assertFalse(self.client.get('/recent-activity/').context['live_updates'])
+
+    async def test_live_updates_under_asgi(self):
+        await self.async_client.aforce_login(self.user)
+        response = await self.async_client.get('/recent-activity/')
+        self.assertTrue(response.context['live_updates'])
+        response = await self.async_client.get('/recent-activity/?before=abc')
+        self.assertFalse(response.context['live_updates'])
+
+
+class ActivityJournalTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+
+    def journal(self):
+        return list(ActivityEntry.objects.filter(user=self.user).order_by('id').values_list('kind', 'action', 'label'))
+
+    def test_changes_are_journaled(self):
+        template = FormTemplate.objects.create(name='Staff', created_by=self.user)
+        field = FormField.objects.create(form_template=template, label='Name', field_type='text')
+        employee = Employee.objects.create(form_template=template, created_by=self.user)
+        template.name = 'Team'
+        template.save()
+        deletion.delete_employee(employee)
+        self.assertEqual(self.journal(), [
+            ('form_template', 'create', 'Staff'),
+            ('form_field', 'create', 'Name (Staff)'),
+            ('employee', 'create', f'Employee #{employee.pk} (Staff)'),
+            ('form_template', 'update', 'Team'),
+            ('employee', 'delete', f'Employee #{employee.pk} (Team)'),
+        ])
+        # Value writes are not employee edits
+        write_values(Employee.objects.create(form_template=template, created_by=self.user), {field.pk: 'Ada'})
+        self.assertEqual(self.journal()[-1][:2], ('employee', 'create'))
+
+    def test_feed_pages_newest_first(self):
+        now = timezone.now()
+        ActivityEntry.objects.bulk_create([
+            ActivityEntry(user=self.user, ts=now - timedelta(minutes=minutes), kind='employee', action='create',
+                          object_id=n, label=str(n))
+            # Two entries share a timestamp; the id breaks the tie
+            for n, minutes in enumerate([5, 4, 3, 3, 1])
+        ])
+        labels, cursor = [], None
+        while True:
+            entries, next_cursor = activity.feed_page(self.user, activity.decode_cursor(cursor), page_size=2)
+            labels.append([entry.label for entry in entries])
+            if next_cursor is None:
+                break
+            cursor = next_cursor
+        self.assertEqual(labels, [['4', '3'], ['2', '1'], ['0']])
+
+    def test_cursor_round_trip(self):
+        entry = ActivityEntry.objects.create(user=self.user, kind='employee', action='create', object_id=1, label='x')
+        self.assertEqual(activity.decode_cursor(activity.encode_cursor(entry)), (entry.ts, entry.pk))
+        for value in (None, '', 'abc', '1_2_3', '1_x', '9' * 30 + '_1'):
+            self.assertIsNone(activity.decode_cursor(value), value)
+
+    def test_view_pages(self):
+        ActivityEntry.objects.bulk_create([
+            ActivityEntry(user=self.user, kind='employee', action='create', object_id=n, label=f'entry {n}')
+            for n in range(activity.PAGE_SIZE + 1)
+        ])
+        self.client.force_login(self.user)
+        response = self.client.get('/recent-activity/')
+        self.assertEqual(len(response.context['entries']), activity.PAGE_SIZE)
+        self.assertTrue(response.context['is_first_page'])
+        response = self.client.get('/recent-activity/', {'before': response.context['next_cursor']})
+        self.assertEqual([entry.label for entry in response.context['entries']], ['entry 0'])
+        self.assertIsNone(response.context['next_cursor'])
+        self.assertFalse(response.context['is_first_page'])
+
+    def test_trim_activity(self):
+        now = timezone.now()
+        ActivityEntry.objects.bulk_create([
+            ActivityEntry(user=self.user, ts=now - timedelta(days=days), kind='employee', action='create',
+                          object_id=days, label=str(days))
+            for days in (100, 3, 2, 1, 0)
+        ])
+        call_command('trim_activity', '--keep-days', '90', '--max-per-user', '3', stdout=io.StringIO())
+        self.assertEqual([label for _, _, label in self.journal()], ['2', '1', '0'])
+
+
+@override_settings(TENANT_SHARDS=2, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class ShardingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+
+    def setUp(self):
+        sharding.cache.clear()
+
+    def test_hashed_shard_is_stable_and_in_range(self):
+        self.assertEqual(sharding.shard_aliases(), ['shard_0', 'shard_1'])
+        shards = {user_id: sharding.hashed_shard(user_id) for user_id in range(1, 200)}
+        self.assertEqual(set(shards.values()), {'shard_0', 'shard_1'})
+        self.assertEqual(shards, {user_id: sharding.hashed_shard(user_id) for user_id in range(1, 200)})
+
+    def test_id_ranges_do_not_overlap(self):
+        self.assertEqual(sharding.shard_id_floor('shard_0'), sharding.SHARD_ID_RANGE)
+        self.assertEqual(sharding.shard_id_floor('shard_1'), 2 * sharding.SHARD_ID_RANGE)
+
+    def test_override_pins_and_locks_a_tenant(self):
+        other = {'shard_0': 'shard_1', 'shard_1': 'shard_0'}[sharding.hashed_shard(self.user.pk)]
+        self.assertEqual(sharding.tenant_state(self.user.pk), (sharding.hashed_shard(self.user.pk), False))
+        TenantShard.objects.create(user=self.user, shard=other, locked=True)
+        # Cached until forgotten
+        self.assertEqual(sharding.shard_for_user(self.user.pk), sharding.hashed_shard(self.user.pk))
+        sharding.forget_user(self.user.pk)
+        self.assertEqual(sharding.tenant_state(self.user.pk), (other, True))
+
+    def test_router_follows_the_active_shard(self):
+        router = sharding.TenantRouter()
+        self.assertIsNone(router.db_for_read(Employee))
+        with sharding.use_shard('shard_1'):
+            self.assertEqual(router.db_for_read(Employee), 'shard_1')
+            self.assertEqual(router.db_for_write(ChangeLogEntry), 'shard_1')
+            self.assertIsNone(router.db_for_write(Job))
+            self.assertIsNone(router.db_for_read(CustomUser))
+            # A row stays with the database it was loaded from
+            employee = Employee()
+            employee._state.db = 'shard_0'
+            self.assertEqual(router.db_for_write(Employee, instance=employee), 'shard_0')
+        self.assertIsNone(sharding.current_shard())
+        with override_settings(TENANT_SHARDS=0), sharding.use_shard('shard_1'):
+            self.assertIsNone(router.db_for_read(Employee))
+
+    def test_each_shard(self):
+        self.assertEqual([(alias, sharding.current_shard()) for alias in sharding.each_shard()],
+                         [('shard_0', 'shard_0'), ('shard_1', 'shard_1')])
+        with override_settings(TENANT_SHARDS=0):
+            self.assertEqual([(alias, sharding.current_shard()) for alias in sharding.each_shard()],
+                             [('default', None)])
+
+    def middleware_shard(self, **headers):
+        seen = []
+        middleware = sharding.TenantMiddleware(lambda request: seen.append(sharding.current_shard()) or 'response')
+        request = RequestFactory().get('/', **headers)
+        with mock.patch.object(sharding, 'ensure_user_on_shard') as ensure:
+            response = middleware(request)
+        return response, seen, ensure
+
+    def test_middleware_activates_the_jwt_users_shard(self):
+        token = str(RefreshToken.for_user(self.user).access_token)
+        response, seen, ensure = self.middleware_shard(HTTP_AUTHORIZATION=f'Bearer {token}')
+        shard = sharding.hashed_shard(self.user.pk)
+        self.assertEqual((response, seen), ('response', [shard]))
+        # SimpleJWT carries the user id as a string
+        ensure.assert_called_once_with(str(self.user.pk), shard)
+        response, seen, ensure = self.middleware_shard(HTTP_AUTHORIZATION='Bearer bogus')
+        self.assertEqual(seen, [None])
+        ensure.assert_not_called()
+
+    def test_middleware_refuses_a_tenant_being_moved(self):
+        TenantShard.objects.create(user=self.user, shard='shard_0', locked=True)
+        token = str(RefreshToken.for_user(self.user).access_token)
+        response, seen, _ = self.middleware_shard(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual((response.status_code, response['Retry-After'], seen), (503, '30', []))
+
+    async def test_async_middleware_activates_the_tenants_shard(self):
+        seen = []
+
+        async def view(request):
+            seen.append(sharding.current_shard())
+            return 'response'
+
+        middleware = sharding.TenantMiddleware(view)
+        token = str(RefreshToken.for_user(self.user).access_token)
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+        with mock.patch.object(sharding, 'ensure_user_on_shard'):
+            self.assertEqual(await middleware(request), 'response')
+        self.assertEqual(seen, [sharding.hashed_shard(self.user.pk)])
+        await sync_to_async(TenantShard.objects.create)(user=self.user, shard='shard_0', locked=True)
+        sharding.forget_user(self.user.pk)
+        self.assertEqual((await middleware(request)).status_code, 503)
+        self.assertEqual(len(seen), 1)
+
+    def test_insert_rows_keeps_timestamps(self):
+        created = timezone.now() - timedelta(days=30)
+        template = FormTemplate(name='Staff', created_by=self.user, created_at=created, updated_at=created)
+        sharding.insert_rows(FormTemplate, [template], 'default')
+        template = FormTemplate.all_objects.get(name='Staff')
+        self.assertEqual((template.created_at, template.updated_at), (created, created))
+
+
+class ParserTests(SimpleTestCase):
+    def assertParses(self, field_type, raw, expected):
+        self.assertEqual(PARSERS[field_type](raw), expected, f'{field_type} {raw!r}')
+
+    def assertRejects(self, field_type, raw, code):
+        with self.assertRaises(InvalidValue, msg=f'{field_type} {raw!r}') as caught:
+            PARSERS[field_type](raw)
+        self.assertEqual(caught.exception.code, code)
+
+    def test_text(self):
+        self.assertParses('text', '  kept as is ', '  kept as is ')
+        self.assertParses('password', 's3cret', 's3cret')
+
+    def test_number(self):
+        for raw, expected in (('42', '42'), (' -3.5 ', '-3.5'), ('+.5', '+.5'), ('1e3', '1e3'), ('7.', '7.')):
+            self.assertParses('number', raw, expected)
+        for raw in ('abc', '1,000', '1.2.3', '.', 'e5', '0x10'):
+            self.assertRejects('number', raw, 'invalid_number')
+
+    def test_date(self):
+        self.assertParses('date', ' 2024-02-29 ', '2024-02-29')
+        for raw in ('2023-02-29', '2024-13-01', '24-01-01', '2024/01/01', '2024-1-1'):
+            self.assertRejects('date', raw, 'invalid_date')
+
+    def test_email(self):
+        self.assertParses('email', ' ada@example.com ', 'ada@example.com')
+        for raw in ('ada', 'ada@example', 'a da@example.com', 'ada@@example.com', 'a' * 250 + '@x.io'):
+            self.assertRejects('email', raw, 'invalid_email')
+
+    def test_choices(self):
+        for field_type in ('select', 'radio'):
+            self.assertParses(field_type, 'option1', 'option1')
+            self.assertRejects(field_type, 'option3', 'invalid_choice')
+            self.assertRejects(field_type, ' option1', 'invalid_choice')
+
+    def test_checkbox(self):
+        for raw in ('on', 'TRUE', ' 1 ', 'yes'):
+            self.assertParses('checkbox', raw, 'on')
+        for raw in ('off', 'false', '0', 'No'):
+            self.assertParses('checkbox', raw, None)
+        self.assertRejects('checkbox', 'maybe', 'invalid_checkbox')
+
+
+class TemplateValidatorTests(SimpleTestCase):
+    def setUp(self):
+        self.validator = TemplateValidator([
+            FormField(pk=1, label='Name', field_type='text', required=True),
+            FormField(pk=2, label='Age', field_type='number', required=False),
+            FormField(pk=3, label='Active', field_type='checkbox', required=True),
+        ])
+
+    def test_valid_record_with_int_and_str_keys(self):
+        self.assertEqual(self.validator.validate({'1': 'Ada', 2: '36', '3': 'on'}), ({1: 'Ada', 2: '36', 3: 'on'}, {}))
+
+    def test_unchecked_checkbox_stores_nothing(self):
+        self.assertEqual(self.validator.validate({'1': 'Ada', '3': 'off'}), ({1: 'Ada'}, {}))
+
+    def test_required_field_missing_or_blank(self):
+        for record in ({}, {'1': ''}):
+            cleaned, errors = self.validator.validate(record)
+            self.assertIsNone(cleaned)
+            self.assertEqual(errors, {1: 'This field is required.'})
+
+    def test_checkbox_is_never_required(self):
+        self.assertEqual(self.validator.validate({'1': 'Ada'}), ({1: 'Ada'}, {}))
+
+    def test_partial_allows_missing_but_not_blank(self):
+        self.assertEqual(self.validator.validate({'2': '5'}, partial=True), ({2: '5'}, {}))
+        self.assertEqual(self.validator.validate({'1': ''}, partial=True)[1], {1: 'This field is required.'})
+
+    def test_optional_blank_is_skipped(self):
+        self.assertEqual(self.validator.validate({'1': 'Ada', '2': ''}), ({1: 'Ada'}, {}))
+
+    def test_unknown_field(self):
+        cleaned, errors = self.validator.validate({'1': 'Ada', '99': 'x'})
+        self.assertIsNone(cleaned)
+        self.assertEqual(errors, {'99': 'This template has no such field.'})
+
+    def test_batch_errors_are_columnar(self):
+        result = self.validator.validate_batch([
+            {'1': 'Ada', '2': '36'},
+            {'2': 'old'},
+            {'1': 'Bob', '7': 'x'},
+        ])
+        self.assertEqual(result.values, [{1: 'Ada', 2: '36'}, None, None])
+        self.assertEqual(result.error_count, 3)
+        self.assertEqual(result.errors, {
+            'row': [1, 1, 2],
+            'field': [1, 2, '7'],
+            'code': ['required', 'invalid_number', 'unknown_field'],
+            'message': ['This field is required.', 'Enter a number.', 'This template has no such field.'],
+        })
+
+
+class EmployeeCreateViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        cls.name = FormField.objects.create(form_template=cls.template, label='Name', field_type='text', order=1)
+        cls.remote = FormField.objects.create(form_template=cls.template, label='Remote', field_type='checkbox',
+                                              required=False, order=2)
+        cls.shift = FormField.objects.create(form_template=cls.template, label='Shift', field_type='radio', order=3)
+
+    def test_rejected_form_keeps_choices(self):
+        self.client.force_login(self.user)
+        response = self.client.post(f'/forms/{self.template.pk}/employee/create/', {
+            f'field_{self.name.pk}': '', f'field_{self.remote.pk}': 'on', f'field_{self.shift.pk}': 'option2',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Employee.objects.exists())
+        self.assertContains(response, f'name="field_{self.remote.pk}" checked>')
+        self.assertContains(response, 'value="option2" checked>')
+        self.assertNotContains(response, 'value="option1" checked>')
+
+
+class ArchiveCommandTests(TestCase):
+    def test_inactive_days_zero_archives_everything(self):
+        user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        template = FormTemplate.objects.create(name='Staff', created_by=user)
+        Employee.objects.create(form_template=template, created_by=user)
+        call_command('archive_employees', '--inactive-days', '0', stdout=io.StringIO())
+        self.assertFalse(Employee.objects.exists())
+        self.assertEqual(ArchivedEmployee.objects.count(), 1)
+
+
+class DictionaryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        cls.field = FormField.objects.create(form_template=cls.template, label='Shift', field_type='select')
+
+    def setUp(self):
+        self.addCleanup(dictionary._values.clear)
+        self.addCleanup(dictionary._codes.clear)
+
+    def add_employee(self, shift):
+        employee = Employee.objects.create(form_template=self.template, created_by=self.user)
+        write_values(employee, {self.field.pk: shift})
+        return employee
+
+    def test_values_are_stored_as_codes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            employee = self.add_employee('option1')
+        row = EmployeeData.objects.get(employee=employee)
+        self.assertEqual((row.value, row.code), ('', 1))
+        self.assertEqual(values_for([employee.pk], [self.field.pk]), {employee.pk: {self.field.pk: 'option1'}})
+        self.assertEqual(dictionary._values['default', self.field.pk], {1: 'option1'})
+
+    def test_rolled_back_codes_are_not_cached(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            self.add_employee('option1')
+            self.assertEqual(dictionary.codes_for('default', self.field.pk, ['option1']), {'option1': 1})
+            raise ValueError
+        self.assertFalse(FieldValueCode.objects.exists())
+        self.assertNotIn(('default', self.field.pk), dictionary._codes)
+        # The code is assigned again instead of pointing at nothing
+        with self.captureOnCommitCallbacks(execute=True):
+            employee = self.add_employee('option1')
+        self.assertEqual(values_for([employee.pk], [self.field.pk]), {employee.pk: {self.field.pk: 'option1'}})
+        self.assertEqual(FieldValueCode.objects.get().value, 'option1')
+
+    def test_delete_page_shows_decoded_values(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            employee = self.add_employee('option2')
+        self.client.force_login(self.user)
+        response = self.client.get(f'/employees/{employee.pk}/delete/')
+        self.assertContains(response, '<td>option2</td>', html=True)
+
+    def test_unknown_code_is_an_error(self):
+        employee = self.add_employee('option1')
+        EmployeeData.objects.filter(employee=employee).update(code=99)
+        with self.assertRaises(dictionary.UnknownCode):
+            values_for([employee.pk], [self.field.pk])
+
+
+class SlowQueryTests(TestCase):
+    def test_normalize(self):
+        self.assertEqual(
+            slowqueries.normalize("SELECT * FROM t WHERE  a = 'it''s' AND b = -1.5\n AND c IN (%s, %s, %s)"),
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...)',
+        )
+        # Digits inside identifiers stay
+        self.assertEqual(slowqueries.normalize('SELECT "t1"."col2" FROM t1 LIMIT 21'),
+                         'SELECT "t1"."col2" FROM t1 LIMIT ?')
+        self.assertEqual(slowqueries.normalize('SELECT 1 WHERE x IN (%s)'),
+                         slowqueries.normalize('SELECT 2 WHERE x IN (%s, %s)'))
+
+    def test_sample_params(self):
+        self.assertEqual(slowqueries.sample_params(['x' * 200, 1], False), repr(['x' * 100, 1]))
+        self.assertEqual(slowqueries.sample_params([(1, 2), (3, 4)], True), repr([1, 2]))
+        self.assertEqual(slowqueries.sample_params({'a': 1}, False), repr([1]))
+        self.assertEqual(slowqueries.sample_params(None, False), '[]')
+
+    def test_record_aggregates_and_keeps_the_worst_sample(self):
+        sql = 'SELECT * FROM employees_job WHERE id = %s'
+        slowqueries.record('default', sql, [1], False, 150, 'first.view')
+        slowqueries.record('default', sql, [2], False, 300, 'second.view')
+        slowqueries.record('default', sql, [3], False, 200, 'third.view')
+        entry = SlowQuery.objects.get()
+        self.assertEqual((entry.count, entry.total_ms, entry.max_ms), (3, 650, 300))
+        self.assertEqual((entry.view, entry.sample_params, entry.database), ('second.view', '[2]', 'default'))
+        self.assertEqual(entry.sql, 'SELECT * FROM employees_job WHERE id = ?')
+        self.assertIn('employees_job', entry.plan)
+
+    @override_settings(SLOW_QUERY_MS=1e-9)
+    def test_middleware_records_the_requests_queries(self):
+        user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        self.client.force_login(user)
+        self.client.get('/')
+        views = set(SlowQuery.objects.values_list('view', flat=True))
+        self.assertIn('employees.views.dashboard_view', views)
+
+    @override_settings(SLOW_QUERY_MS=1e-9)
+    async def test_async_middleware_records_the_requests_queries(self):
+        user = await sync_to_async(CustomUser.objects.create_user)(
+            username='owner', email='owner@example.com', password='x',
+        )
+        await self.async_client.aforce_login(user)
+        await self.async_client.get('/')
+        views = await sync_to_async(lambda: set(SlowQuery.objects.values_list('view', flat=True)))()
+        self.assertIn('employees.views.dashboard_view', views)
+
+    def test_command(self):
+        slowqueries.record('default', 'SELECT * FROM employees_job WHERE id = %s', [1], False, 150, 'a.view')
+        out = io.StringIO()
+        call_command('slow_queries', '--plan', stdout=out)
+        self.assertIn('1x, total 150 ms', out.getvalue())
+        self.assertIn('params: [1]', out.getvalue())
+        call_command('slow_queries', '--reset', stdout=io.StringIO())
+        self.assertFalse(SlowQuery.objects.exists())
+
+
+class FieldStatsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        other = CustomUser.objects.create_user(username='other', email='other@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        cls.age = FormField.objects.create(form_template=cls.template, label='Age', field_type='number')
+        cls.shift = FormField.objects.create(form_template=cls.template, label='Shift', field_type='select')
+        for owner, age, shift in [(cls.user, '30', 'option1'), (cls.user, '40', 'option1'), (cls.user, '30', None),
+                                  (cls.user, None, 'option2'), (other, '99', 'option1')]:
+            employee = Employee.objects.create(form_template=cls.template, created_by=owner)
+            write_values(employee, {k: v for k, v in ((cls.age.pk, age), (cls.shift.pk, shift)) if v is not None})
+
+    def stats(self, field, filters=None, backend='eav'):
+        return reports.field_stats(self.template, self.user, field, filters, backend=backend)
+
+    def check_stats(self, backend='eav'):
+        self.assertEqual(self.stats(self.age, backend=backend), {
+            'count': 3, 'distinct': 2, 'min': 30.0, 'max': 40.0, 'avg': 100 / 3, 'top': [(30.0, 2), (40.0, 1)],
+        })
+        self.assertEqual(self.stats(self.shift, {self.age.pk: '30'}, backend=backend), {
+            'count': 1, 'distinct': 1, 'min': 'option1', 'max': 'option1', 'avg': None, 'top': [('option1', 1)],
+        })
+
+    def test_eav(self):
+        # Grouped in the database: the query count doesn't grow with the rows
+        with self.assertNumQueries(3):
+            self.stats(self.age)
+        self.check_stats()
+
+    @override_settings(EMPLOYEE_STORAGE='json')
+    def test_document(self):
+        call_command('migrate_employee_storage', stdout=io.StringIO())
+        self.check_stats()
+
+    @override_settings(MATERIALIZED_TABLES=True)
+    def test_same_as_materialized(self):
+        self.addCleanup(materialized._ready.clear)
+        self.addCleanup(materialized.drop_table, self.template.pk)
+        list(materialized.rebuild(self.template.pk))
+        self.check_stats('materialized')
+
+
+class SuggestTrackingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='owner', email='owner@example.com', password='x')
+        cls.template = FormTemplate.objects.create(name='Staff', created_by=cls.user)
+        cls.field = FormField.objects.create(form_template=cls.template, label='City', field_type='text')
+
+    def setUp(self):
+        self.addCleanup(suggest._indexes.clear)
+
+    def add_employee(self, city):
+        employee = Employee.objects.create(form_template=self.template, created_by=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            write_values(employee, {self.field.pk: city})
+        return employee
+
+    def test_inserted_values_are_counted_at_once(self):
+        self.add_employee('Paris')
+        self.assertEqual(suggest.suggest(self.field, 'pa', 5), [('Paris', 1)])
+        self.add_employee('Paris')
+        self.add_employee('Pau')
+        self.assertEqual(suggest.suggest(self.field, 'pa', 5), [('Paris', 2), ('Pau', 1)])
+
+    def test_updates_do_not_inflate_counts(self):
+        employee = self.add_employee('Paris')
+        self.assertEqual(suggest.suggest(self.field, 'p', 5), [('Paris', 1)])
+        for city in ('Pau', 'Paris', 'Pau'):
+            with self.captureOnCommitCallbacks(execute=True):
+                update_values([(employee, {self.field.pk: city})])
+        self.assertEqual(suggest.suggest(self.field, 'p', 5), [('Paris', 1)])
+        suggest._indexes.clear()
+        self.assertEqual(suggest.suggest(self.field, 'p', 5), [('Pau', 1)])
+
+
+class BackupTests(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.live = os.path.join(self.directory, 'live.sqlite3')
+        self.backups = os.path.join(self.directory, 'backups')
+        self.write('CREATE TABLE staff (name TEXT)', *[f"INSERT INTO staff VALUES ('{i}' || hex(randomblob(500)))"
+                                                       for i in range(200)])
+        # The test database lives in memory; back up a file of our own
+        self.enterContext(mock.patch.object(backup, 'database_path', return_value=self.live))
+
+    def write(self, *statements):
+        with closing(sqlite3.connect(self.live)) as connection, connection:
+            for statement in statements:
+                connection.execute(statement)
+
+    def rows(self, path):
+        with closing(sqlite3.connect(path)) as connection:
+            return connection.execute('SELECT name FROM staff ORDER BY rowid').fetchall()
+
+    def backup(self, **options):
+        return backup.backup('default', directory=self.backups, sleep=0, **options)
+
+    def restored(self, manifest):
+        path = os.path.join(self.directory, manifest['manifest'] + '.restored')
+        backup.restore(manifest['manifest'], path, self.backups)
+        return path
+
+    def test_full_round_trip(self):
+        for compress in (False, True):
+            manifest = self.backup(compress=compress, verify=True, pages=5)
+            self.assertEqual((manifest['kind'], manifest['integrity']), ('full', 'ok'))
+            self.assertGreater(manifest['copy']['steps'], 1)
+            self.assertEqual(manifest['file'].endswith('.gz'), compress)
+            self.assertEqual(self.rows(self.restored(manifest)), self.rows(self.live))
+
+    def test_incremental_round_trip(self):
+        for compress in (False, True):
+            full = self.backup(compress=compress)
+            self.write("UPDATE staff SET name = 'changed' WHERE rowid = 1",
+                       *[f"INSERT INTO staff VALUES ('{i}')" for i in range(300)])
+            snapshot = self.backup(incremental=True, compress=compress, verify=True)
+            self.assertEqual((snapshot['kind'], snapshot['base']), ('incremental', full['manifest']))
+            self.assertLess(snapshot['pages_written'], snapshot['page_count'])
+            self.assertEqual(self.rows(self.restored(snapshot)), self.rows(self.live))
+            # The full backup still restores the database as it was
+            self.assertNotEqual(self.rows(self.restored(full)), self.rows(self.live))
+
+    def test_incremental_without_full_backup_is_full(self):
+        self.assertEqual(self.backup(incremental=True)['kind'], 'full')
+
+    def test_restore_checks_the_checksum(self):
+        self.backup()
+        self.write("UPDATE staff SET name = 'changed' WHERE rowid = 1")
+        snapshot = self.backup(incremental=True)
+        with open(os.path.join(self.backups, snapshot['file']), 'r+b') as file:
+            file.seek(backup.PAGE_NUMBER.size + 100)
+            file.write(b'corrupt')
+        with self.assertRaises(backup.BackupError):
+            self.restored(snapshot)
+
+    def test_command_restores_to_a_new_path(self):
+        manifest = self.backup()
+        target = os.path.join(self.directory, 'restored.sqlite3')
+        out = io.StringIO()
+        call_command('backup_database', restore=manifest['manifest'], to=target, output=self.backups, stdout=out)
+        self.assertIn('Restored default', out.getvalue())
+        self.assertEqual(self.rows(target), self.rows(self.live))
+        with self.assertRaises(CommandError):
+            call_command('backup_database', restore=manifest['manifest'], to=target, output=self.backups)
+
+
+class LargeTableAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = CustomUser.objects.create_superuser(username='staff', email='staff@example.com', password='x')
+        cls.jobs = [jobs.enqueue(succeeding_task, index) for index in range(5)]
+
+    def setUp(self):
+        self.client.force_login(self.staff)
+        self.enterContext(mock.patch.object(JobAdmin, 'list_per_page', 2))
+
+    def changelist(self, **params):
+        response = self.client.get('/admin/employees/job/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.context['cl']
+
+    def test_cursor_pages_newest_first(self):
+        ids = [job.pk for job in reversed(self.jobs)]
+        cl = self.changelist()
+        self.assertEqual([job.pk for job in cl.result_list], ids[:2])
+        self.assertIsNone(cl.first_page_url)
+        self.assertEqual(cl.next_page_url, f'?cursor={ids[1]}')
+        cl = self.changelist(cursor=ids[1])
+        self.assertEqual([job.pk for job in cl.result_list], ids[2:4])
+        self.assertEqual(cl.first_page_url, '?')
+        cl = self.changelist(cursor=ids[3])
+        self.assertEqual([job.pk for job in cl.result_list], ids[4:])
+        self.assertIsNone(cl.next_page_url)
+
+    def test_unfiltered_count_is_the_id_range(self):
+        self.jobs[2].delete()
+        cl = self.changelist()
+        self.assertTrue(cl.paginator.estimated)
+        self.assertEqual(cl.result_count, 5)
+        self.assertContains(self.client.get('/admin/employees/job/'), 'About 5')
+
+    def test_filtered_count_is_capped(self):
+        with mock.patch('employees.admin.COUNT_LIMIT', 3):
+            cl = self.changelist(status='queued')
+            self.assertFalse(cl.paginator.estimated)
+            self.assertTrue(cl.paginator.capped)
+            self.assertEqual(cl.result_count, 3)
+            self.assertContains(self.client.get('/admin/employees/job/', {'status': 'queued'}), 'More than 3')
+            cl = self.changelist(status='failed')
+            self.assertEqual((cl.result_count, cl.paginator.capped), (0, False))
+
+    def test_search_by_id(self):
+        cl = self.changelist(q=str(self.jobs[1].pk))
+        self.assertEqual(list(cl.result_list), [self.jobs[1]])
+        self.assertEqual(cl.result_count, 1)
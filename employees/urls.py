@@ -4,13 +4,15 @@ from .views import (
     change_password_view, profile_view, recent_activity_view,
     dashboard_view, form_design_view, form_design_edit_view,
     employee_create_view, employee_list_view, employee_detail_view,
-    employee_delete_view, ajax_save_field_order, ajax_delete_field
+    employee_delete_view, ajax_save_field_order, ajax_delete_field,
+    ajax_employee_rows, ajax_field_suggest, activity_stream_view
 )
 
 
 urlpatterns = [
     path('', dashboard_view, name='dashboard'),
     path('recent-activity/', recent_activity_view, name='recent_activity'),
+    path('recent-activity/stream/', activity_stream_view, name='activity_stream'),
     path('login/', login_view, name='login'),
     path('register/', register_view, name='register'),
     path('logout/', logout_view, name='logout'),
@@ -30,5 +32,7 @@ urlpatterns = [
     # AJAX Endpoints
     path('ajax/save-field-order/', ajax_save_field_order, name='ajax_save_field_order'),
     path('ajax/delete-field/<int:field_id>/', ajax_delete_field, name='ajax_delete_field'),
+    path('ajax/employees/', ajax_employee_rows, name='ajax_employee_rows'),
+    path('ajax/fields/<int:field_id>/suggest/', ajax_field_suggest, name='ajax_field_suggest'),
 
 ]
\ No newline at end of file
@@ -1,14 +1,29 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.http import require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from .models import FormTemplate, FormField, Employee, EmployeeData
-from django.db.models import Q
+from django.db.models import Q, Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 from django.core.paginator import Paginator
 from .forms import CustomUserCreationForm, CustomPasswordChangeForm, ProfileUpdateForm, FormTemplateForm, FormFieldForm
+from .images import schedule_thumbnails
+from .events import broker
+from .activity import feed_page as activity_feed_page, decode_cursor, PAGE_SIZE as ACTIVITY_PAGE_SIZE
+from .deletion import delete_employee, delete_field
+from .validation import TemplateValidator
+from .dictionary import search_expression as dictionary_search_expression
+from .suggest import suggest, suggestible
+from .storage import (
+    uses_document, write_values, field_rows, value_count_expression, value_search_expression,
+)
+import asyncio
 import json
+import time
 
 def register_view(request):
     if request.method == 'POST':
@@ -55,7 +70,13 @@ def profile_view(request):
     if request.method == 'POST':
         form = ProfileUpdateForm(request.POST, request.FILES, instance=request.user)
         if form.is_valid():
-            form.save()
+            user = form.save(commit=False)
+            if 'profile_picture' in form.changed_data:
+                # Serve the original until the new thumbnails are ready
+                user.profile_picture_hash = ''
+            user.save()
+            if 'profile_picture' in form.changed_data:
+                schedule_thumbnails(user)
             return redirect('profile')
     else:
         form = ProfileUpdateForm(instance=request.user)
@@ -73,21 +94,47 @@ def dashboard_view(request):
 
 @login_required
 def recent_activity_view(request):
-    # Get recent form creations
-    recent_forms = FormTemplate.objects.filter(
-        created_by=request.user
-    ).order_by('-created_at')[:5]
-    
-    # Get recent employee additions
-    recent_employees = Employee.objects.filter(
-        created_by=request.user
-    ).order_by('-created_at')[:5]
-    
+    entries, next_cursor = activity_feed_page(request.user, decode_cursor(request.GET.get('before')))
     return render(request, 'employees/recent_activity.html', {
-        'recent_forms': recent_forms,
-        'recent_employees': recent_employees
+        'entries': entries,
+        'next_cursor': next_cursor,
+        'is_first_page': 'before' not in request.GET,
+        'live_updates': 'before' not in request.GET and isinstance(request, ASGIRequest),
+        'page_size': ACTIVITY_PAGE_SIZE,
     })
 
+@login_required
+async def activity_stream_view(request):
+    """
+    Server-Sent Events stream of new forms and employees for the current
+    user. Needs an ASGI server (employee_portal.asgi): under WSGI the
+    endless stream would be buffered whole and hold a worker forever, so it
+    is refused there.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'The activity stream needs an ASGI server'}, status=501)
+    user = await request.auser()
+    subscription = broker.subscribe(user.pk)
+    heartbeat = getattr(settings, 'ACTIVITY_STREAM_HEARTBEAT', 15)
+    
+    async def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscription.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    yield ': ping\n\n'
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+    
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @login_required
 def form_design_view(request):
     if request.method == 'POST':
@@ -127,28 +174,34 @@ def form_design_edit_view(request, template_id):
 @login_required
 def employee_create_view(request, template_id):
     template = get_object_or_404(FormTemplate, id=template_id)
-    fields = template.fields.all()
+    fields = list(template.fields.all())
     
     if request.method == 'POST':
-        employee = Employee.objects.create(form_template=template, created_by=request.user)
+        submitted = {field.id: request.POST.get(f'field_{field.id}', '') for field in fields}
+        values, errors = TemplateValidator(fields).validate(submitted)
+        if not errors:
+            employee = Employee.objects.create(form_template=template, created_by=request.user)
+            write_values(employee, values)
+            return redirect('employee_list')
         
         for field in fields:
-            value = request.POST.get(f'field_{field.id}')
-            if value:
-                EmployeeData.objects.create(
-                    employee=employee,
-                    field=field,
-                    value=value
-                )
-        
-        return redirect('employee_list')
+            field.submitted = submitted[field.id]
+            field.error = errors.get(field.id)
     
     return render(request, 'employees/employee_create.html', {'template': template, 'fields': fields})
 
-@login_required
-def employee_list_view(request):
-    employees = Employee.objects.filter(created_by=request.user).select_related('form_template')
-    templates = FormTemplate.objects.filter(created_by=request.user)
+def _filter_employees(request):
+    if uses_document():
+        data_count = value_count_expression()
+    else:
+        data_count = Coalesce(Subquery(
+            EmployeeData.objects.filter(
+                employee=OuterRef('pk')
+            ).order_by().values('employee').annotate(c=Count('id')).values('c')
+        ), 0)
+    employees = Employee.objects.filter(created_by=request.user).select_related('form_template').annotate(
+        data_count=data_count
+    ).order_by('id')
     
     # template filter
     template_filter = request.GET.get('template')
@@ -159,15 +212,27 @@ def employee_list_view(request):
     search_query = request.GET.get('search')
     if search_query:
         # Search in both employee data and ID
-        employees = employees.filter(
-            Q(data__value__icontains=search_query) |
-            Q(id__icontains=search_query)
-        ).distinct()
+        if uses_document():
+            employees = employees.filter(
+                Q(value_search_expression(search_query)) |
+                Q(id__icontains=search_query)
+            )
+        else:
+            employees = employees.filter(
+                Q(data__value__icontains=search_query) |
+                Q(dictionary_search_expression(search_query)) |
+                Q(id__icontains=search_query)
+            ).distinct()
     
     # pagination
     paginator = Paginator(employees, 10)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginator.get_page(request.GET.get('page'))
+    return page_obj, template_filter, search_query
+
+@login_required
+def employee_list_view(request):
+    page_obj, template_filter, search_query = _filter_employees(request)
+    templates = FormTemplate.objects.filter(created_by=request.user)
     
     return render(request, 'employees/employee_list.html', {
         'employees': page_obj,
@@ -177,18 +242,66 @@ def employee_list_view(request):
         'page_obj': page_obj,
     })
 
+@login_required
+@require_http_methods(['GET'])
+def ajax_employee_rows(request):
+    """
+    Only the matching rows of the employee list, either as the pre-rendered
+    table fragment (default) or as compact JSON with ``?format=json``.
+    ``seq`` is echoed back so the client can drop stale responses.
+    """
+    started = time.perf_counter()
+    page_obj, template_filter, search_query = _filter_employees(request)
+    seq = request.GET.get('seq')
+    
+    if request.GET.get('format') == 'json':
+        response = JsonResponse({
+            'seq': seq,
+            'page': page_obj.number,
+            'num_pages': page_obj.paginator.num_pages,
+            'count': page_obj.paginator.count,
+            'columns': ['id', 'form_template', 'fields', 'created_at'],
+            'rows': [
+                [e.id, e.form_template.name, e.data_count, e.created_at.isoformat()]
+                for e in page_obj
+            ],
+        }, json_dumps_params={'separators': (',', ':')})
+    else:
+        templates = FormTemplate.objects.filter(created_by=request.user)
+        response = render(request, 'employees/employee_table.html', {
+            'employees': page_obj,
+            'templates': templates,
+            'template_filter': template_filter,
+            'search_query': search_query,
+            'page_obj': page_obj,
+        })
+        if seq is not None:
+            response['X-Request-Seq'] = seq
+    
+    response['Cache-Control'] = 'private, no-store'
+    response['Server-Timing'] = f'render;dur={(time.perf_counter() - started) * 1000:.1f}'
+    return response
+
 @login_required
 def employee_detail_view(request, employee_id):
-    employee = get_object_or_404(Employee, id=employee_id, created_by=request.user)
-    return render(request, 'employees/employee_detail.html', {'employee': employee})
+    employee = get_object_or_404(
+        Employee.objects.select_related('form_template', 'created_by'), id=employee_id, created_by=request.user
+    )
+    return render(request, 'employees/employee_detail.html', {
+        'employee': employee,
+        'field_rows': field_rows(employee),
+    })
 
 @login_required
 def employee_delete_view(request, employee_id):
     employee = get_object_or_404(Employee, id=employee_id, created_by=request.user)
     if request.method == 'POST':
-        employee.delete()
+        delete_employee(employee)
         return redirect('employee_list')
-    return render(request, 'employees/employee_delete.html', {'employee': employee})
+    return render(request, 'employees/employee_delete.html', {
+        'employee': employee,
+        'field_rows': field_rows(employee),
+    })
 
 # AJAX views
 @login_required
@@ -200,7 +313,7 @@ def ajax_save_field_order(request):
         for item in data:
             field = FormField.objects.get(id=item['id'], form_template__created_by=request.user)
             field.order = item['order']
-            field.save()
+            field.save(update_fields=['order'])
         return JsonResponse({'status': 'success'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
@@ -211,9 +324,20 @@ def ajax_save_field_order(request):
 def ajax_delete_field(request, field_id):
     try:
         field = FormField.objects.get(id=field_id, form_template__created_by=request.user)
-        field.delete()
+        delete_field(field, user=request.user)
         return JsonResponse({'status': 'success'})
     except Exception as e:
         return JsonResponse({'status': 'error', 'message': str(e)}, status=400)
+
+
+@login_required
+@require_http_methods(['GET'])
+def ajax_field_suggest(request, field_id):
+    """Completions for a field of the employee form; ``seq`` is echoed back like in ajax_employee_rows."""
+    field = get_object_or_404(FormField, id=field_id, form_template__created_by=request.user)
+    if not suggestible(field):
+        return JsonResponse({'status': 'error', 'message': 'No suggestions for this field'}, status=400)
+    values = suggest(field, request.GET.get('prefix', ''))
+    return JsonResponse({'seq': request.GET.get('seq'), 'suggestions': [value for value, _ in values]})
     
 